@@ -0,0 +1,627 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+geoip_check.py 的离线基准测试。
+
+在本机启动一个替身 HTTP(S) 服务器，按 Host 头模拟各个被检测站点的行为
+（cdn-cgi/trace、Netflix 地区跳转、Amazon 国别域名跳转、brotli/gzip 压缩的 Google / YouTube 页面、
+Disney+ 的 physical-location 头、慢速与失败的主机等），
+通过 GeoIPChecker 的 host_overrides 把所有请求改发到替身服务器，
+测量 run_all_checks 与各单项检查在不同引擎、不同并发度下的延迟分位数、吞吐、CPU 与峰值 RSS，
+以及全新解释器中导入 geoip_check 的冷启动耗时，和长时间重复检测时常驻内存是否有界。
+
+每个场景在独立子进程中运行，峰值 RSS 互不影响。
+
+用法：
+    python geoip_bench.py                                # 默认：async/thread 引擎 × 并发 1,4,16
+    python geoip_bench.py --engines async --concurrency 1 8 32 --runs 64
+    python geoip_bench.py --rtt 20 --slow web.telegram.org=0.5 --json bench.json
+    python geoip_bench.py --import-only --import-budget 150     # cron / CI 的冷启动门禁
+    python geoip_bench.py --runs 0 --check-runs 0 --fleet-targets 64 --fleet-processes 1 2 4 8
+    python geoip_bench.py --runs 0 --check-runs 5 --rss-budget 2 --soak-runs 200 --rss-growth-budget 8   # 内存门禁
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gzip
+import http.server
+import json
+import os
+import random
+import resource
+import socket
+import socketserver
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 替身服务器返回的公网 / DNS IP（文档保留地址）
+PUBLIC_IP = '203.0.113.7'
+DNS_IP = '198.51.100.53'
+
+
+# ---------------------------------------------------------------------------
+# 替身页面
+# ---------------------------------------------------------------------------
+def _filler(blocks: int, seed: int = 0) -> str:
+    """生成体积接近真实页面的 HTML 填充（脚本、菜单、正文段落），内容固定以便结果可复现"""
+    rng = random.Random(seed)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'Images', 'Gmail']
+    parts = []
+    for i in range(blocks):
+        text = ' '.join(rng.choice(words) for _ in range(60))
+        parts.append(f'<div class="c{i}"><script>var s{i}="{text}";</script>'
+                     f'<a href="/x{i}">Sign in</a><p>{text}</p></div>')
+    return ''.join(parts)
+
+
+def _cdn_trace(loc: str) -> bytes:
+    return (f'fl=28f1\nh=www.cloudflare.com\nip={PUBLIC_IP}\nts={time.time():.3f}\nvisit_scheme=https\n'
+            f'uag=Mozilla/5.0\ncolo=HKG\nsliver=none\nhttp=http/1.1\nloc={loc}\ntls=TLSv1.3\n'
+            f'sni=plaintext\nwarp=off\ngateway=off\nrbi=off\nkex=X25519\n').encode()
+
+
+class StandInPages:
+    """各替身站点的静态内容（启动时生成并预先压缩一次）"""
+
+    def __init__(self, loc: str = 'HK'):
+        self.loc = loc
+        # Google 首页约 200KB，国家名在页面底部
+        google = ('<html><head><title>Google</title></head><body>' + _filler(300, 1) +
+                  '<div class="footer"><span>香港</span><span>隱私權</span></div></body></html>')
+        # YouTube Premium 页面约 600KB，价格在页面靠前位置
+        youtube = ('<html><body><div>Get YouTube Premium</div><span>HK$78.00/月</span>' +
+                   _filler(900, 2) + '</body></html>')
+        self.html = {'www.google.com.hk': google.encode(), 'www.youtube.com': youtube.encode()}
+        self.gzip = {host: gzip.compress(body, 6) for host, body in self.html.items()}
+        self.brotli = {host: brotli.compress(body) for host, body in self.html.items()} if brotli else {}
+        self.dns_page = (f'<html><body>Your IP Address: {PUBLIC_IP}<br>'
+                         f'Your Local DNS Server: {DNS_IP}<br></body></html>').encode()
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """按 Host 头分派到各站点的模拟逻辑"""
+    protocol_version = 'HTTP/1.1'
+    server_version = 'standin'
+    # 响应头与正文分两次写出，关闭 Nagle 避免与客户端延迟 ACK 叠加出 40ms 的假延迟
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._dispatch(head=True)
+
+    def do_GET(self):
+        self._dispatch(head=False)
+
+    def _reply(self, status: int, body: bytes = b'', headers: Optional[Dict[str, str]] = None, head: bool = False):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head and body:
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端提前停止读取（流式扫描命中后关闭连接）
+                self.close_connection = True
+
+    def _html(self, host: str, head: bool):
+        pages = self.server.pages
+        accept = self.headers.get('Accept-Encoding', '')
+        if 'br' in accept and host in pages.brotli:
+            body, encoding = pages.brotli[host], 'br'
+        elif 'gzip' in accept:
+            body, encoding = pages.gzip[host], 'gzip'
+        else:
+            body, encoding = pages.html[host], None
+        headers = {'Content-Type': 'text/html; charset=utf-8'}
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        self._reply(200, body, headers, head)
+
+    def _redirects(self, path: str, head: bool):
+        """
+        重定向场景（测试用）：/loop 指回自身；/ping ⇄ /pong 互相跳转；
+        /login 没有 session Cookie 时跳到 /auth，/auth 设置 Cookie 后跳回 /login（A→B→A 的登录往返）；
+        /hops/<n> 以相对 Location 逐跳递减，/hops/0 返回 200。
+        """
+        if path == '/loop':
+            self._reply(302, headers={'Location': '/loop'}, head=head)
+        elif path in ('/ping', '/pong'):
+            self._reply(302, headers={'Location': 'https://redirect.standin' + ('/pong' if path == '/ping' else '/ping')},
+                        head=head)
+        elif path == '/login' and 'session=' not in (self.headers.get('Cookie') or ''):
+            self._reply(302, headers={'Location': '/auth'}, head=head)
+        elif path == '/auth':
+            self._reply(302, headers={'Location': '/login', 'Set-Cookie': 'session=1; Path=/'}, head=head)
+        elif path.startswith('/hops/') and path[6:].isdigit() and int(path[6:]) > 0:
+            self._reply(302, headers={'Location': str(int(path[6:]) - 1)}, head=head)
+        else:
+            self._reply(200, b'<html><body>landed</body></html>', {'Content-Type': 'text/html'}, head)
+
+    def _dispatch(self, head: bool):
+        host = (self.headers.get('Host') or '').split(':')[0].lower()
+        # 兼容代理形式的绝对 URL 请求行（fleet 场景把替身服务器同时当作 HTTP 代理）
+        path = urllib.parse.urlsplit(self.path).path
+        config = self.server.config
+        delay = config['rtt'] + config['slow'].get(host, 0.0)
+        if delay:
+            time.sleep(delay)
+        if host in config['fail']:
+            # 失败主机：不返回任何响应直接断开
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        loc = self.server.pages.loc
+        pages = self.server.pages
+
+        if path == '/cdn-cgi/trace' and host in ('www.cloudflare.com', 'chat.openai.com', 'chatgpt.com'):
+            self._reply(200, _cdn_trace(loc), {'Content-Type': 'text/plain'}, head)
+        elif host.endswith('nstool.onmyojigame.com'):
+            self._reply(200, pages.dns_page, {'Content-Type': 'text/html'}, head)
+        elif host == 'api.country.is':
+            ip = path.strip('/')
+            self._reply(200, json.dumps({'ip': ip, 'country': loc}).encode(), {'Content-Type': 'application/json'}, head)
+        elif host == 'www.netflix.com':
+            if path.startswith('/title/'):
+                # 地区跳转：/title/<id> → /<region>/title/<id>
+                self._reply(302, headers={'Location': f'https://www.netflix.com/{loc.lower()}-en{path}',
+                                          'Set-Cookie': 'nfvdid=BQFmAAEBE; Path=/'}, head=head)
+            else:
+                self._reply(200, b'<html><body>House of Cards</body></html>', {'Content-Type': 'text/html'}, head)
+        elif host in ('www.youtube.com', 'www.google.com.hk'):
+            self._html(host, head)
+        elif host == 'www.amazon.com':
+            # 国别域名跳转
+            self._reply(301, headers={'Location': 'https://www.amazon.co.jp/'}, head=head)
+        elif host.startswith('www.amazon.'):
+            self._reply(200, b'<html><body>Amazon</body></html>' * 200, {'Content-Type': 'text/html'}, head)
+        elif host == 'www.disneyplus.com':
+            self._reply(200, b'<html><body>Disney+</body></html>',
+                        {'Content-Type': 'text/html', 'physical-location': loc}, head)
+        elif host == 'www.tiktok.com' and head:
+            # 拒绝 HEAD，触发 probe 的流式 GET 回退
+            self._reply(405, head=True)
+        elif host == 'www.facebook.com':
+            # 主端点 503，迫使检查走备用端点（并触发重试）
+            self._reply(503, b'unavailable', head=head)
+        elif host == 'redirect.standin':
+            self._redirects(path, head)
+        else:
+            self._reply(200, b'<html><body>ok</body></html>' * 1000, {'Content-Type': 'text/html'}, head)
+
+
+class StandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 512
+
+    def handle_error(self, request, client_address):
+        # 客户端提前关闭连接（流式扫描命中、probe 丢弃正文）属于正常情况
+        if not isinstance(sys.exc_info()[1], (ConnectionError, ssl.SSLError)):
+            super().handle_error(request, client_address)
+
+
+def start_standin(config: Dict[str, Any], loc: str = 'HK', certfile: Optional[str] = None,
+                  keyfile: Optional[str] = None) -> StandInServer:
+    """在后台线程启动替身服务器（端口 0 表示自动分配），返回服务器对象"""
+    server = StandInServer(('127.0.0.1', config.get('port', 0)), StandInHandler)
+    server.config = config
+    server.pages = StandInPages(loc)
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, name='standin', daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# 场景（在子进程中运行）
+# ---------------------------------------------------------------------------
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    """最近秩分位数（毫秒）"""
+    if not samples:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    ordered = sorted(samples)
+
+    def rank(q):
+        return round(ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))] * 1000, 2)
+
+    return {'p50': rank(0.5), 'p90': rank(0.9), 'p99': rank(0.99), 'max': round(ordered[-1] * 1000, 2)}
+
+
+def _peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 单位为 KB，macOS 为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _new_checker(spec: Dict[str, Any], **kwargs):
+    import geoip_check
+    checker = geoip_check.GeoIPChecker(timeout=spec['timeout'], tmp_dir=spec['tmp_dir'],
+                                       host_overrides={'*': spec['target']}, **kwargs)
+    if spec.get('verify') is not None:
+        checker.session.verify = spec['verify']
+    checker.stream_html = not spec.get('soup')
+    return checker
+
+
+def run_suite_scenario(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    完整检测场景：concurrency 个 worker 各持有一个 GeoIPChecker（共享线程池），
+    共执行 runs 次 run_all_checks；每个 worker 先预热一次，不计入统计。
+    """
+    engine, concurrency, runs = spec['engine'], spec['concurrency'], spec['runs']
+    executor = ThreadPoolExecutor(max_workers=max(32, concurrency * 4), thread_name_prefix='bench')
+    checkers = [_new_checker(spec, executor=executor) for _ in range(concurrency)]
+    latencies = []
+    services = len(checkers[0].check_table())
+
+    def run_once(checker):
+        started = time.perf_counter()
+        if engine == 'thread':
+            checker._run_checks_threaded()
+        else:
+            asyncio.run(checker.run_all_checks_async())
+        latencies.append(time.perf_counter() - started)
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        # 预热：建立连接池、加载国家库与 CIDR 索引
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run_once, checkers))
+        latencies.clear()
+        remaining = iter(range(runs))
+        lock = threading.Lock()
+
+        def worker(checker):
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                run_once(checker)
+
+        cpu, wall = time.process_time(), time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, checkers))
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    for checker in checkers:
+        checker.close()
+    executor.shutdown(wait=False)
+    return {
+        'scenario': 'suite', 'engine': engine, 'concurrency': concurrency, 'runs': runs,
+        'latency_ms': _percentiles(latencies),
+        'runs_per_s': round(runs / wall, 2),
+        'checks_per_s': round(runs * services / wall, 2),
+        'cpu_ms_per_run': round(cpu * 1000 / runs, 2),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def run_checks_scenario(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    单项检查场景：每个检查顺序执行 runs 次，记录延迟分位数、CPU、分阶段耗时摘要，
+    以及该检查预热后的重复执行使峰值 RSS 抬高了多少（rss_growth_mb；正文未及时释放时会持续上涨）。
+    """
+    checker = _new_checker(spec)
+    results = {}
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        for service, func in checker.check_table().items():
+            checker._run_one_traced(service, func)  # 预热（首次导入的模块、建立的连接不计入）
+            latencies, cpu = [], 0.0
+            peak = _peak_rss_mb()
+            for _ in range(spec['runs']):
+                started, cpu_start = time.perf_counter(), time.thread_time()
+                checker._run_one_traced(service, func)
+                cpu += time.thread_time() - cpu_start
+                latencies.append(time.perf_counter() - started)
+            results[service] = {'latency_ms': _percentiles(latencies),
+                                'cpu_ms': round(cpu * 1000 / spec['runs'], 3),
+                                'rss_growth_mb': round(_peak_rss_mb() - peak, 1)}
+    phases = checker.metrics.summary()['checks']
+    for service, entry in results.items():
+        entry['phases_ms'] = {phase: round(stats['sum'] * 1000 / stats['count'], 3)
+                              for phase, stats in phases.get(service, {}).get('phases', {}).items()}
+    checker.close()
+    return {'scenario': 'checks', 'runs': spec['runs'], 'checks': results, 'peak_rss_mb': _peak_rss_mb()}
+
+
+# 长跑场景中不计入内存增长的预热次数
+SOAK_WARMUP = 20
+
+
+def run_soak_scenario(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    长跑场景：同一个 GeoIPChecker 连续执行 runs 次 run_all_checks，结果写入容量为 history 的 ResultHistory
+    （与 --monitor 守护进程相同），记录预热后常驻内存的变化；内存有界时 rss_growth_mb 应接近 0。
+    预热的 SOAK_WARMUP 次让线程池涨满、各线程的 malloc arena 分配到位，不计入增长。
+    """
+    import geoip_check
+    checker = _new_checker(spec)
+    history = geoip_check.ResultHistory(spec['history'])
+    samples = []
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        for _ in range(SOAK_WARMUP + spec['runs']):
+            results = asyncio.run(checker.run_all_checks_async(refresh=True))
+            for service, result in results.items():
+                history.append(service, result)
+            del results
+            samples.append(geoip_check.current_rss_bytes() / (1024 * 1024))
+    checker.close()
+    baseline = samples[SOAK_WARMUP - 1]
+    samples = samples[SOAK_WARMUP:]
+    return {
+        'scenario': 'soak', 'runs': spec['runs'], 'history': spec['history'], 'history_entries': len(history),
+        'rss_start_mb': round(baseline, 1), 'rss_end_mb': round(samples[-1], 1),
+        'rss_growth_mb': round(samples[-1] - baseline, 1), 'rss_max_mb': round(max(samples), 1),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+class _LineCounter:
+    """只统计行数的输出流（fleet 场景丢弃结果正文）"""
+
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, text: str):
+        self.lines += text.count('\n')
+
+    def flush(self):
+        pass
+
+
+def run_fleet_scenario(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    多进程 fleet 场景：替身服务器同时充当 HTTP 代理，targets 个出口经 run_fleet_sharded
+    分给 processes 个工作进程，记录吞吐与工作进程的峰值 RSS。
+    """
+    import geoip_check
+    out = _LineCounter()
+    wall = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        geoip_check.run_fleet_sharded([spec['target']] * spec['targets'], out=out, processes=spec['processes'],
+                                      recycle_after=spec['recycle_after'], concurrency=spec['concurrency'],
+                                      per_proxy=4, timeout=spec['timeout'], tmp_dir=spec['tmp_dir'],
+                                      dump_every=0, host_overrides={'*': spec['target']})
+    wall = time.perf_counter() - wall
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'scenario': 'fleet', 'processes': spec['processes'], 'targets': spec['targets'], 'completed': out.lines,
+        'targets_per_s': round(out.lines / wall, 2),
+        'cpu_ms_per_target': round((children.ru_utime + children.ru_stime) * 1000 / max(1, out.lines), 2),
+        'worker_peak_rss_mb': round(children.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+    }
+
+
+# 导入 geoip_check 时不应加载的重型依赖（geoip_check 在用到时才延迟导入）
+LAZY_MODULES = ('numpy', 'bs4', 'asyncio', 'sqlite3', 'http.server', 'requests', 'urllib3', 'geoip_http')
+_IMPORT_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import geoip_check
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed * 1000, [m for m in %s if m in sys.modules]]))
+''' % json.dumps(LAZY_MODULES)
+
+
+def measure_import(runs: int = 7) -> Dict[str, Any]:
+    """
+    在全新的解释器中反复导入 geoip_check，测量冷启动开销：
+    import_ms 为 import 语句本身的耗时，process_ms 为解释器启动到退出的总耗时（均取中位数）。
+
+    实际部署时字节码已缓存，因此先预热一个临时的 pycache 目录再计时；否则在
+    PYTHONDONTWRITEBYTECODE 环境下每次都要重新编译 geoip_check.py，测到的是编译耗时。
+    """
+    imports, processes, loaded = [], [], set()
+    with tempfile.TemporaryDirectory() as pycache:
+        env = {k: v for k, v in os.environ.items() if k != 'PYTHONDONTWRITEBYTECODE'}
+        env['PYTHONPYCACHEPREFIX'] = pycache
+        for attempt in range(runs + 1):
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable, '-c', _IMPORT_PROBE], capture_output=True, text=True,
+                                  cwd=SCRIPT_DIR, env=env, check=True)
+            elapsed = time.perf_counter() - start
+            if attempt == 0:
+                continue  # 预热轮：写入字节码，不计入结果
+            processes.append(elapsed)
+            import_ms, modules = json.loads(proc.stdout.strip().splitlines()[-1])
+            imports.append(import_ms / 1000)
+            loaded.update(modules)
+    return {
+        'runs': runs,
+        'import_ms': _percentiles(imports)['p50'],
+        'process_ms': _percentiles(processes)['p50'],
+        'eager_heavy_modules': sorted(loaded),
+    }
+
+
+def _run_in_subprocess(spec: Dict[str, Any]) -> Dict[str, Any]:
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--scenario', json.dumps(spec)],
+                          capture_output=True, text=True, cwd=SCRIPT_DIR)
+    if proc.returncode != 0:
+        raise RuntimeError(f"场景执行失败: {spec}\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+# ---------------------------------------------------------------------------
+# 报告
+# ---------------------------------------------------------------------------
+def print_import(result: Dict[str, Any], budget: Optional[float] = None):
+    limit = f"  (预算 {budget}ms)" if budget else ''
+    print(f"冷启动: import {result['import_ms']}ms, 进程 {result['process_ms']}ms{limit}")
+    if result['eager_heavy_modules']:
+        print(f"  导入时加载了应延迟导入的模块: {', '.join(result['eager_heavy_modules'])}")
+
+
+def print_fleet(rows: List[Dict[str, Any]]):
+    base = rows[0]['targets_per_s'] / rows[0]['processes'] if rows and rows[0]['targets_per_s'] else None
+    print(f"{'procs':<8}{'targets':>8}{'done':>6}{'targets/s':>11}{'scaling':>9}{'cpu ms/target':>15}{'worker RSS MB':>15}")
+    for row in rows:
+        # 相对单进程吞吐的线性扩展比例
+        scaling = round(row['targets_per_s'] / (base * row['processes']), 2) if base else '-'
+        print(f"{row['processes']:<8}{row['targets']:>8}{row['completed']:>6}{row['targets_per_s']:>11}{scaling:>9}"
+              f"{row['cpu_ms_per_target']:>15}{row['worker_peak_rss_mb']:>15}")
+
+
+def print_suite(rows: List[Dict[str, Any]]):
+    print(f"{'engine':<8}{'conc':>6}{'runs':>6}{'p50ms':>10}{'p90ms':>10}{'p99ms':>10}"
+          f"{'runs/s':>9}{'checks/s':>10}{'cpu ms/run':>12}{'RSS MB':>9}")
+    for row in rows:
+        lat = row['latency_ms']
+        print(f"{row['engine']:<8}{row['concurrency']:>6}{row['runs']:>6}{lat['p50']:>10}{lat['p90']:>10}"
+              f"{lat['p99']:>10}{row['runs_per_s']:>9}{row['checks_per_s']:>10}{row['cpu_ms_per_run']:>12}"
+              f"{row['peak_rss_mb']:>9}")
+
+
+def print_checks(report: Dict[str, Any]):
+    print(f"{'check':<12}{'p50ms':>10}{'p90ms':>10}{'p99ms':>10}{'cpu ms':>10}{'+RSS MB':>9}  phases (mean ms)")
+    for service, entry in report['checks'].items():
+        lat = entry['latency_ms']
+        phases = ' '.join(f"{k}={v}" for k, v in entry['phases_ms'].items() if k != 'total')
+        print(f"{service:<12}{lat['p50']:>10}{lat['p90']:>10}{lat['p99']:>10}{entry['cpu_ms']:>10}"
+              f"{entry['rss_growth_mb']:>9}  {phases}")
+
+
+def print_soak(result: Dict[str, Any]):
+    print(f"长跑: {result['runs']} 次完整检测, 历史 {result['history_entries']} 条 (容量 {result['history']}/检查), "
+          f"RSS {result['rss_start_mb']}MB -> {result['rss_end_mb']}MB (增长 {result['rss_growth_mb']}MB, "
+          f"最高 {result['rss_max_mb']}MB)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='geoip_check 离线基准测试（本地替身服务器）')
+    parser.add_argument('--engines', nargs='+', choices=['async', 'thread'], default=['async', 'thread'])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16], help='同时在途的完整检测数')
+    parser.add_argument('--runs', type=int, default=32, help='每个场景的完整检测次数（0 表示跳过）')
+    parser.add_argument('--check-runs', type=int, default=20, help='单项检查的重复次数（0 表示跳过）')
+    parser.add_argument('--timeout', type=float, default=1, help='GeoIPChecker 请求超时（秒）')
+    parser.add_argument('--rtt', type=float, default=0, help='替身服务器对每个请求附加的延迟（毫秒）')
+    parser.add_argument('--slow', action='append', default=['web.telegram.org=0.2'], metavar='HOST=SECONDS',
+                        help='慢速主机的额外延迟（可重复）')
+    parser.add_argument('--fail', action='append', default=['graph.facebook.com'], metavar='HOST',
+                        help='直接断开连接的主机（可重复）')
+    parser.add_argument('--loc', default='HK', help='替身站点返回的国家 / 地区代码')
+    parser.add_argument('--soup', action='store_true', help='YouTube / Google 使用 BeautifulSoup 整页解析')
+    parser.add_argument('--tls-cert', help='以 HTTPS 提供替身服务（证书需包含 IP:127.0.0.1）')
+    parser.add_argument('--tls-key', help='--tls-cert 对应的私钥')
+    parser.add_argument('--json', metavar='FILE', help='同时把完整结果写入 JSON 文件')
+    parser.add_argument('--fleet-targets', type=int, default=0,
+                        help='多进程 fleet 场景的出口数（0 表示跳过；仅支持 HTTP 替身服务）')
+    parser.add_argument('--fleet-processes', nargs='+', type=int, default=[1, 2, 4], help='fleet 场景的工作进程数')
+    parser.add_argument('--recycle-after', type=int, default=50, help='fleet 场景中工作进程的回收间隔（出口数）')
+    parser.add_argument('--import-budget', type=float, metavar='MS',
+                        help='导入 geoip_check 的耗时预算（毫秒）；超出或提前加载了重型依赖时以状态码 1 退出')
+    parser.add_argument('--import-only', action='store_true', help='只测量冷启动导入开销，不运行检测场景')
+    parser.add_argument('--rss-budget', type=float, metavar='MB',
+                        help='单项检查预热后重复执行允许抬高的峰值 RSS（MB）；超出时以状态码 1 退出')
+    parser.add_argument('--soak-runs', type=int, default=0, help='长跑场景的完整检测次数（0 表示跳过）')
+    parser.add_argument('--history', type=int, default=64, help='长跑场景中每个检查保留的历史条数')
+    parser.add_argument('--rss-growth-budget', type=float, metavar='MB',
+                        help='长跑场景预热后允许的常驻内存增长（MB）；超出时以状态码 1 退出')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        spec = json.loads(args.scenario)
+        sys.path.insert(0, SCRIPT_DIR)
+        runner = {'checks': run_checks_scenario, 'fleet': run_fleet_scenario,
+                  'soak': run_soak_scenario}.get(spec['kind'], run_suite_scenario)
+        # 被放弃的对冲 / 竞速请求可能在场景结束后才打印日志，整个子进程的 stdout 都丢弃，结果单独写出
+        out, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        out.write(json.dumps(runner(spec)) + '\n')
+        out.flush()
+        return
+
+    report = {'config': {**vars(args), 'brotli': brotli is not None}, 'import': measure_import(),
+              'suite': [], 'checks': None, 'fleet': [], 'soak': None}
+    print_import(report['import'], args.import_budget)
+    over_budget = bool(report['import']['eager_heavy_modules']) or (
+        args.import_budget is not None and report['import']['import_ms'] > args.import_budget)
+    if args.import_only:
+        _write_report(report, args.json)
+        sys.exit(1 if over_budget else 0)
+
+    config = {
+        'rtt': args.rtt / 1000,
+        'slow': {host: float(sec) for host, _, sec in (s.partition('=') for s in args.slow)},
+        'fail': set(args.fail),
+    }
+    server = start_standin(config, loc=args.loc, certfile=args.tls_cert, keyfile=args.tls_key)
+    scheme = 'https' if args.tls_cert else 'http'
+    base = {
+        'target': f'{scheme}://127.0.0.1:{server.server_address[1]}',
+        'timeout': args.timeout,
+        'tmp_dir': tempfile.mkdtemp(prefix='geoip_bench_'),
+        'verify': args.tls_cert,
+        'soup': args.soup,
+    }
+    print(f"替身服务器: {base['target']}  (brotli: {'yes' if brotli else 'no'}, rtt: {args.rtt}ms)")
+
+    if args.runs:
+        for engine in args.engines:
+            for concurrency in args.concurrency:
+                spec = {**base, 'kind': 'suite', 'engine': engine, 'concurrency': concurrency, 'runs': args.runs}
+                report['suite'].append(_run_in_subprocess(spec))
+        print_suite(report['suite'])
+
+    if args.check_runs:
+        print()
+        report['checks'] = _run_in_subprocess({**base, 'kind': 'checks', 'runs': args.check_runs})
+        print_checks(report['checks'])
+        if args.rss_budget is not None:
+            over = {service: entry['rss_growth_mb'] for service, entry in report['checks']['checks'].items()
+                    if entry['rss_growth_mb'] > args.rss_budget}
+            if over:
+                print(f"  峰值 RSS 增长超出预算 {args.rss_budget}MB: "
+                      f"{', '.join(f'{k}=+{v}MB' for k, v in over.items())}")
+                over_budget = True
+
+    if args.soak_runs:
+        print()
+        report['soak'] = _run_in_subprocess({**base, 'kind': 'soak', 'runs': args.soak_runs,
+                                             'history': args.history})
+        print_soak(report['soak'])
+        if args.rss_growth_budget is not None and report['soak']['rss_growth_mb'] > args.rss_growth_budget:
+            print(f"  常驻内存增长超出预算 {args.rss_growth_budget}MB")
+            over_budget = True
+
+    if args.fleet_targets and not args.tls_cert:
+        print()
+        for processes in args.fleet_processes:
+            spec = {**base, 'kind': 'fleet', 'processes': processes, 'targets': args.fleet_targets,
+                    'recycle_after': args.recycle_after, 'concurrency': 16 * processes}
+            report['fleet'].append(_run_in_subprocess(spec))
+        print_fleet(report['fleet'])
+
+    server.shutdown()
+    _write_report(report, args.json)
+    if over_budget:
+        sys.exit(1)
+
+
+def _write_report(report: Dict[str, Any], path: Optional[str]):
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
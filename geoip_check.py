@@ -1,20 +1,106 @@
-import gzip
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import zlib
+import importlib
+import importlib.util
 try:
     import brotli
+    # brotli < 1.2 无法限制单次解压输出（output_buffer_limit），解压炸弹防护失效，按未安装处理
+    if not hasattr(brotli.Decompressor, 'can_accept_more_data'):
+        brotli = None
 except ImportError:
     brotli = None
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-
-import requests
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 import json
 import re
-from bs4 import BeautifulSoup
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Iterable
 import time
 import base64
 import urllib.parse
 import os
+import functools
+import sys
+import argparse
+import mmap
+import struct
+import ipaddress
+import csv
+import socket
+import bisect
+import codecs
+import queue
+import threading
+import itertools
+import atexit
+import contextvars
+import collections
+import collections.abc
+import array
+import datetime
+import random
+import signal
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from html.parser import HTMLParser
+from types import MappingProxyType
+
+if __name__ in ('__main__', '__mp_main__'):
+    # 以脚本运行（包括 fleet 的 spawn 子进程）时，geoip_http 中的 `from geoip_check import ...` 应拿到本模块，
+    # 而不是再导入一份（否则两份模块的 contextvars 互不相通，连接类读不到当前解析器与追踪）
+    sys.modules.setdefault('geoip_check', sys.modules[__name__])
+
+
+class _LazyModule:
+    """
+    首次访问属性时才导入的模块代理：一次性运行（cron、fleet worker）只为真正用到的依赖付出导入开销。
+    importlib.import_module 自带模块级锁，多线程同时首次访问是安全的。
+    """
+
+    def __init__(self, name: str):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'>"
+
+
+def _lazy_import(name: str) -> Optional[_LazyModule]:
+    """返回延迟导入的模块代理；模块未安装时返回 None（与 try/except ImportError 的约定一致）"""
+    try:
+        found = importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        found = False
+    return _LazyModule(name) if found else None
+
+
+# 启动路径上用不到的重型依赖：numpy 只用于 --bulk，BeautifulSoup 只用于整页解析回退，
+# asyncio 只用于 async 引擎 / fleet / 守护模式，其余只用于结果缓存、调试转储、守护模式与多进程 fleet
+np = _lazy_import('numpy')
+bs4 = _lazy_import('bs4')
+asyncio = _lazy_import('asyncio')
+sqlite3 = _lazy_import('sqlite3')
+gzip = _lazy_import('gzip')
+http_server = _lazy_import('http.server')
+multiprocessing = _lazy_import('multiprocessing')
+mp_connection = _LazyModule('multiprocessing.connection')
+resource = _lazy_import('resource')
+# 必需的依赖同样推迟导入（requests 约占原导入耗时的八成），首次发请求时才加载
+requests = _LazyModule('requests')
+urllib3 = _LazyModule('urllib3')
+# 依赖 requests / urllib3 的类型（可追踪连接、HTTPAdapter、BudgetedRetry 等），随 requests 一起推迟导入
+geoip_http = _LazyModule('geoip_http')
 # ---------------------------------------------------------------------------
 # ISO‑3166 country name → alpha‑2 code master map (common English names)
 # ---------------------------------------------------------------------------
@@ -78,179 +164,2431 @@ ISO_COUNTRIES = {
     'Hong Kong': 'HK', 'Macau': 'MO', 'Åland Islands': 'AX'
 }
 ISO_COUNTRY_LOOKUP = {k.lower(): v for k, v in ISO_COUNTRIES.items()}
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# ---------------------------------------------------------------------------
+# 本地 IP → 国家解析（MaxMind MMDB，mmap 只读映射，无网络）
+# ---------------------------------------------------------------------------
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+GEOLITE2_DIR = os.path.join(SCRIPT_DIR, 'geolite2')
+DEFAULT_MMDB_PATHS = [
+    os.path.join(SCRIPT_DIR, 'geolite2', 'GeoLite2-Country.mmdb'),
+    os.path.join(SCRIPT_DIR, 'output', 'GeoLite2-Country.mmdb'),
+    os.path.join(SCRIPT_DIR, 'output', 'Country.mmdb'),
+]
+
+
+class MMDBReader:
+    """
+    极简 MaxMind DB 读取器：只实现查询国家所需的搜索树遍历与数据段解码。
+    文件通过 mmap 映射，解码后的记录按偏移缓存（国家库只有几百条不同记录），
+    因此单次查询只是 32/128 次节点跳转。
+    """
+    METADATA_MARKER = b'\xab\xcd\xefMaxMind.com'
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        marker = self._buf.rfind(self.METADATA_MARKER)
+        if marker < 0:
+            raise ValueError(f'{path} 不是有效的 MMDB 文件')
+        self.metadata, _ = self._decode(marker + len(self.METADATA_MARKER), 0)
+        self.node_count = self.metadata['node_count']
+        self.record_size = self.metadata['record_size']
+        self.ip_version = self.metadata['ip_version']
+        if self.record_size not in (24, 28, 32):
+            raise ValueError(f'不支持的 record_size: {self.record_size}')
+        self._node_bytes = self.record_size // 4
+        self._data_start = self._node_bytes * self.node_count + 16
+        self._record_cache = {}
+        # IPv4 地址在 IPv6 树中位于 ::/96 下，预先走完前 96 位
+        self._ipv4_start = 0
+        if self.ip_version == 6:
+            node = 0
+            for _ in range(96):
+                if node >= self.node_count:
+                    break
+                node = self._read_node(node, 0)
+            self._ipv4_start = node
+
+    def close(self):
+        self._buf.close()
+
+    def _read_node(self, node: int, bit: int) -> int:
+        buf = self._buf
+        base = node * self._node_bytes
+        if self.record_size == 24:
+            off = base + bit * 3
+            return int.from_bytes(buf[off:off + 3], 'big')
+        if self.record_size == 28:
+            if bit == 0:
+                return ((buf[base + 3] & 0xF0) << 20) | int.from_bytes(buf[base:base + 3], 'big')
+            return ((buf[base + 3] & 0x0F) << 24) | int.from_bytes(buf[base + 4:base + 7], 'big')
+        off = base + bit * 4
+        return int.from_bytes(buf[off:off + 4], 'big')
+
+    def _decode(self, offset: int, base: int):
+        """解码 offset 处的一个数据字段，返回 (值, 下一个字段偏移)；base 为指针的基准偏移"""
+        buf = self._buf
+        ctrl = buf[offset]
+        offset += 1
+        dtype = ctrl >> 5
+        if dtype == 1:  # pointer
+            size = (ctrl >> 3) & 0x3
+            vvv = ctrl & 0x7
+            if size == 0:
+                ptr = (vvv << 8) | buf[offset]
+            elif size == 1:
+                ptr = ((vvv << 16) | int.from_bytes(buf[offset:offset + 2], 'big')) + 2048
+            elif size == 2:
+                ptr = ((vvv << 24) | int.from_bytes(buf[offset:offset + 3], 'big')) + 526336
+            else:
+                ptr = int.from_bytes(buf[offset:offset + 4], 'big')
+            value, _ = self._decode(base + ptr, base)
+            return value, offset + size + 1
+        if dtype == 0:  # extended
+            dtype = 7 + buf[offset]
+            offset += 1
+        size = ctrl & 0x1F
+        if size >= 29:
+            extra = size - 28
+            n = int.from_bytes(buf[offset:offset + extra], 'big')
+            offset += extra
+            size = (29, 285, 65821)[extra - 1] + n
+        if dtype == 2:  # utf8 string
+            return buf[offset:offset + size].decode('utf-8'), offset + size
+        if dtype == 7:  # map
+            result = {}
+            for _ in range(size):
+                key, offset = self._decode(offset, base)
+                result[key], offset = self._decode(offset, base)
+            return result, offset
+        if dtype == 11:  # array
+            result = []
+            for _ in range(size):
+                item, offset = self._decode(offset, base)
+                result.append(item)
+            return result, offset
+        if dtype in (5, 6, 9, 10):  # unsigned ints
+            return int.from_bytes(buf[offset:offset + size], 'big'), offset + size
+        if dtype == 8:  # int32
+            return int.from_bytes(buf[offset:offset + size], 'big', signed=size == 4), offset + size
+        if dtype == 3:  # double
+            return struct.unpack('>d', buf[offset:offset + 8])[0], offset + 8
+        if dtype == 15:  # float
+            return struct.unpack('>f', buf[offset:offset + 4])[0], offset + 4
+        if dtype == 4:  # bytes
+            return bytes(buf[offset:offset + size]), offset + size
+        if dtype == 14:  # boolean
+            return bool(size), offset
+        raise ValueError(f'不支持的 MMDB 数据类型: {dtype}')
+
+    def _record_offset(self, packed: bytes) -> Optional[int]:
+        bits = len(packed) * 8
+        if bits == 32 and self.ip_version == 6:
+            node = self._ipv4_start
+        else:
+            if bits == 128 and self.ip_version == 4:
+                return None
+            node = 0
+        node_count = self.node_count
+        for i in range(bits):
+            if node >= node_count:
+                break
+            node = self._read_node(node, (packed[i >> 3] >> (7 - (i & 7))) & 1)
+        if node <= node_count:
+            return None
+        return node - node_count - 16 + self._data_start
+
+    def lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        """查询 IP 对应的完整记录，未收录返回 None"""
+        try:
+            packed = ipaddress.ip_address(ip).packed
+        except ValueError:
+            return None
+        offset = self._record_offset(packed)
+        if offset is None:
+            return None
+        record = self._record_cache.get(offset)
+        if record is None:
+            record, _ = self._decode(offset, self._data_start)
+            self._record_cache[offset] = record
+        return record
+
+    def country_code(self, ip: str) -> Optional[str]:
+        """查询 IP 的 ISO 国家代码（兼容本项目自定义 mmdb 中 country 为字符串的格式）"""
+        record = self.lookup(ip)
+        if not isinstance(record, dict):
+            return None
+        for key in ('country', 'registered_country'):
+            value = record.get(key)
+            if isinstance(value, dict):
+                value = value.get('iso_code')
+            if value:
+                return value
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def open_country_db(path: Optional[str] = None) -> Optional[MMDBReader]:
+    """打开（并在进程内复用）国家 MMDB；未指定路径时依次尝试 $GEOIP_MMDB 与默认位置"""
+    candidates = [path] if path else [os.environ.get('GEOIP_MMDB')] + DEFAULT_MMDB_PATHS
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate):
+            try:
+                return MMDBReader(candidate)
+            except (OSError, ValueError) as e:
+                print(f"无法加载 MMDB {candidate}: {e}")
+    return None
+
+# ---------------------------------------------------------------------------
+# 多语言国家名匹配器（首次使用时编译一次，对页面文本单次线性扫描）
+# ---------------------------------------------------------------------------
+# 常见国家名用字的简→繁映射，用于匹配 zh-HK / zh-TW 页面
+_ZH_HANT = str.maketrans('国湾亚尔兰马罗门伦维纳乌韩岛联来兹买赖麦泽库东欧萨鲁达卢莱贝宁图圣卫丽谢斯', '國灣亞爾蘭馬羅門倫維納烏韓島聯來茲買賴麥澤庫東歐薩魯達盧萊貝寧圖聖衛麗謝斯')
+
+
+class CountryMatcher:
+    """
+    把所有国家名（ISO_COUNTRIES 英文名 + GeoLite2 Locations en / zh-CN 名称及其繁体写法）
+    编译为一个按长度降序排列的交替正则，一次扫描即可找出文本中所有国家名。
+    拉丁字母名称（含 "Åland"、"Guinea‑Bissau" 这类非 ASCII 写法）要求前后不是字母
+    （避免 "Oman" 命中 "Romania"），中日韩文字名称不加边界。
+    """
+    _CJK = re.compile('[\u2e80-\u9fff\uf900-\ufaff]')
+
+    def __init__(self, names: Dict[str, str]):
+        # 小写名称 → ISO 代码
+        self.names = {name.lower(): code for name, code in names.items() if name}
+        latin = [n for n in self.names if not self._CJK.search(n)]
+        other = [n for n in self.names if self._CJK.search(n)]
+        parts = []
+        if latin:
+            alt = '|'.join(re.escape(n) for n in sorted(latin, key=len, reverse=True))
+            parts.append(rf'(?<![^\W\d_])(?:{alt})(?![^\W\d_])')
+        if other:
+            parts.append('|'.join(re.escape(n) for n in sorted(other, key=len, reverse=True)))
+        self.pattern = re.compile('|'.join(parts) or r'(?!)', re.IGNORECASE)
+
+    @classmethod
+    def load(cls, geolite2_dir: str = GEOLITE2_DIR) -> 'CountryMatcher':
+        names = dict(ISO_COUNTRIES)
+        for name, code in ISO_COUNTRIES.items():
+            names[name.replace('\u2011', '-')] = code
+        for locale in ('en', 'zh-CN'):
+            path = os.path.join(geolite2_dir, f'GeoLite2-Country-Locations-{locale}.csv')
+            try:
+                with open(path, encoding='utf-8') as f:
+                    for row in csv.DictReader(f):
+                        name, code = row['country_name'], row['country_iso_code']
+                        if name and code:
+                            names[name] = code
+                            if locale == 'zh-CN':
+                                names[name.translate(_ZH_HANT)] = code
+            except OSError:
+                continue
+        return cls(names)
+
+    def finditer(self, text: str):
+        """依次产出 (匹配到的名称, ISO 代码)"""
+        for m in self.pattern.finditer(text):
+            yield m.group(0), self.names[m.group(0).lower()]
+
+    def find_all(self, text: str) -> List[tuple]:
+        return list(self.finditer(text))
+
+    def search(self, text: str) -> Optional[tuple]:
+        """返回文本中第一个国家名 (名称, ISO 代码)，没有则 None"""
+        return next(self.finditer(text), None)
+
+
+_COUNTRY_MATCHER = None
+_COUNTRY_MATCHER_LOCK = threading.Lock()
+
+
+def country_matcher() -> CountryMatcher:
+    """
+    返回全局国家名匹配器。交替正则编译需要数十毫秒，因此推迟到首次使用时构建
+    （GeoIPChecker 初始化时在后台预热），并发的首次调用只构建一次。
+    """
+    global _COUNTRY_MATCHER
+    if _COUNTRY_MATCHER is None:
+        with _COUNTRY_MATCHER_LOCK:
+            if _COUNTRY_MATCHER is None:
+                _COUNTRY_MATCHER = CountryMatcher.load()
+    return _COUNTRY_MATCHER
+
+
+# ISO 代码 → 英文国家名
+COUNTRY_NAMES_EN = {code: name for name, code in ISO_COUNTRIES.items()}
+
+
+# ---------------------------------------------------------------------------
+# 批量 IP 地理定位（GeoLite2 Country Blocks CSV → 有序区间数组，numpy 向量化查询）
+# ---------------------------------------------------------------------------
+RANGE_CACHE_DIR = os.path.join(GEOLITE2_DIR, '.ranges')
+# IPv6 地址拆成高/低两个 64 位无符号整数，按 (hi, lo) 字典序比较
+IPV6_KEY_DTYPE = [('hi', '<u8'), ('lo', '<u8')]
+
+
+class CountryRangeTable:
+    """
+    按起始地址排序的 [start, end] → 国家 区间表。
+    IPv4 使用 uint32，IPv6 使用 (hi, lo) 128 位拆分键；查询用 np.searchsorted。
+    数组以 .npy 缓存，之后以 mmap 方式加载，启动无需重新解析 CSV。
+    """
+    ARRAYS = ('v4_start', 'v4_end', 'v4_code', 'v6_start', 'v6_end', 'v6_code')
+
+    def __init__(self, codes: List[str], **arrays):
+        self.codes = codes
+        self._code_names = np.array(codes + [''], dtype=object)
+        self._missing = len(codes)
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_csv(cls, geolite2_dir: str = GEOLITE2_DIR) -> 'CountryRangeTable':
+        """从 GeoLite2-Country-Blocks-IPv4/IPv6.csv 与 Locations-en.csv 构建区间表"""
+        geoname_to_code = {}
+        with open(os.path.join(geolite2_dir, 'GeoLite2-Country-Locations-en.csv'), encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if row['country_iso_code']:
+                    geoname_to_code[row['geoname_id']] = row['country_iso_code']
+        codes = sorted(set(geoname_to_code.values()))
+        code_index = {code: i for i, code in enumerate(codes)}
+
+        def load(version):
+            rows = []
+            path = os.path.join(geolite2_dir, f'GeoLite2-Country-Blocks-IPv{version}.csv')
+            with open(path, encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    code = (geoname_to_code.get(row['geoname_id'])
+                            or geoname_to_code.get(row['registered_country_geoname_id'])
+                            or geoname_to_code.get(row.get('represented_country_geoname_id', '')))
+                    if not code:
+                        continue
+                    net = ipaddress.ip_network(row['network'])
+                    rows.append((int(net.network_address), int(net.broadcast_address), code_index[code]))
+            rows.sort()
+            return rows
+
+        v4 = load(4)
+        v6 = load(6)
+        mask = (1 << 64) - 1
+
+        def split(values):
+            return np.array([(v >> 64, v & mask) for v in values], dtype=IPV6_KEY_DTYPE)
+
+        return cls(
+            codes,
+            v4_start=np.array([r[0] for r in v4], dtype=np.uint32),
+            v4_end=np.array([r[1] for r in v4], dtype=np.uint32),
+            v4_code=np.array([r[2] for r in v4], dtype=np.uint16),
+            v6_start=split(r[0] for r in v6),
+            v6_end=split(r[1] for r in v6),
+            v6_code=np.array([r[2] for r in v6], dtype=np.uint16),
+        )
+
+    def save(self, cache_dir: str, source_stamp: Dict[str, Any]):
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(cache_dir, f'{name}.npy'), getattr(self, name))
+        # meta 最后写入，作为缓存完整性的标记
+        with open(os.path.join(cache_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'codes': self.codes, 'source': source_stamp}, f)
+
+    @classmethod
+    def load(cls, cache_dir: str) -> 'CountryRangeTable':
+        with open(os.path.join(cache_dir, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(cache_dir, f'{name}.npy'), mmap_mode='r') for name in cls.ARRAYS}
+        return cls(meta['codes'], **arrays)
+
+    @staticmethod
+    def _resolve(starts, ends, code_idx, keys, after_end):
+        if not len(starts):
+            return np.full(len(keys), -1, dtype=np.int64)
+        idx = np.searchsorted(starts, keys, side='right') - 1
+        safe = idx.clip(0)
+        hit = (idx >= 0) & ~after_end(keys, ends[safe])
+        return np.where(hit, code_idx[safe].astype(np.int64), -1)
+
+    def lookup_many(self, addresses: List[str]) -> List[str]:
+        """批量查询一组地址字符串，返回同长度的国家代码列表（无效/未收录为空字符串）"""
+        result = np.full(len(addresses), self._missing, dtype=np.int64)
+        v4_pos, v4_raw, v6_pos, v6_raw = [], [], [], []
+        for i, addr in enumerate(addresses):
+            try:
+                if ':' in addr:
+                    v6_raw.append(socket.inet_pton(socket.AF_INET6, addr))
+                    v6_pos.append(i)
+                else:
+                    v4_raw.append(socket.inet_pton(socket.AF_INET, addr))
+                    v4_pos.append(i)
+            except OSError:
+                continue
+        if v4_pos:
+            keys = np.frombuffer(b''.join(v4_raw), dtype='>u4').astype(np.uint32)
+            codes = self._resolve(self.v4_start, self.v4_end, self.v4_code, keys,
+                                  lambda q, end: q > end)
+            result[v4_pos] = np.where(codes >= 0, codes, self._missing)
+        if v6_pos:
+            raw = np.frombuffer(b''.join(v6_raw), dtype='>u8').reshape(-1, 2)
+            keys = np.empty(len(v6_pos), dtype=IPV6_KEY_DTYPE)
+            keys['hi'] = raw[:, 0]
+            keys['lo'] = raw[:, 1]
+            codes = self._resolve(self.v6_start, self.v6_end, self.v6_code, keys,
+                                  lambda q, end: (q['hi'] > end['hi']) | ((q['hi'] == end['hi']) & (q['lo'] > end['lo'])))
+            result[v6_pos] = np.where(codes >= 0, codes, self._missing)
+        return self._code_names[result].tolist()
+
+
+def load_country_ranges(geolite2_dir: str = GEOLITE2_DIR, cache_dir: str = RANGE_CACHE_DIR,
+                        rebuild: bool = False) -> CountryRangeTable:
+    """加载区间表：源 CSV 未变化时直接 mmap 缓存，否则重新构建并写入缓存"""
+    if np is None:
+        raise RuntimeError('批量定位需要 numpy：pip install numpy')
+    stamp = {}
+    for name in ('GeoLite2-Country-Blocks-IPv4.csv', 'GeoLite2-Country-Blocks-IPv6.csv',
+                 'GeoLite2-Country-Locations-en.csv'):
+        st = os.stat(os.path.join(geolite2_dir, name))
+        # 纳秒精度：同一秒内改写且大小不变的 CSV 也能使缓存失效
+        stamp[name] = [st.st_size, st.st_mtime_ns]
+    if not rebuild:
+        try:
+            with open(os.path.join(cache_dir, 'meta.json'), encoding='utf-8') as f:
+                if json.load(f).get('source') == stamp:
+                    return CountryRangeTable.load(cache_dir)
+        except (OSError, ValueError):
+            pass
+    table = CountryRangeTable.from_csv(geolite2_dir)
+    table.save(cache_dir, stamp)
+    return table
+
+
+def bulk_geolocate(table: CountryRangeTable, lines: Iterable[str], out, chunk_size: int = 100000) -> int:
+    """
+    流式批量定位：按 chunk_size 行分块读取，取每行第一个字段作为 IP，
+    输出 "原始行<TAB>国家代码"，每块处理完立即写出。返回处理的行数。
+    """
+    total = 0
+    chunk = []
+
+    def flush():
+        addresses = [line.split(None, 1)[0] if line.strip() else '' for line in chunk]
+        codes = table.lookup_many(addresses)
+        out.write(''.join(f'{line}\t{code}\n' for line, code in zip(chunk, codes)))
+        out.flush()
+
+    for line in lines:
+        chunk.append(line.rstrip('\r\n'))
+        if len(chunk) >= chunk_size:
+            flush()
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        flush()
+        total += len(chunk)
+    return total
+
+
+# ---------------------------------------------------------------------------
+# 多列表 CIDR 成员索引（与 config.json / geoip.dat 中的列表对应）
+# ---------------------------------------------------------------------------
+CONFIG_PATH = os.path.join(SCRIPT_DIR, 'config.json')
+
+
+class CIDRIndex:
+    """
+    多列表 CIDR 成员索引。
+    各列表的网段先收集为 [start, end] 区间，build() 时按地址族做一次扫描线，
+    合并成互不重叠的有序基本区间，每个区间记录覆盖它的列表名元组；
+    查询一个 IP 属于哪些列表只需一次二分查找，与列表数量无关。
+    列表名与 Go 端一致，统一为大写。
+    """
+
+    def __init__(self):
+        self._pending = {4: [], 6: []}
+        self._bounds = {4: [], 6: []}
+        self._labels = {4: [], 6: []}
+        self.names = set()
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name: str, cidr: str, only_ip_type: Optional[str] = None) -> bool:
+        """添加一个 IP 或 CIDR，无效或被 only_ip_type 过滤时返回 False"""
+        try:
+            net = ipaddress.ip_network(cidr.strip(), strict=False)
+        except ValueError:
+            return False
+        if only_ip_type and only_ip_type.lower() != f'ipv{net.version}':
+            return False
+        name = name.strip().upper()
+        self._pending[net.version].append((int(net.network_address), int(net.broadcast_address), name))
+        self.names.add(name)
+        self._dirty = True
+        return True
+
+    def add_text(self, name: str, lines: Iterable[str], only_ip_type: Optional[str] = None) -> int:
+        """按 Go 端 text 输入格式解析（支持 # 与 // 注释），返回添加的条目数"""
+        count = 0
+        for line in lines:
+            line = line.split('#', 1)[0].split('//', 1)[0].strip()
+            if line and self.add(name, line, only_ip_type):
+                count += 1
+        return count
+
+    def load_text(self, name: str, path: str, only_ip_type: Optional[str] = None) -> int:
+        with open(path, encoding='utf-8') as f:
+            return self.add_text(name, f, only_ip_type)
+
+    @staticmethod
+    def _iter_protobuf(buf: memoryview):
+        """遍历 protobuf 消息的 (字段号, 值)；长度分隔字段返回 memoryview"""
+        pos, end = 0, len(buf)
+
+        def varint():
+            nonlocal pos
+            shift = result = 0
+            while True:
+                b = buf[pos]
+                pos += 1
+                result |= (b & 0x7F) << shift
+                if not b & 0x80:
+                    return result
+                shift += 7
+
+        while pos < end:
+            key = varint()
+            field, wire = key >> 3, key & 0x7
+            if wire == 0:
+                yield field, varint()
+            elif wire == 2:
+                size = varint()
+                yield field, buf[pos:pos + size]
+                pos += size
+            elif wire == 1:
+                pos += 8
+            elif wire == 5:
+                pos += 4
+            else:
+                raise ValueError(f'不支持的 protobuf wire type: {wire}')
+
+    def load_geoip_dat(self, path: str, wanted: Optional[Iterable[str]] = None) -> int:
+        """加载 V2Ray geoip.dat（GeoIPList protobuf），wanted 指定只加载的列表，返回加载的列表数"""
+        wanted = {w.strip().upper() for w in wanted} if wanted else None
+        with open(path, 'rb') as f:
+            data = memoryview(f.read())
+        loaded = 0
+        for field, entry in self._iter_protobuf(data):
+            if field != 1:
+                continue
+            name, cidrs = None, []
+            for efield, value in self._iter_protobuf(entry):
+                if efield == 1:
+                    name = bytes(value).decode('utf-8').upper()
+                elif efield == 2:
+                    cidrs.append(value)
+            if not name or (wanted is not None and name not in wanted):
+                continue
+            for cidr in cidrs:
+                ip, prefix = b'', 0
+                for cfield, value in self._iter_protobuf(cidr):
+                    if cfield == 1:
+                        ip = bytes(value)
+                    elif cfield == 2:
+                        prefix = value
+                if len(ip) in (4, 16):
+                    self.add(name, f'{ipaddress.ip_address(ip)}/{prefix}')
+            loaded += 1
+        return loaded
+
+    @classmethod
+    def from_config(cls, path: str = CONFIG_PATH) -> 'CIDRIndex':
+        """加载 config.json 中 uri 为本地文件的 text 输入（远程 URL 需由 Go 端生成后以 geoip.dat 加载）"""
+        index = cls()
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        for item in config.get('input', []):
+            args = item.get('args', {})
+            uri = args.get('uri', '')
+            if item.get('type') != 'text' or item.get('action') != 'add' or not args.get('name'):
+                continue
+            if not uri or uri.startswith(('http://', 'https://')):
+                continue
+            local = os.path.join(base, uri)
+            if os.path.isfile(local):
+                index.load_text(args['name'], local, args.get('onlyIPType'))
+        return index
+
+    def build(self):
+        """扫描线合并所有区间，生成有序边界与每段的列表名元组"""
+        for version in (4, 6):
+            events = {}
+            for start, end, name in self._pending[version]:
+                events.setdefault(start, []).append((name, 1))
+                events.setdefault(end + 1, []).append((name, -1))
+            active = {}
+            bounds, labels = [], []
+            interned = {}
+            for point in sorted(events):
+                for name, delta in events[point]:
+                    count = active.get(name, 0) + delta
+                    if count:
+                        active[name] = count
+                    else:
+                        active.pop(name, None)
+                label = tuple(sorted(active))
+                label = interned.setdefault(label, label)
+                if labels and labels[-1] == label:
+                    continue
+                bounds.append(point)
+                labels.append(label)
+            self._bounds[version] = bounds
+            self._labels[version] = labels
+        self._dirty = False
+        return self
+
+    def lookup(self, ip: str) -> List[str]:
+        """返回包含该 IP 的所有列表名（无效 IP 返回空列表）"""
+        if self._dirty:
+            self.build()
+        try:
+            addr = ipaddress.ip_address(ip.strip())
+        except (ValueError, AttributeError):
+            return []
+        bounds = self._bounds[addr.version]
+        i = bisect.bisect_right(bounds, int(addr)) - 1
+        return list(self._labels[addr.version][i]) if i >= 0 else []
+
+    def contains(self, ip: str, name: str) -> bool:
+        return name.strip().upper() in self.lookup(ip)
+
+    def lookup_many(self, ips: Iterable[str]) -> List[List[str]]:
+        """批量查询，返回与输入顺序一致的列表名列表"""
+        return [self.lookup(ip) for ip in ips]
+
+
+@functools.lru_cache(maxsize=None)
+def default_cidr_index() -> CIDRIndex:
+    """进程内共享的默认索引：config.json 中的本地 text 列表（如 5ufhk）"""
+    try:
+        return CIDRIndex.from_config().build()
+    except (OSError, ValueError) as e:
+        print(f"无法加载 CIDR 列表: {e}")
+        return CIDRIndex()
+
+
+def _release_on_loop(loop, sems, _future=None):
+    """在事件循环线程中归还 asyncio 信号量（由工作线程中的 Future 完成回调调用）"""
+    def release():
+        for sem in sems:
+            sem.release()
+
+    try:
+        loop.call_soon_threadsafe(release)
+    except RuntimeError:
+        pass  # 事件循环已关闭，信号量随之废弃
+
+# ---------------------------------------------------------------------------
+# 请求头配置（只读）：按主机选择并在每个请求上合并，不修改共享 Session
+# ---------------------------------------------------------------------------
+# 未安装 brotli 时不声明 br，避免收到无法解码的正文
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36'
+DEFAULT_HEADERS = MappingProxyType({
+    'User-Agent': DEFAULT_USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': ACCEPT_ENCODING,
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1'
+})
+_MOBILE_SAFARI_UA = 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1'
+_EDGE_UA = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Edg/121.0.0.0'
+EMPTY_PROFILE = MappingProxyType({})
+# 主机（含子域名）→ 覆盖 DEFAULT_HEADERS 的请求头
+HEADER_PROFILES = MappingProxyType({
+    'facebook.com': MappingProxyType({'User-Agent': _MOBILE_SAFARI_UA}),
+    'chatgpt.com': MappingProxyType({'User-Agent': _EDGE_UA}),
+    'chat.openai.com': MappingProxyType({'User-Agent': _EDGE_UA}),
+})
+# 只需状态码 / 最终 URL 的探测请求最多读取的正文字节数
+PROBE_BYTE_BUDGET = 16 * 1024
+# 重定向状态码与单次请求最多跟随的跳数
+REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+MAX_REDIRECTS = 10
+
+
+# 各检查直接访问的主机，每个主机挂载独立的 HTTPAdapter 连接池
+CHECK_HOSTS = (
+    'www.cloudflare.com', 'only-185936-14-198-202-48.nstool.onmyojigame.com', 'api.country.is',
+    'www.netflix.com', 'www.youtube.com', 'www.google.com.hk', 'www.amazon.com', 'www.disneyplus.com',
+    'twitter.com', 'www.tiktok.com', 'chat.openai.com', 'chatgpt.com', 'www.facebook.com',
+    'm.facebook.com', 'graph.facebook.com', 'www.instagram.com', 'web.telegram.org',
+)
+
+
+def header_profile(url: str, profiles=HEADER_PROFILES):
+    """返回 URL 所属主机的请求头覆盖配置（按域名后缀匹配）"""
+    host = (urllib.parse.urlsplit(url).hostname or '').lower()
+    for domain, profile in profiles.items():
+        if host == domain or host.endswith('.' + domain):
+            return profile
+    return EMPTY_PROFILE
+
+
+# ---------------------------------------------------------------------------
+# 分阶段耗时追踪与指标导出
+# ---------------------------------------------------------------------------
+# 当前正在执行的检查（CheckTrace）与当前请求的连接耗时累加器，经 contextvars 传入工作线程
+_current_check = contextvars.ContextVar('geoip_current_check', default=None)
+_current_request = contextvars.ContextVar('geoip_current_request', default=None)
+
+
+class CheckTrace:
+    """
+    单次检查的追踪记录：各阶段耗时累加（秒）与计数器。
+    阶段：dns、connect（TCP）、tls、ttfb、download、decode_cpu、parse_cpu、total。
+    同一检查的子请求可能在多个线程并发执行，因此写入加锁。
+    """
+    __slots__ = ('name', 'phases', 'counters', '_lock')
+    COUNTERS = ('requests', 'bytes', 'retries', 'redirects', 'errors', 'timeouts', 'short_circuits')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.phases = {}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + max(seconds, 0.0)
+
+    def count(self, counter: str, value: int = 1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'phases': {k: round(v, 6) for k, v in self.phases.items()}, **self.counters}
+
+
+def _trace_add(phase: str, seconds: float):
+    """向当前检查（以及当前请求的累加器）记录一段耗时；不在检查中时忽略"""
+    trace = _current_check.get()
+    if trace is not None:
+        trace.add(phase, seconds)
+    acc = _current_request.get()
+    if acc is not None:
+        acc[phase] = acc.get(phase, 0.0) + seconds
+
+
+def _trace_count(counter: str, value: int = 1):
+    trace = _current_check.get()
+    if trace is not None and value:
+        trace.count(counter, value)
+
+
+# ---------------------------------------------------------------------------
+# DNS 预解析与缓存
+# ---------------------------------------------------------------------------
+# 默认解析结果的缓存时间（秒）：getaddrinfo 不返回记录的 TTL，只能使用固定值
+DNS_TTL = 300.0
+# 解析失败的缓存时间（秒），避免对不存在的域名反复阻塞
+DNS_NEGATIVE_TTL = 30.0
+# 缓存条目剩余寿命低于该比例时，命中后在后台提前刷新
+DNS_REFRESH_AHEAD = 0.2
+
+
+class DNSResolver:
+    """
+    带 TTL 的进程内 DNS 缓存，可跨 GeoIPChecker 实例共享。
+    - lookup：命中直接返回地址列表；同一主机的并发查询只发起一次 getaddrinfo；
+      快过期的条目命中后在后台刷新，查询本身不等待。
+    - prefetch：启动时在线程池中并发预解析所有检查主机，不阻塞调用方。
+    解析失败按 DNS_NEGATIVE_TTL 缓存，期间 lookup 直接抛出同一个 socket.gaierror。
+    实际等待 DNS 的耗时记入当前检查的 dns 阶段。
+    """
+
+    def __init__(self, ttl: float = DNS_TTL, negative_ttl: float = DNS_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        # host -> (地址元组或 socket.gaierror, 过期时间)
+        self._cache = {}
+        # host -> 正在进行的解析（Future）
+        self._inflight = {}
+
+    @staticmethod
+    def _is_literal(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host.strip('[]'))
+            return True
+        except ValueError:
+            return False
+
+    def _fresh(self, host: str):
+        entry = self._cache.get(host)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry
+        return None
+
+    def _resolve(self, host: str, future: Future):
+        """执行一次 getaddrinfo，写入缓存并完成 future（由发起者调用）"""
+        try:
+            infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+            addresses = tuple(dict.fromkeys(info[4][0] for info in infos))
+            value, ttl = addresses, self.ttl
+        except socket.gaierror as e:
+            value, ttl = e, self.negative_ttl
+        except Exception as e:
+            # 非解析类异常不缓存
+            with self._lock:
+                self._inflight.pop(host, None)
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._cache[host] = (value, time.monotonic() + ttl)
+            self._inflight.pop(host, None)
+        if isinstance(value, socket.gaierror):
+            future.set_exception(value)
+        else:
+            future.set_result(value)
+
+    def _claim(self, host: str):
+        """返回 (future, 是否由调用方负责解析)"""
+        with self._lock:
+            future = self._inflight.get(host)
+            if future is not None:
+                return future, False
+            future = self._inflight[host] = Future()
+            return future, True
+
+    def lookup(self, host: str) -> tuple:
+        """返回主机的地址元组（IP 字面量原样返回）；解析失败抛出 socket.gaierror"""
+        host = host.lower()
+        if self._is_literal(host):
+            return (host.strip('[]'),)
+        entry = self._fresh(host)
+        if entry is not None:
+            value, expires = entry
+            if isinstance(value, socket.gaierror):
+                raise value
+            if expires - time.monotonic() < self.ttl * DNS_REFRESH_AHEAD:
+                self._refresh_in_background(host)
+            return value
+        start = time.perf_counter()
+        try:
+            future, owner = self._claim(host)
+            if owner:
+                self._resolve(host, future)
+            return future.result()
+        finally:
+            _trace_add('dns', time.perf_counter() - start)
+
+    def _refresh_in_background(self, host: str):
+        future, owner = self._claim(host)
+        if owner:
+            threading.Thread(target=self._resolve, args=(host, future), name='geoip-dns', daemon=True).start()
+
+    def prefetch(self, hosts: Iterable[str], executor: ThreadPoolExecutor) -> List[Future]:
+        """在 executor 中并发解析尚未缓存的主机，立即返回各主机的 Future"""
+        futures = []
+        for host in dict.fromkeys(h.lower() for h in hosts if h):
+            if self._is_literal(host) or self._fresh(host) is not None:
+                continue
+            future, owner = self._claim(host)
+            if owner:
+                # 空上下文：预解析不记入任何检查的追踪
+                executor.submit(contextvars.Context().run, self._resolve, host, future)
+            futures.append(future)
+        return futures
+
+
+# 进程默认的解析缓存（GeoIPChecker 未指定 resolver 时共享）
+DEFAULT_RESOLVER = DNSResolver()
+# 当前请求使用的解析器，由 GeoIPChecker._send 设置，供连接类读取
+_current_resolver = contextvars.ContextVar('geoip_current_resolver', default=None)
+
+
+def _name_resolution_error(conn, host: str, error: Exception) -> Exception:
+    """
+    连接类解析主机失败时抛出的异常：urllib3 2.x 为 NameResolutionError；
+    1.x 没有该类型，与其自身解析失败时一样使用 NewConnectionError。两者都会被 requests 转换为 ConnectionError。
+    """
+    exceptions = urllib3.exceptions
+    if hasattr(exceptions, 'NameResolutionError'):
+        return exceptions.NameResolutionError(host, conn, error)
+    return exceptions.NewConnectionError(conn, f"Failed to resolve '{host}' ({error})")
+
+
+class _TracedConnectionMixin:
+    """
+    记录新建连接的 DNS（dns）、TCP（connect）与 TLS 握手（tls）耗时（geoip_http 中的连接类继承它）。
+    存在当前解析器（_current_resolver）时，主机名经 DNSResolver 缓存解析，
+    再依次尝试各地址建立连接；SNI 与证书校验仍使用原主机名。
+    """
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        dns_time = 0.0
+        try:
+            resolver = _current_resolver.get()
+            if resolver is None:
+                return super()._new_conn()
+            host = self._dns_host
+            try:
+                addresses = resolver.lookup(host)
+            except socket.gaierror as e:
+                raise _name_resolution_error(self, host, e) from e
+            finally:
+                dns_time = time.perf_counter() - start
+            # 解析器返回空列表时没有可尝试的地址，按解析失败处理
+            error = _name_resolution_error(self, host, socket.gaierror(socket.EAI_NONAME, 'no addresses'))
+            for address in addresses:
+                # urllib3 以 _dns_host 建立 TCP 连接，连接建立后立即恢复主机名
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except urllib3.exceptions.NewConnectionError as e:
+                    error = e
+                finally:
+                    self._dns_host = host
+            raise error
+        finally:
+            self._geoip_tcp_time = time.perf_counter() - start
+            _trace_add('connect', self._geoip_tcp_time - dns_time)
+
+    def connect(self):
+        self._geoip_tcp_time = 0.0
+        start = time.perf_counter()
+        super().connect()
+        if isinstance(self, urllib3.connection.HTTPSConnection):
+            _trace_add('tls', time.perf_counter() - start - self._geoip_tcp_time)
+
+
+class Metrics:
+    """
+    按 (检查, 阶段) 聚合的耗时直方图与计数器。
+    可导出结构化 JSON 摘要（summary）与 Prometheus textfile（write_prometheus）。
+    fleet 模式下多个 checker 可共享同一实例。
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (check, phase) -> [各桶计数..., +Inf 计数], sum, max
+        self._hist = {}
+        self._counters = {}
+        self.last_run = {}
+
+    def observe(self, check: str, phase: str, seconds: float):
+        with self._lock:
+            entry = self._hist.get((check, phase))
+            if entry is None:
+                entry = self._hist[(check, phase)] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0.0]
+            entry[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def record(self, trace: CheckTrace):
+        data = trace.to_dict()
+        for phase, seconds in data['phases'].items():
+            self.observe(trace.name, phase, seconds)
+        with self._lock:
+            for counter in CheckTrace.COUNTERS:
+                key = (trace.name, counter)
+                self._counters[key] = self._counters.get(key, 0) + data[counter]
+            self.last_run[trace.name] = data
+
+    def _quantile(self, counts: List[int], q: float, maximum: float) -> float:
+        total = sum(counts)
+        rank = q * total
+        cumulative = 0
+        for i, n in enumerate(counts):
+            cumulative += n
+            if cumulative >= rank and n:
+                return self.BUCKETS[i] if i < len(self.BUCKETS) else maximum
+        return maximum
+
+    def summary(self) -> Dict[str, Any]:
+        """结构化摘要：每个检查的各阶段 count/sum/max/p50/p90/p99（分位数取桶上界）及计数器"""
+        with self._lock:
+            checks = {}
+            for (check, phase), (counts, total, maximum) in sorted(self._hist.items()):
+                count = sum(counts)
+                checks.setdefault(check, {'phases': {}})['phases'][phase] = {
+                    'count': count,
+                    'sum': round(total, 6),
+                    'max': round(maximum, 6),
+                    'p50': self._quantile(counts, 0.5, maximum),
+                    'p90': self._quantile(counts, 0.9, maximum),
+                    'p99': self._quantile(counts, 0.99, maximum),
+                }
+            for (check, counter), value in sorted(self._counters.items()):
+                checks.setdefault(check, {'phases': {}})[counter] = value
+            return {'checks': checks, 'last_run': dict(self.last_run)}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """原始直方图与计数器的可序列化副本（多进程 fleet 中由子进程发回主进程，见 merge）"""
+        with self._lock:
+            return {
+                'hist': {key: [list(counts), total, maximum] for key, (counts, total, maximum) in self._hist.items()},
+                'counters': dict(self._counters),
+                'last_run': dict(self.last_run),
+            }
+
+    def merge(self, snapshot: Dict[str, Any]):
+        """把另一个 Metrics 的 snapshot 累加进来"""
+        with self._lock:
+            for key, (counts, total, maximum) in snapshot['hist'].items():
+                entry = self._hist.get(key)
+                if entry is None:
+                    entry = self._hist[key] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0.0]
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] = max(entry[2], maximum)
+            for key, value in snapshot['counters'].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            self.last_run.update(snapshot['last_run'])
+
+    @staticmethod
+    def _label(value: str) -> str:
+        """标签值转义（反斜杠、双引号、换行），自定义检查名中出现这些字符时输出仍可解析"""
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式（供 node_exporter textfile collector 采集）"""
+        lines = ['# HELP geoip_check_phase_seconds Per-phase latency of geoip checks.',
+                 '# TYPE geoip_check_phase_seconds histogram']
+        with self._lock:
+            for (check, phase), (counts, total, _) in sorted(self._hist.items()):
+                labels = f'check="{self._label(check)}",phase="{self._label(phase)}"'
+                cumulative = 0
+                for bound, n in zip(self.BUCKETS + (float('inf'),), counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'geoip_check_phase_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f'geoip_check_phase_seconds_sum{{{labels}}} {total:.6f}')
+                lines.append(f'geoip_check_phase_seconds_count{{{labels}}} {cumulative}')
+            for counter in CheckTrace.COUNTERS:
+                lines.append(f'# TYPE geoip_check_{counter}_total counter')
+                for (check, name), value in sorted(self._counters.items()):
+                    if name == counter:
+                        lines.append(f'geoip_check_{counter}_total{{check="{self._label(check)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """原子写入 textfile（先写临时文件再 rename）"""
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+
+# ---------------------------------------------------------------------------
+# 熔断与重试预算
+# ---------------------------------------------------------------------------
+class CircuitBreaker:
+    """
+    单个 (出口, 主机) 的熔断器。
+    closed：统计最近 window 秒内的请求，至少 min_requests 次且错误率达到 error_rate 时打开；
+    open：cooldown 秒内直接拒绝；到期后进入 half_open，只放行一个试探请求，
+    试探成功则关闭，失败则重新打开且冷却时间加倍（不超过 max_cooldown）。
+    """
+    __slots__ = ('window', 'min_requests', 'error_rate', 'cooldown', 'max_cooldown',
+                 'state', '_events', '_opened_at', '_open_for', '_trial', '_lock')
+
+    def __init__(self, window: float = 60.0, min_requests: int = 5, error_rate: float = 0.5,
+                 cooldown: float = 30.0, max_cooldown: float = 300.0):
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = 'closed'
+        self._events = collections.deque()  # (时间, 是否成功)
+        self._opened_at = 0.0
+        self._open_for = cooldown
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if time.monotonic() - self._opened_at < self._open_for:
+                    return False
+                self.state = 'half_open'
+                self._trial = False
+            # half_open：只放行一个试探请求
+            if self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def release(self):
+        """归还 allow() 放行的试探名额（放行后请求最终未发出时调用）"""
+        with self._lock:
+            if self.state == 'half_open':
+                self._trial = False
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == 'half_open':
+                if ok:
+                    self.state = 'closed'
+                    self._events.clear()
+                    self._open_for = self.cooldown
+                else:
+                    self._open(now, min(self._open_for * 2, self.max_cooldown))
+                return
+            if self.state == 'open':
+                return
+            self._events.append((now, ok))
+            while self._events and now - self._events[0][0] > self.window:
+                self._events.popleft()
+            total = len(self._events)
+            if total >= self.min_requests:
+                errors = sum(1 for _, success in self._events if not success)
+                if errors >= self.error_rate * total:
+                    self._open(now, self.cooldown)
+
+    def _open(self, now: float, duration: float):
+        self.state = 'open'
+        self._opened_at = now
+        self._open_for = duration
+        self._trial = False
+        self._events.clear()
+
+
+# 跨出口汇总熔断器的默认参数：样本更多、错误率更高才打开，
+# 即主机对几乎所有出口都失败时才熔断；fleet 中少数出口被封锁不会连累健康的出口
+HOST_BREAKER_SETTINGS = {'min_requests': 20, 'error_rate': 0.9}
+
+
+class CircuitBreakers:
+    """
+    熔断器集合：每个 (出口, 主机) 一个，另有每个主机跨出口汇总的一个（出口记为 '*'，
+    参数为 settings 叠加 HOST_BREAKER_SETTINGS 与 host_settings）。
+    两者都放行时请求才会发出。fleet / 常驻模式下多个 checker 共享同一实例。
+    """
+
+    def __init__(self, host_settings: Optional[Dict[str, Any]] = None, **settings):
+        self.settings = settings
+        self.host_settings = {**settings, **HOST_BREAKER_SETTINGS, **(host_settings or {})}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _get(self, egress: str, host: str) -> CircuitBreaker:
+        key = (egress, host)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            settings = self.host_settings if egress == '*' else self.settings
+            with self._lock:
+                breaker = self._breakers.setdefault(key, CircuitBreaker(**settings))
+        return breaker
+
+    def allow(self, egress: str, host: str) -> bool:
+        # 先问本出口的熔断器：它拒绝时不占用汇总熔断器的试探名额；
+        # 汇总熔断器拒绝时归还本出口可能已占用的试探名额，两者都不会卡在 half_open
+        breaker = self._get(egress, host)
+        if not breaker.allow():
+            return False
+        if self._get('*', host).allow():
+            return True
+        breaker.release()
+        return False
+
+    def record(self, egress: str, host: str, ok: bool):
+        self._get(egress, host).record(ok)
+        self._get('*', host).record(ok)
+
+    def open_circuits(self) -> List[tuple]:
+        """当前未关闭的 (出口, 主机, 状态)"""
+        return [(egress, host, b.state) for (egress, host), b in list(self._breakers.items()) if b.state != 'closed']
+
+
+class RetryBudget:
+    """
+    重试预算：最近 window 秒内的重试次数不超过 min_retries + ratio × 请求数。
+    避免在主机持续失败时把时间全部花在重试上。
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 3, window: float = 10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests = collections.deque()
+        self._retries = collections.deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, events, now):
+        while events and now - events[0] > self.window:
+            events.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        with self._lock:
+            self._requests.append(now)
+            self._prune(self._requests, now)
+
+    def try_spend(self) -> bool:
+        """申请一次重试；预算不足时返回 False"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(self._requests, now)
+            self._prune(self._retries, now)
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+                return False
+            self._retries.append(now)
+            return True
+
+
+# ---------------------------------------------------------------------------
+# 正文解码层：每个响应只解压一次（增量解压 + 解压后大小上限）
+# ---------------------------------------------------------------------------
+# 解压后正文的最大字节数，超过即截断（防止解压炸弹）
+MAX_BODY_BYTES = 4 * 1024 * 1024
+BODY_CHUNK_SIZE = 16 * 1024
+
+
+class _ZlibDecoder:
+    """
+    gzip / deflate 解压级。deflate 既可能是 zlib 封装也可能是裸流，首块失败时切换为裸流。
+    单次输出受 max_length 限制，未处理完的输入留在 unconsumed_tail，pending 为真时可继续取出输出。
+    """
+
+    def __init__(self, wbits: int, raw_fallback: bool = False):
+        self._obj = zlib.decompressobj(wbits)
+        self._raw_fallback = raw_fallback
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._obj.unconsumed_tail)
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        data = self._obj.unconsumed_tail + data if self._obj.unconsumed_tail else data
+        if self._raw_fallback:
+            self._raw_fallback = False
+            try:
+                return self._obj.decompress(data, max_length)
+            except zlib.error:
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._obj.decompress(data, max_length)
+
+
+class _BrotliDecoder:
+    """
+    brotli 解压级，接口同 _ZlibDecoder：output_buffer_limit 限制单次输出，
+    解压器暂存有未取出的输出（can_accept_more_data() 为假）时只能以空输入继续调用，新输入先缓存。
+    """
+
+    def __init__(self):
+        self._obj = brotli.Decompressor()
+        self._backlog = b''
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._backlog) or not self._obj.can_accept_more_data()
+
+    def decompress(self, data: bytes, max_length: int) -> bytes:
+        try:
+            if not self._obj.can_accept_more_data():
+                self._backlog += data
+                return self._obj.process(b'', output_buffer_limit=max_length)
+            data, self._backlog = self._backlog + data, b''
+            return self._obj.process(data, output_buffer_limit=max_length)
+        except brotli.error as e:
+            # 与 requests 对损坏的压缩正文的处理一致
+            raise requests.exceptions.ContentDecodingError(e) from e
+
+
+class BodyDecoder:
+    """
+    按 Content-Encoding 增量解压原始正文（支持 br、gzip、deflate 及其叠加）。
+    每一级单次最多输出 BODY_CHUNK_SIZE 字节（最后一级不超过剩余额度），逐块送往下一级；
+    解压后累计超过 limit 字节时立即停止并标记 truncated，解压炸弹不会在内存中展开。
+    """
+
+    def __init__(self, content_encoding: str, limit: int = MAX_BODY_BYTES):
+        self.limit = limit
+        self.size = 0
+        self.truncated = False
+        self._stages = []
+        # Content-Encoding 按施加顺序列出，解码时逆序处理
+        for coding in reversed([c.strip().lower() for c in content_encoding.split(',') if c.strip()]):
+            if coding in ('gzip', 'x-gzip'):
+                self._stages.append(_ZlibDecoder(16 + zlib.MAX_WBITS))
+            elif coding == 'deflate':
+                self._stages.append(_ZlibDecoder(zlib.MAX_WBITS, raw_fallback=True))
+            elif coding == 'br':
+                if brotli is None:
+                    raise ValueError('响应使用 brotli 压缩，但未安装 brotli')
+                self._stages.append(_BrotliDecoder())
+            elif coding != 'identity':
+                raise ValueError(f'不支持的 Content-Encoding: {coding}')
+
+    def feed(self, data: bytes) -> bytes:
+        """解压一块数据，返回本块新增的明文（已按剩余额度截断）"""
+        out = bytearray()
+        self._push(0, data, out)
+        self.size += len(out)
+        return bytes(out)
+
+    def _push(self, level: int, data: bytes, out: bytearray):
+        """把 data 送入第 level 级，逐块取出该级的输出送往下一级，直到该级没有更多输出或已超限"""
+        if level == len(self._stages):
+            room = self.limit - self.size - len(out)
+            if len(data) > room:
+                data = data[:room]
+                self.truncated = True
+            out += data
+            return
+        stage = self._stages[level]
+        last = level == len(self._stages) - 1
+        while not self.truncated:
+            # 最后一级多取一个字节用于判断是否超限
+            max_length = self.limit - self.size - len(out) + 1 if last else BODY_CHUNK_SIZE
+            chunk = stage.decompress(data, max_length)
+            data = b''
+            if chunk:
+                self._push(level + 1, chunk, out)
+            if not stage.pending:
+                break
+
+
+def iter_raw_body(response: requests.Response):
+    """
+    逐块产出未解压的原始正文。urllib3 的传输错误（连接中断、读取超时等）按 requests.iter_content 的方式
+    转换为 requests 的异常，调用方只需处理 requests.RequestException。
+    """
+    try:
+        yield from response.raw.stream(BODY_CHUNK_SIZE, decode_content=False)
+    except urllib3.exceptions.ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e) from e
+    except urllib3.exceptions.SSLError as e:
+        raise requests.exceptions.SSLError(e) from e
+    except urllib3.exceptions.HTTPError as e:
+        raise requests.exceptions.ConnectionError(e) from e
+
+
+def read_body(response: requests.Response, limit: int = MAX_BODY_BYTES) -> bytes:
+    """
+    读取并解码响应正文，结果回填到 response._content，之后 .text/.json() 直接复用。
+    流式响应（stream=True）从原始字节流增量解压一次；
+    非流式响应正文已由 urllib3 解压，直接使用，不再二次解压。
+    """
+    if response._content_consumed or response.raw is None:
+        return response.content or b''
+    decoder = BodyDecoder(response.headers.get('Content-Encoding', ''), limit)
+    buf = bytearray()
+    start = time.perf_counter()
+    try:
+        for chunk in iter_raw_body(response):
+            buf += decoder.feed(chunk)
+            if decoder.truncated:
+                break
+    finally:
+        _trace_add('download', time.perf_counter() - start)
+        _trace_count('bytes', response.raw.tell())
+        response.close()
+    response._content = bytes(buf)
+    response._content_consumed = True
+    response.body_truncated = decoder.truncated
+    return response._content
+
+
+# ---------------------------------------------------------------------------
+# 增量 HTML 文本扫描（边读边解析，得出结论即停止读取）
+# ---------------------------------------------------------------------------
+class HTMLTextScanner(HTMLParser):
+    """
+    增量 HTML 文本扫描器：feed() 可逐块调用，每个可见文本节点到达时以 (去空白文本, 所在标签) 调用 on_text；
+    回调返回非 None 即作为结果，之后的内容不再处理。不构建文档树。
+    """
+    SKIP_TAGS = frozenset({'script', 'style', 'noscript', 'template'})
+    VOID_TAGS = frozenset({'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+                           'meta', 'param', 'source', 'track', 'wbr'})
+
+    def __init__(self, on_text):
+        super().__init__(convert_charrefs=True)
+        self.on_text = on_text
+        self.result = None
+        self._stack = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in self.VOID_TAGS:
+            self._stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_endtag(self, tag):
+        # 容忍未闭合标签：弹出到最近的同名标签
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i] == tag:
+                del self._stack[i:]
+                break
+
+    def handle_data(self, data):
+        if self.result is not None:
+            return
+        tag = self._stack[-1] if self._stack else ''
+        if tag in self.SKIP_TAGS:
+            return
+        text = data.strip()
+        if text:
+            self.result = self.on_text(text, tag)
+
+
+DNS_PAGE_IP_RE = re.compile(r'Your IP Address:\s*([\d\.]+)')
+DNS_PAGE_SERVER_RE = re.compile(r'Your Local DNS Server:\s*([\d\.]+)')
+NETFLIX_REGION_RE = re.compile(r'netflix\.com/([a-z]{2}(?:-[a-z]{2})?)/title')
+NETFLIX_COOKIE_COUNTRY_RE = re.compile(r'"country"\s*:\s*"([A-Z]{2})"')
+YOUTUBE_PRICE_RE = re.compile(r'HK\$|NT\$|\$|\d+\s*港币|\d+\s*新台币|\d+\s*USD|\d+\s*円|¥')
+YOUTUBE_BLOCKED_RE = re.compile(r'not available|unavailable|不可用|利用できません|사용할 수 없음')
+GOOGLE_TEXT_TAGS = frozenset({'div', 'span', 'p', 'a'})
+GOOGLE_MENU_WORDS = frozenset({
+    'about', 'advertising', 'business', 'how search works', 'privacy', 'terms',
+    'settings', 'advertise', 'store', 'all', 'images', 'videos', 'news', 'shopping',
+    'tools', 'search', 'sign in', 'gmail', 'more', 'maps', 'play', 'youtube', 'drive',
+    'calendar', 'translate', 'photos', 'books', 'blogger', 'contacts', 'docs', 'finance',
+    'groups', 'hangouts', 'keep', 'meet', 'jamboard', 'earth', 'chrome', 'arts & culture',
+    'podcasts', 'stadia', 'duo', 'messages', 'collections', 'forms', 'ads', 'developers',
+    'press', 'location', 'account', 'help', 'send feedback', 'learn more', 'cookies'
+})
+
+
+# ---------------------------------------------------------------------------
+# 调试转储：后台线程写入、压缩、采样与轮转，不阻塞检测
+# ---------------------------------------------------------------------------
+class ArtifactSink:
+    """
+    调试产物（页面 HTML 等）的后台写入器。
+    submit() 只把内容放入有界队列，队列满时直接丢弃（计入 dropped），从不阻塞调用方；
+    写入线程负责压缩（zstd 可用时优先，否则 gzip）并按总大小 / 文件年龄轮转目录。
+    成功结果按 1/sample_every 采样，失败结果总是保存；sample_every=0 表示只保存失败结果。
+    """
+    SUFFIXES = ('.txt', '.gz', '.zst')
+
+    def __init__(self, directory: str, sample_every: int = 20, max_bytes: int = 50 * 1024 * 1024,
+                 max_age: float = 86400, queue_size: int = 32, compression: Optional[str] = None):
+        self.directory = directory
+        self.sample_every = sample_every
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        if compression is None:
+            compression = 'zstd' if zstandard is not None else 'gzip'
+        self.compression = compression
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._seq = itertools.count()
+        self._success_seq = itertools.count()
+        self._thread = None
+        self._lock = threading.Lock()
+        # dropped / written 由提交线程与写入线程并发更新
+        self._count_lock = threading.Lock()
+
+    def submit(self, name: str, content, failed: bool = False) -> bool:
+        """提交一个产物，返回是否入队（被采样跳过或队列已满时返回 False）"""
+        if not failed:
+            if not self.sample_every or next(self._success_seq) % self.sample_every:
+                return False
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((next(self._seq), name, content))
+            return True
+        except queue.Full:
+            with self._count_lock:
+                self.dropped += 1
+            return False
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._thread = threading.Thread(target=self._run, name='geoip-artifacts', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                print(f"[artifacts] 写入失败: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, seq: int, name: str, content):
+        if not isinstance(content, (bytes, bytearray)):
+            content = str(content).encode('utf-8', errors='replace')
+        # 毫秒时间戳 + 进程内序号，多线程 / 多进程下不会重名
+        now = time.time()
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(now)) + f'.{int(now * 1000) % 1000:03d}'
+        fname = os.path.join(self.directory, f'{stamp}_{os.getpid()}_{seq}_{name}')
+        if self.compression == 'zstd':
+            fname += '.zst'
+            content = zstandard.ZstdCompressor().compress(content)
+        elif self.compression == 'gzip':
+            fname += '.gz'
+            content = gzip.compress(content, compresslevel=6)
+        with open(fname, 'wb') as f:
+            f.write(content)
+        with self._count_lock:
+            self.written += 1
+        self._rotate()
+
+    def _rotate(self):
+        """删除超龄文件，并在总大小超限时从最旧的开始删除"""
+        now = time.time()
+        files = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(self.SUFFIXES):
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def flush(self, timeout: float = 5.0):
+        """等待队列写完（最多 timeout 秒）"""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+
+_ARTIFACT_SINKS = {}
+_ARTIFACT_SINKS_LOCK = threading.Lock()
+
+
+def get_artifact_sink(directory: str, **kwargs) -> ArtifactSink:
+    """同一目录在进程内共享一个写入器（fleet 模式下的大量 checker 不会各自起线程）"""
+    key = os.path.abspath(directory)
+    with _ARTIFACT_SINKS_LOCK:
+        sink = _ARTIFACT_SINKS.get(key)
+        if sink is None:
+            sink = _ARTIFACT_SINKS[key] = ArtifactSink(directory, **kwargs)
+        elif 'sample_every' in kwargs:
+            sink.sample_every = kwargs['sample_every']
+        return sink
+
+
+@atexit.register
+def _flush_artifact_sinks():
+    for sink in list(_ARTIFACT_SINKS.values()):
+        sink.flush(timeout=2.0)
+
+
+# ---------------------------------------------------------------------------
+# 声明式检查注册表
+# ---------------------------------------------------------------------------
+# 简单检查声明为「URL + 请求头 + 提取器」，模块导入时编译一次：
+# 同一 (URL, 请求头) 的抓取在规划阶段合并为一个 Fetch（探测与取正文合并为取正文），
+# 一次检测中多个检查共用同一响应，所有提取器都在这一个响应上求值。
+# 新增的服务若与已有服务数据重叠（同一 trace、同一跳转），不会产生额外请求。
+def parse_trace(text: str) -> Dict[str, str]:
+    """解析 Cloudflare /cdn-cgi/trace 的 key=value 正文"""
+    return dict(line.split('=', 1) for line in text.splitlines() if '=' in line)
+
+
+class FetchedPage:
+    """一次抓取的结果（多个检查共享，创建后只读）"""
+    __slots__ = ('url', 'status_code', 'headers', 'text', '_trace')
+
+    def __init__(self, response, text: Optional[str] = None):
+        # 在某一跳提前停止跟随时，以该跳的跳转目标作为最终 URL
+        self.url = getattr(response, 'redirect_target', None) or response.url
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.text = text
+        self._trace = None
+
+    @property
+    def trace(self) -> Dict[str, str]:
+        if self._trace is None:
+            self._trace = parse_trace(self.text or '')
+        return self._trace
+
+
+class Extractor:
+    """提取器基类：从 FetchedPage 取值，未命中时返回 None"""
+    __slots__ = ()
+    needs_body = False
+
+    def __call__(self, page: FetchedPage):
+        raise NotImplementedError
+
+
+class Const(Extractor):
+    """只要抓取成功即返回固定值"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, page):
+        return self.value
+
+
+class StatusIs(Extractor):
+    """状态码是否在给定集合内"""
+    __slots__ = ('codes',)
+
+    def __init__(self, *codes: int):
+        self.codes = frozenset(codes or (200,))
+
+    def __call__(self, page):
+        return page.status_code in self.codes
+
+
+class HeaderValue(Extractor):
+    """响应头的值"""
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __call__(self, page):
+        return page.headers.get(self.name)
+
+
+class FinalURL(Extractor):
+    """跟随重定向后的最终 URL"""
+    __slots__ = ()
+
+    def __call__(self, page):
+        return page.url
+
+
+class URLMatch(Extractor):
+    """在最终 URL 上匹配正则，返回指定分组（可选转换）"""
+    __slots__ = ('pattern', 'group', 'transform')
+
+    def __init__(self, pattern: str, group: int = 1, transform=None):
+        self.pattern = re.compile(pattern)
+        self.group = group
+        self.transform = transform
+
+    def __call__(self, page):
+        m = self.pattern.search(page.url)
+        if not m:
+            return None
+        value = m.group(self.group)
+        return self.transform(value) if self.transform else value
+
+
+class TextMatch(URLMatch):
+    """在正文上匹配正则"""
+    __slots__ = ()
+    needs_body = True
+
+    def __call__(self, page):
+        m = self.pattern.search(page.text or '')
+        if not m:
+            return None
+        value = m.group(self.group)
+        return self.transform(value) if self.transform else value
+
+
+class TraceField(Extractor):
+    """cdn-cgi/trace 中的字段"""
+    __slots__ = ('name',)
+    needs_body = True
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __call__(self, page):
+        return page.trace.get(self.name)
+
+
+class TraceAllowed(Extractor):
+    """trace 显示访问未被拦截（有 ip 字段且 warp 不是 deny）"""
+    __slots__ = ()
+    needs_body = True
+
+    def __call__(self, page):
+        trace = page.trace
+        return trace.get('warp') != 'deny' and trace.get('ip') is not None
+
+
+class Fetch:
+    """
+    规划后的唯一抓取：mode 为 'probe'（HEAD/小预算 GET）或 'get'（流式 GET）。
+    redirect_stop 为编译后的正则时，跳转目标匹配即停止跟随重定向。
+    byte_budget 为 probe 回退到流式 GET 时最多读取的字节数。
+    """
+    __slots__ = ('url', 'headers', 'mode', 'needs_body', 'redirect_stop', 'byte_budget', 'key')
+
+    def __init__(self, url: str, headers, mode: str, needs_body: bool, redirect_stop=None,
+                 byte_budget: int = PROBE_BYTE_BUDGET):
+        self.url = url
+        self.headers = headers
+        self.mode = mode
+        self.needs_body = needs_body
+        self.redirect_stop = redirect_stop
+        self.byte_budget = byte_budget
+        self.key = (url, tuple(sorted(headers.items())))
+
+
+# 引擎附加在结果上的状态标记（不属于检查本身的字段）
+RESULT_FLAGS = frozenset({'timed_out', 'circuit_open', 'cached', 'stale'})
+
+
+def default_report(name: str, result) -> List[str]:
+    """未声明 report 的检查的文本输出：有 available 字段时先输出可用性，其余字段逐行输出"""
+    lines = []
+    if 'available' in result:
+        lines.append(f"{name}: {'Available' if result['available'] else 'Not Available'}")
+    for key, value in result.items():
+        if key != 'available' and key not in RESULT_FLAGS:
+            if isinstance(value, (list, tuple)):
+                value = ', '.join(map(str, value)) or '-'
+            lines.append(f"{key}: {value}")
+    return lines
+
+
+def report_available(label: str):
+    """只关心可用性的检查的 report：输出 '<label>: Available / Not Available'"""
+    def report(result) -> List[str]:
+        return [f"{label}: {'Available' if result.get('available') else 'Not Available'}"]
+    return report
+
+
+class CheckSpec:
+    """
+    一个检查的声明。
+    method 非空时表示自定义检查（调用 GeoIPChecker 上的同名方法），只使用 default；
+    否则在 urls 中取第一个有结论的响应，用 fields 中的提取器生成结果。
+    多个 URL 的尝试方式由 strategy 决定：
+      'sequential' 前一个失败后才尝试下一个；
+      'race'       所有 URL 同时请求；
+      'hedge'      前一个在 hedge_delay 秒内没有结论（或已失败）就启动下一个。
+    后两种取到结论后取消其余尝试。
+    抓取失败或 require 中的字段未命中时返回 default，其余未命中的字段取 default 中的同名值；
+    检测超过全局截止时间时返回 default 并加上 timed_out 标记。
+    ttl 为结果缓存时间（秒，按出口公网 IP 缓存），0 表示每次都实时检测。
+    redirect_stop 为 URL 正则：只凭跳转目标就能得出结论的检查，在第一个匹配的跳转处停止跟随，
+    以跳转目标作为最终 URL（仅当共享同一抓取的检查都声明了相同的 redirect_stop 时生效）。
+    byte_budget 为 probe 模式下站点拒绝 HEAD、回退到流式 GET 时最多读取的字节数
+    （多个检查共享同一抓取时取其中最大的预算）。
+    title 为文本报告中的小节标题（默认为 name）；report(result) 返回该小节的文本行，
+    未声明时由 default_report 输出可用性与各字段。
+    """
+    __slots__ = ('name', 'method', 'urls', 'fields', 'default', 'require', 'mode', 'headers',
+                 'strategy', 'hedge_delay', 'ttl', 'redirect_stop', 'byte_budget', 'title', 'report')
+
+    def __init__(self, name: str, method: Optional[str] = None, urls=(), fields=None, default=None,
+                 require=(), mode: str = 'probe', headers=None, strategy: str = 'sequential',
+                 hedge_delay: float = 0.3, ttl: float = 1800, redirect_stop: Optional[str] = None,
+                 byte_budget: int = PROBE_BYTE_BUDGET, title: Optional[str] = None, report=None):
+        self.name = name
+        self.title = title or name
+        self.report = report or functools.partial(default_report, name)
+        self.method = method
+        self.urls = (urls,) if isinstance(urls, str) else tuple(urls)
+        self.fields = MappingProxyType(dict(fields or {}))
+        self.default = MappingProxyType(dict(default or {}))
+        self.require = tuple(require)
+        self.headers = MappingProxyType(dict(headers or {}))
+        # 任一提取器需要正文时必须取正文
+        self.mode = 'get' if any(e.needs_body for e in self.fields.values()) else mode
+        self.strategy = strategy
+        self.hedge_delay = hedge_delay
+        self.ttl = ttl
+        self.redirect_stop = re.compile(redirect_stop) if redirect_stop else None
+        self.byte_budget = byte_budget
+
+    def conclusive(self, page: Optional[FetchedPage]) -> bool:
+        """响应是否足以得出结论（抓取成功且 require 中的字段都已命中）"""
+        return page is not None and all(self.fields[key](page) is not None for key in self.require)
+
+    def timed_out(self) -> Dict[str, Any]:
+        return {**self.default, 'timed_out': True}
+
+    def evaluate(self, page: Optional[FetchedPage]) -> Dict[str, Any]:
+        if page is None:
+            return dict(self.default)
+        result = {key: extract(page) for key, extract in self.fields.items()}
+        if any(result[key] is None for key in self.require):
+            return dict(self.default)
+        return {key: self.default.get(key, 'Unknown') if value is None else value
+                for key, value in result.items()}
+
+
+class CheckRegistry:
+    """
+    有序的检查注册表（顺序即输出顺序）。
+    构造时完成规划：相同 (URL, 请求头) 的抓取合并为一个 Fetch，
+    任一使用者需要 GET / 正文时，合并后的抓取就取 GET / 正文。
+    """
+
+    def __init__(self, specs: Iterable[CheckSpec]):
+        self.specs = {spec.name: spec for spec in specs}
+        merged = {}
+        stops = {}
+        budgets = {}
+        for spec in self.specs.values():
+            needs_body = any(e.needs_body for e in spec.fields.values())
+            for url in spec.urls:
+                key = (url, tuple(sorted(spec.headers.items())))
+                mode, body = merged.get(key, ('probe', False))
+                merged[key] = ('get' if 'get' in (mode, spec.mode) else 'probe', body or needs_body)
+                stops.setdefault(key, set()).add(spec.redirect_stop.pattern if spec.redirect_stop else None)
+                budgets[key] = max(budgets.get(key, 0), spec.byte_budget)
+        fetches = {}
+        for key, (mode, body) in merged.items():
+            # 提前停止只在所有使用者都声明了同一个 redirect_stop 时生效
+            stop = next(iter(stops[key])) if len(stops[key]) == 1 else None
+            fetches[key] = Fetch(key[0], MappingProxyType(dict(key[1])), mode, body, re.compile(stop) if stop else None,
+                                 budgets[key])
+        self.plans = {
+            spec.name: tuple(fetches[(url, tuple(sorted(spec.headers.items())))] for url in spec.urls)
+            for spec in self.specs.values()
+        }
+        self.fetches = tuple(fetches.values())
+
+    def __iter__(self):
+        return iter(self.specs.values())
+
+    def __getitem__(self, name: str) -> CheckSpec:
+        return self.specs[name]
+
+    def get(self, name: str) -> Optional[CheckSpec]:
+        return self.specs.get(name)
+
+    def fetch_for(self, url: str) -> Fetch:
+        """URL 对应的已规划抓取（与使用它的检查共享）；未规划时返回一个取正文的新抓取"""
+        for fetch in self.fetches:
+            if fetch.url == url and not fetch.headers and fetch.needs_body:
+                return fetch
+        return Fetch(url, MappingProxyType({}), 'get', True)
+
+
+class FetchCache:
+    """
+    单次检测内的抓取去重：同一 Fetch 只请求一次，并发的使用者等待同一个结果。
+    通过 contextvar 传递，引擎在每次检测开始时创建。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key, fetch):
+        with self._lock:
+            future = self._entries.get(key)
+            owner = future is None
+            if owner:
+                future = self._entries[key] = Future()
+        if owner:
+            try:
+                future.set_result(fetch())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+
+_current_fetches = contextvars.ContextVar('geoip_current_fetches', default=None)
+
+# 可被放弃的各层尝试（检查本身、竞速 / 对冲中的单个 URL）：每层一个 threading.Event，放弃时 set()。
+# 被放弃的尝试仍在工作线程中阻塞的请求结束时不再打印错误（结果已不会被使用，报告可能已经输出）
+_current_attempt = contextvars.ContextVar('geoip_current_attempt', default=())
+
+
+def _run_attempt(abandoned: threading.Event, func, *args):
+    """在（复制的）上下文中以一层新的尝试执行 func(*args)，abandoned 被 set() 即视为放弃"""
+    _current_attempt.set(_current_attempt.get() + (abandoned,))
+    return func(*args)
+
+
+def _log_request_error(url: str, error: Exception):
+    """打印请求错误；所在的任一层尝试已被放弃时不打印"""
+    if not any(abandoned.is_set() for abandoned in _current_attempt.get()):
+        print(f"请求错误 ({url}): {str(error)}")
+
+
+# 出口公网 IP 来源（Cloudflare trace 的 ip 字段）
+EGRESS_TRACE_URL = 'https://www.cloudflare.com/cdn-cgi/trace'
+# 地区类结果的缓存时间（秒）
+REGION_TTL = 6 * 3600
+# Amazon 国别站点域名（amazon.co.jp / amazon.de 等），跳转目标命中即可得出结论
+AMAZON_CCTLD_PATTERN = r'amazon\.(?:com?\.)?([a-z]{2})\b'
+
+
+def _report_dns(result) -> List[str]:
+    lines = [f"Public IP: {result.get('public_ip', 'Unknown')} ({result.get('public_country', 'Unknown')})",
+             f"DNS IP   : {result.get('dns_ip', 'Unknown')} ({result.get('dns_country', 'Unknown')})"]
+    if result.get('public_lists'):
+        lines.append(f"公网 IP 所属列表: {', '.join(result['public_lists'])}")
+    if result.get('match'):
+        lines.append("✅ 公网 IP 与 DNS 服务器属于同一国家")
+    else:
+        lines.append("⚠️  公网 IP 与 DNS 服务器国家不一致")
+    return lines
+
+
+def _report_region(label: str):
+    """可用时输出 '<label> 地区: region (country)' 的 report"""
+    def report(result) -> List[str]:
+        if result.get('available'):
+            return [f"{label} 地区: {result.get('region')} ({result.get('country')})"]
+        return [f"{label}: Not Available"]
+    return report
+
+
+def _report_disney(result) -> List[str]:
+    if result.get('available'):
+        return [f"Disney+ Region: {result.get('region')}"]
+    return ["Disney+: Not Available"]
+
+
+def _report_openai(result) -> List[str]:
+    if result.get('available'):
+        return [f"OpenAI Country: {result.get('country')} (Available)"]
+    return ["OpenAI: Not Available"]
+
+
+CHECK_REGISTRY = CheckRegistry([
+    # trace 同时提供出口公网 IP（结果缓存的键），因此不缓存、每次实时获取
+    CheckSpec('Cloudflare', urls=EGRESS_TRACE_URL, ttl=0, title='Cloudflare (最快)',
+              fields={'location': TraceField('loc'), 'ip': TraceField('ip')},
+              default={'location': 'Unknown', 'ip': 'Unknown'},
+              report=lambda r: [f"Cloudflare Location: {r.get('location', 'Unknown')}"]),
+    CheckSpec('DNSMatch', method='check_dns_country_match', ttl=600, title='DNS & 本地解析服务器检测',
+              default={'public_ip': 'Unknown', 'public_country': 'Unknown', 'public_lists': (),
+                       'dns_ip': 'Unknown', 'dns_country': 'Unknown', 'dns_lists': (), 'match': False},
+              report=_report_dns),
+    # 各服务的地区判定对同一出口 IP 很少变化，缓存 REGION_TTL
+    CheckSpec('Netflix', method='check_netflix', ttl=REGION_TTL, title='Netflix 国家识别',
+              default={'available': False, 'country': 'Unknown', 'region': 'Unknown'},
+              report=_report_region('Netflix')),
+    CheckSpec('YouTube', method='check_youtube_premium', ttl=REGION_TTL, title='YouTube Premium 国家检测',
+              default={'available': False, 'country': 'Unknown', 'region': 'Unknown'},
+              report=_report_region('YouTube Premium')),
+    CheckSpec('Google', method='check_google_location', ttl=REGION_TTL, title='Google 位置检测',
+              default={'location': 'Unknown', 'method': 'unknown'},
+              report=lambda r: [f"Google Location: {r.get('location', 'Unknown')}"]),
+    # 跳转到的国别站点（amazon.co.jp / amazon.de 等）；留在 amazon.com 时为 Unknown，跳转到国别站点即停止跟随
+    CheckSpec('Amazon', urls='https://www.amazon.com/', ttl=REGION_TTL, redirect_stop=AMAZON_CCTLD_PATTERN,
+              fields={'country': URLMatch(AMAZON_CCTLD_PATTERN, transform=str.upper), 'url': FinalURL()},
+              default={'country': 'Unknown', 'url': 'Unknown'}, require=('country',), title='Amazon 站点跳转检测',
+              report=lambda r: [f"Amazon Country: {r.get('country', 'Unknown')}",
+                                f"Amazon URL: {r.get('url', 'Unknown')}"]),
+    CheckSpec('DisneyPlus', urls='https://www.disneyplus.com/', mode='get', ttl=REGION_TTL, title='Disney+ 检测',
+              fields={'available': Const(True), 'region': HeaderValue('physical-location')},
+              default={'available': False, 'region': 'Unknown'}, report=_report_disney),
+    CheckSpec('X', urls='https://twitter.com/', fields={'available': StatusIs(200)}, default={'available': False},
+              title='X (Twitter) 可用性检测', report=report_available('X (Twitter)')),
+    CheckSpec('TikTok', urls='https://www.tiktok.com/', fields={'available': StatusIs(200)},
+              default={'available': False}, title='TikTok 可用性检测'),
+    # chat.openai.com 未及时响应时对冲请求备用域名 chatgpt.com；warp=deny 表示被 Cloudflare 拦截
+    CheckSpec('OpenAI', urls=('https://chat.openai.com/cdn-cgi/trace', 'https://chatgpt.com/cdn-cgi/trace'),
+              strategy='hedge', fields={'available': TraceAllowed(), 'country': TraceField('loc')},
+              default={'available': False, 'country': 'Unknown'},
+              title='OpenAI (chat.openai.com) 可用性检测', report=_report_openai),
+    # 多端点同时尝试，任一可用即可
+    CheckSpec('Facebook', urls=('https://www.facebook.com/favicon.ico', 'https://m.facebook.com/favicon.ico',
+                                'https://graph.facebook.com/robots.txt'),
+              mode='get', strategy='race', fields={'available': StatusIs(200)}, default={'available': False},
+              title='Facebook 可用性检测'),
+    CheckSpec('Instagram', urls='https://www.instagram.com/', fields={'available': StatusIs(200)},
+              default={'available': False}, title='Instagram 可用性检测'),
+    CheckSpec('Telegram', urls='https://web.telegram.org/', fields={'available': StatusIs(200)},
+              default={'available': False}, title='Telegram 可用性检测'),
+])
+
+
+# ---------------------------------------------------------------------------
+# 结果缓存（进程内 LRU + SQLite 持久化，stale-while-revalidate）
+# ---------------------------------------------------------------------------
+DEFAULT_CACHE_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                                  'geoip_check', 'results.sqlite')
+# IP → 国家的缓存时间（秒）
+COUNTRY_TTL = 7 * 86400
+# 后台刷新专用线程池的大小（所有 GeoIPChecker 共用）
+REVALIDATE_WORKERS = 4
+
+_REVALIDATE_EXECUTOR = None
+_REVALIDATE_EXECUTOR_LOCK = threading.Lock()
+
+
+def revalidate_executor() -> ThreadPoolExecutor:
+    """
+    返回后台刷新专用的线程池。刷新任务（如 race / hedge 检查）会把子请求提交到共享线程池并阻塞等待，
+    若刷新本身也占用共享线程池的工作线程，刷新任务占满线程池时就会互相等待而死锁，因此单独运行。
+    """
+    global _REVALIDATE_EXECUTOR
+    if _REVALIDATE_EXECUTOR is None:
+        with _REVALIDATE_EXECUTOR_LOCK:
+            if _REVALIDATE_EXECUTOR is None:
+                _REVALIDATE_EXECUTOR = ThreadPoolExecutor(max_workers=REVALIDATE_WORKERS,
+                                                          thread_name_prefix='geoip-revalidate')
+    return _REVALIDATE_EXECUTOR
+
+
+class ResultCache:
+    """
+    两级结果缓存，键为 (scope, name)：检查结果的 scope 为出口公网 IP，国家查询为 'ip:<地址>'。
+    第一级是进程内 LRU（最多 max_entries 条），第二级是可选的 SQLite 文件（多进程 / 多次运行共享）。
+    条目在 ttl 秒内为 fresh；之后 stale_for 秒内为 stale（照常返回，由调用方在后台刷新）；再之后视为未命中。
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 4096, stale_for: float = 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.stale_for = stale_for
+        self._lru = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS results (scope TEXT, name TEXT, value TEXT, '
+                             'stored REAL, ttl REAL, PRIMARY KEY (scope, name))')
+
+    def _remember(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, scope: str, name: str):
+        """返回 (value, 'fresh' | 'stale')，未命中或已过期返回 None"""
+        key = (scope, name)
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute('SELECT value, stored, ttl FROM results WHERE scope = ? AND name = ?',
+                                       key).fetchone()
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1], row[2])
+                    self._remember(key, entry)
+            if entry is None:
+                return None
+            self._lru.move_to_end(key)
+        value, stored, ttl = entry
+        age = time.time() - stored
+        if age < ttl:
+            return value, 'fresh'
+        if age < ttl + self.stale_for:
+            return value, 'stale'
+        return None
+
+    def put(self, scope: str, name: str, value, ttl: float):
+        if ttl <= 0:
+            return
+        entry = (value, time.time(), ttl)
+        with self._lock:
+            self._remember((scope, name), entry)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                                 (scope, name, json.dumps(value, ensure_ascii=False), entry[1], ttl))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
 
 class GeoIPChecker:
-    def __init__(self, timeout: int = 1, tmp_dir: str = '/tmp/geoip_check/'):
+    def __init__(self, timeout: int = 1, tmp_dir: str = '/tmp/geoip_check/', max_workers: int = 32,
+                 proxy: Optional[str] = None, executor: Optional[ThreadPoolExecutor] = None,
+                 request_limit: Optional[int] = None, mmdb_path: Optional[str] = None,
+                 remote_country_fallback: bool = True, cidr_index: Optional[CIDRIndex] = None,
+                 dump_every: int = 20, metrics: Optional[Metrics] = None,
+                 host_overrides: Optional[Dict[str, str]] = None, registry: Optional[CheckRegistry] = None,
+                 deadline: Optional[float] = None, breakers: Optional[CircuitBreakers] = None,
+                 retry_budget: Optional[RetryBudget] = None, cache: Optional[ResultCache] = None,
+                 resolver: Optional[DNSResolver] = None, warm_up: bool = True):
         self.timeout = timeout
+        # asyncio 引擎用于执行阻塞请求的共享线程池大小（与检查项/出口数量无关）
+        self.max_workers = max_workers
+        # 外部传入的线程池（fleet 模式下所有代理共享），由调用方负责关闭
+        self._executor = executor
+        self._owns_executor = executor is None
+        # 本实例同时在途的请求上限（fleet 模式的单代理并发），None 表示不限制
+        self.request_limit = request_limit
+        self._request_sem = None
+        # 跨实例共享的全局并发闸门（fleet 模式设置）
+        self.global_sem = None
+        self.proxy = proxy
+        # 分阶段耗时与计数指标（fleet 模式可传入共享实例）
+        self.metrics = metrics if metrics is not None else Metrics()
+        # 单个响应解压后正文的大小上限
+        self.max_body_bytes = MAX_BODY_BYTES
+        # YouTube / Google 页面使用流式扫描（False 时退回 BeautifulSoup 整页解析）
+        self.stream_html = True
+        # 本地国家库（未找到时为 None），以及本地未命中时是否回退到 api.country.is
+        self.country_db = open_country_db(mmdb_path)
+        self.remote_country_fallback = remote_country_fallback
+        # 公网 / DNS IP 所属列表（cn、5ufhk、tor 等）的成员索引
+        self.cidr_index = cidr_index if cidr_index is not None else default_cidr_index()
+        # 检查注册表（决定检查项、抓取合并与输出顺序）
+        self.registry = registry if registry is not None else CHECK_REGISTRY
+        # 一次完整检测的截止时间（秒），None 表示等待所有检查完成
+        self.deadline = deadline
         self.session = requests.Session()
+        if proxy:
+            self.session.proxies = {'http': proxy, 'https': proxy}
         # 配置 SSL 验证
         self.session.verify = True
-        # 配置重试策略
-        retry_strategy = requests.adapters.Retry(
+        # 按主机 / 出口的熔断器（可跨实例共享），本出口的重试预算
+        self.breakers = breakers if breakers is not None else CircuitBreakers()
+        self.egress = proxy or 'direct'
+        self.retry_budget = retry_budget if retry_budget is not None else RetryBudget()
+        # 配置重试策略（受重试预算约束）
+        self.retry_strategy = geoip_http.BudgetedRetry(
             total=2,
             backoff_factor=0.5,
             status_forcelist=[500, 502, 503, 504]
         )
-        adapter = requests.adapters.HTTPAdapter(max_retries=retry_strategy)
+        self.retry_strategy.budget = self.retry_budget
+        # 各检查最近一次的有效结果（熔断时作为缓存结果返回）
+        self._last_results = {}
+        # 按出口 IP 的结果缓存（None 表示不缓存），以及正在后台刷新的键
+        self.cache = cache
+        self._revalidating = set()
+        self._revalidating_lock = threading.Lock()
+        # 连接池大小与并发度一致，避免高并发时连接被丢弃重建
+        self.pool_size = request_limit or max_workers
+        # 主机改发表（见 geoip_http.TracingHTTPAdapter），默认为空
+        self.host_overrides = dict(host_overrides or {})
+        # DNS 解析缓存（默认进程内共享）
+        self.resolver = resolver if resolver is not None else DEFAULT_RESOLVER
+        adapter = self._new_adapter(len(CHECK_HOSTS))
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
+        for host in CHECK_HOSTS:
+            self.session.mount(f"https://{host}/", self._new_adapter(1))
 
-        # 默认 User-Agent
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1'
-        })
-        # 特定网站的 User-Agent
-        self.special_agents = {
-            'facebook.com': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1',
-            'chatgpt.com': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Edg/121.0.0.0',
-            'chat.openai.com': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Edg/121.0.0.0'
-        }
+        # 默认请求头只在此处设置一次，之后不再修改（多线程共享 Session 安全）
+        self.session.headers.clear()
+        self.session.headers.update(DEFAULT_HEADERS)
+        # 特定网站的请求头（只读配置，逐请求合并）
+        self.header_profiles = HEADER_PROFILES
         self.tmp_dir = tmp_dir
-        os.makedirs(self.tmp_dir, exist_ok=True)
-        # 清理 tmp_dir 下所有旧的 .txt 临时文件
-        for fname in os.listdir(self.tmp_dir):
-            if fname.endswith('.txt'):
-                try:
-                    os.remove(os.path.join(self.tmp_dir, fname))
-                except Exception as e:
-                    print(f"无法删除临时文件 {fname}: {e}")
+        # 调试转储交给后台写入器：按 dump_every 采样、失败必存、目录按大小/年龄轮转
+        self.artifacts = get_artifact_sink(tmp_dir, sample_every=dump_every)
+        # 启动时在后台并发预解析所有需要直连的主机、预编译国家名匹配器，检查开始时多已就绪
+        if warm_up:
+            self.prefetch_dns()
+            self._get_executor().submit(country_matcher)
 
-    def decode_response(self, response):
+    def decode_response(self, response) -> str:
         """
-        自动解压 response 内容，支持 brotli、gzip、deflate，fallback 用 response.text 或 content.decode。
-        打印 Content-Encoding 及每一步日志。
+        返回响应正文文本：正文只解压一次（见 read_body），文本只解码一次并缓存在响应上，
+        解析、调试转储与各提取器共用同一份结果。
         """
-        encoding = response.headers.get('Content-Encoding', '').lower()
-        print(f"[decode_response] Content-Encoding: {encoding}")
-        # 顺序尝试 brotli, gzip, deflate
-        # Brotli
-        if 'br' in encoding and brotli is not None:
-            try:
-                decoded = brotli.decompress(response.content).decode('utf-8', errors='replace')
-                print("[decode_response] Brotli 解压成功")
-                return decoded
-            except Exception as e:
-                print(f"[decode_response] Brotli 解压失败: {e}")
-        # Gzip
-        if 'gzip' in encoding:
+        text = getattr(response, 'decoded_text', None)
+        if text is None:
+            cpu = time.thread_time()
             try:
-                decoded = gzip.decompress(response.content).decode('utf-8', errors='replace')
-                print("[decode_response] Gzip 解压成功")
-                return decoded
-            except Exception as e:
-                print(f"[decode_response] Gzip 解压失败: {e}")
-        # Deflate
-        if 'deflate' in encoding:
-            try:
-                import zlib
-                decoded = zlib.decompress(response.content).decode('utf-8', errors='replace')
-                print("[decode_response] Deflate 解压成功")
-                return decoded
-            except Exception as e:
-                print(f"[decode_response] Deflate 解压失败: {e}")
-        # 没有 Content-Encoding 或都解压失败，尝试 text
+                data = read_body(response, self.max_body_bytes)
+            except (requests.RequestException, ValueError, zlib.error) as e:
+                print(f"[decode_response] 正文解码失败 ({response.url}): {e}")
+                data = b''
+            text = data.decode(self._charset(response), errors='replace')
+            response.decoded_text = text
+            _trace_add('decode_cpu', time.thread_time() - cpu)
+        return text
+
+    @staticmethod
+    def release_body(response):
+        """
+        提取完成后立即释放响应占用的内存：丢弃原始正文与缓存的解码文本，关闭连接
+        （未读完的流式正文不再下载）。之后不能再读取该响应的正文。
+        """
+        response.decoded_text = None
+        if response._content_consumed:
+            response._content = b''
+        response.close()
+
+    @staticmethod
+    def _charset(response) -> str:
+        """只采用 Content-Type 中显式声明的字符集，否则按 UTF-8（不用 requests 的 ISO-8859-1 默认值）"""
+        if 'charset=' in response.headers.get('Content-Type', '').lower() and response.encoding:
+            return response.encoding
+        return 'utf-8'
+
+    def iter_body_text(self, response):
+        """
+        流式产出解压并解码后的正文文本块；生成器关闭（提前 break）时立即关闭连接。
+        已完整读取的响应直接产出缓存的文本。
+        """
+        if getattr(response, 'decoded_text', None) is not None or response._content_consumed:
+            yield self.decode_response(response)
+            return
+        decoder = BodyDecoder(response.headers.get('Content-Encoding', ''), self.max_body_bytes)
+        text_decoder = codecs.getincrementaldecoder(self._charset(response))(errors='replace')
+        waited = 0.0
         try:
-            print("[decode_response] 使用 response.text")
-            return response.text
-        except Exception as e:
-            print(f"[decode_response] response.text 失败: {e}")
+            stream = iter_raw_body(response)
+            while True:
+                # 只统计等待网络数据的时间，解析耗时另计
+                start = time.perf_counter()
+                chunk = next(stream, None)
+                waited += time.perf_counter() - start
+                if chunk is None:
+                    break
+                data = decoder.feed(chunk)
+                if data:
+                    yield text_decoder.decode(data)
+                if decoder.truncated:
+                    break
+            yield text_decoder.decode(b'', final=True)
+        finally:
+            _trace_add('download', waited)
+            _trace_count('bytes', response.raw.tell())
+            response.close()
+
+    def scan_html(self, response, on_text, keep: Optional[list] = None):
+        """
+        边读边用 HTMLTextScanner 扫描正文，on_text 给出结论后立即停止读取 socket。
+        keep 不为 None 时把已读取的文本块追加进去（供调试转储）。返回 on_text 的结论或 None。
+        """
+        scanner = HTMLTextScanner(on_text)
+        cpu = time.thread_time()
         try:
-            print("[decode_response] 使用 response.content.decode('utf-8')")
-            return response.content.decode('utf-8', errors='replace')
-        except Exception as e:
-            print(f"[decode_response] response.content.decode 也失败: {e}")
-            print("[decode_response] 返回空字符串")
-            return ""
-
-    def save_tmp(self, content, suffix: str):
-        """保存内容到临时目录，文件名带时间戳和指定后缀。始终保存为 UTF-8 文本，必要时先 brotli/gzip 解压，打印日志。"""
-        ts = time.strftime('%Y%m%d_%H%M%S')
-        fname = f"{self.tmp_dir.rstrip('/')}/{ts}_{suffix}"
-        text = None
-        # 如果已经是 str，直接保存
-        if isinstance(content, str):
-            print(f"[save_tmp] 内容类型为 str，直接保存到 {fname}")
-            text = content
-        else:
-            # 不是 str，尝试 brotli, gzip, deflate 解压
-            print(f"[save_tmp] 内容类型为 {type(content)}, 尝试解压为文本")
-            # Brotli
-            if brotli is not None:
-                try:
-                    text = brotli.decompress(content).decode('utf-8', errors='replace')
-                    print(f"[save_tmp] Brotli 解压成功，保存到 {fname}")
-                except Exception as e:
-                    print(f"[save_tmp] Brotli 解压失败: {e}")
-            if text is None:
-                try:
-                    text = gzip.decompress(content).decode('utf-8', errors='replace')
-                    print(f"[save_tmp] Gzip 解压成功，保存到 {fname}")
-                except Exception as e:
-                    print(f"[save_tmp] Gzip 解压失败: {e}")
-            if text is None:
-                try:
-                    import zlib
-                    text = zlib.decompress(content).decode('utf-8', errors='replace')
-                    print(f"[save_tmp] Deflate 解压成功，保存到 {fname}")
-                except Exception as e:
-                    print(f"[save_tmp] Deflate 解压失败: {e}")
-            if text is None:
-                try:
-                    text = content.decode('utf-8', errors='replace')
-                    print(f"[save_tmp] 直接 decode('utf-8') 成功，保存到 {fname}")
-                except Exception as e:
-                    print(f"[save_tmp] content.decode 失败: {e}")
-                    text = str(content)
-                    print(f"[save_tmp] 保存 str(content) 到 {fname}")
+            with contextlib.closing(self.iter_body_text(response)) as chunks:
+                for chunk in chunks:
+                    if keep is not None:
+                        keep.append(chunk)
+                    # 高压缩比的正文一块可能解出数 MB，切片喂给解析器以便尽早停止
+                    for i in range(0, len(chunk), BODY_CHUNK_SIZE):
+                        scanner.feed(chunk[i:i + BODY_CHUNK_SIZE])
+                        if scanner.result is not None:
+                            break
+                    if scanner.result is not None:
+                        break
+                else:
+                    scanner.close()
+        except (requests.RequestException, ValueError, zlib.error) as e:
+            print(f"[scan_html] 读取正文失败 ({response.url}): {e}")
+        _trace_add('parse_cpu', time.thread_time() - cpu)
+        return scanner.result
+
+    def save_tmp(self, content, suffix: str, failed: bool = False):
+        """把调试内容交给后台写入器（非阻塞；成功结果按采样保存，failed=True 时总是保存）"""
+        self.artifacts.submit(suffix, content, failed=failed)
+
+    def _new_adapter(self, pool_connections: int) -> requests.adapters.HTTPAdapter:
+        return geoip_http.TracingHTTPAdapter(
+            host_overrides=self.host_overrides,
+            pool_connections=pool_connections,
+            pool_maxsize=self.pool_size,
+            max_retries=self.retry_strategy
+        )
+
+    def dns_hosts(self) -> List[str]:
+        """
+        需要本机解析的主机：经代理时只有代理主机（目标主机由代理解析），
+        否则为各检查直连的主机（被 host_overrides 改发的换成改发目标）。
+        """
+        if self.proxy:
+            return [urllib.parse.urlsplit(self.proxy).hostname or '']
+        hosts = set(CHECK_HOSTS)
+        for fetch in self.registry.fetches:
+            hosts.add(urllib.parse.urlsplit(fetch.url).hostname or '')
+        resolved = []
+        for host in hosts:
+            target = self.host_overrides.get(host, self.host_overrides.get('*'))
+            resolved.append(urllib.parse.urlsplit(target).hostname if target else host)
+        return resolved
+
+    def prefetch_dns(self) -> List[Future]:
+        """在共享线程池中并发预解析 dns_hosts()，立即返回"""
+        return self.resolver.prefetch(self.dns_hosts(), self._get_executor())
+
+    def _request_headers(self, url: str, extra=None) -> Dict[str, str]:
+        """按主机合并请求头：主机配置 < 调用方传入的 headers"""
+        headers = dict(header_profile(url, self.header_profiles))
+        headers.update(extra or {})
+        return headers
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """发送单个请求并记录 ttfb / 重试次数；非流式请求同时记录正文下载耗时与字节数"""
+        host = (urllib.parse.urlsplit(url).hostname or '').lower()
+        if not self.breakers.allow(self.egress, host):
+            _trace_count('short_circuits')
+            raise geoip_http.CircuitOpenError(f'circuit open: {host} via {self.egress}')
+        self.retry_budget.record_request()
+        acc = {}
+        token = _current_request.set(acc)
+        resolver_token = _current_resolver.set(self.resolver)
+        start = time.perf_counter()
         try:
-            with open(fname, 'w', encoding='utf-8') as f:
-                f.write(text)
-        except Exception as e:
-            print(f"[save_tmp] 写入文件失败: {e}")
+            response = self.session.request(method, url, **kwargs)
+        except Exception:
+            _trace_count('errors')
+            self.breakers.record(self.egress, host, False)
+            raise
+        finally:
+            wall = time.perf_counter() - start
+            _current_resolver.reset(resolver_token)
+            _current_request.reset(token)
+        self.breakers.record(self.egress, host, response.status_code < 500)
+        _trace_count('requests')
+        # elapsed 为发出请求到解析完响应头的时间，扣除本次新建连接的耗时即为 TTFB
+        headers_at = response.elapsed.total_seconds()
+        _trace_add('ttfb', headers_at - sum(acc.get(phase, 0.0) for phase in ('dns', 'connect', 'tls')))
+        retries = getattr(response.raw, 'retries', None)
+        _trace_count('retries', len(retries.history) if retries is not None else 0)
+        _trace_count('redirects', len(response.history))
+        if not kwargs.get('stream'):
+            _trace_add('download', wall - headers_at)
+            _trace_count('bytes', len(response.content or b''))
+        return response
 
-    def safe_request(self, url: str, method: str = 'GET', **kwargs) -> Optional[requests.Response]:
-        """安全的请求方法，包含错误处理"""
+    def _release(self, response: requests.Response, byte_budget: int = PROBE_BYTE_BUDGET):
+        """
+        丢弃不再需要的响应：正文不超过 byte_budget 时读完，连接归还连接池供下一个请求复用
+        （同主机的下一跳不必重新握手）；否则直接关闭连接。
+        """
+        try:
+            length = response.headers.get('Content-Length')
+            if not response._content_consumed and (length is None or (length.isdigit() and int(length) <= byte_budget)):
+                response.raw.read(byte_budget, decode_content=False)
+        except Exception:
+            pass
+        finally:
+            response.close()
+
+    def _cookie_state(self) -> tuple:
+        """Session Cookie 的当前状态（用于区分重定向循环与设置 Cookie 后的往返）"""
+        return tuple(sorted((c.domain, c.path, c.name, c.value or '') for c in self.session.cookies))
+
+    def follow_redirects(self, method: str, url: str, stop=None, max_hops: int = MAX_REDIRECTS,
+                         **kwargs) -> requests.Response:
+        """
+        迭代跟随重定向，返回最终响应（response.history 为中间各跳，均已释放）。
+        - 相对 Location 按当前 URL 解析；超过 max_hops 跳抛出 TooManyRedirects；
+          回到已访问的 URL 且 Session 的 Cookie 自上次前往该 URL 以来没有变化时抛出 RedirectLoopError
+          （登录等 A→B→A 的往返在 B 设置 Cookie 后回到 A，不算循环）；
+        - 每一跳按目标主机重新合并请求头（主机配置 < 调用方 headers），不修改共享状态；
+        - 303（以及 POST 的 301/302）之后改用 GET 并丢弃请求体；
+        - stop(下一跳的绝对 URL) 为真时不再跟随，直接返回这个 3xx 响应，
+          并把下一跳 URL 记在 response.redirect_target 上（只需要跳转目标的检查可以省掉后续往返）。
+        """
+        extra = kwargs.pop('headers', None)
+        kwargs.pop('allow_redirects', None)
+        history = []
+        # 已访问的 URL → 前往该 URL 时 Cookie 的状态
+        seen = {url: self._cookie_state()}
+        while True:
+            response = self._send(method, url, headers=self._request_headers(url, extra),
+                                  allow_redirects=False, **kwargs)
+            location = response.headers.get('Location') if response.status_code in REDIRECT_STATUSES else None
+            if not location:
+                break
+            target = urllib.parse.urljoin(url, location)
+            if stop is not None and stop(target):
+                response.redirect_target = target
+                break
+            cookies = self._cookie_state()
+            looped = seen.get(target) == cookies
+            if looped or len(history) >= max_hops:
+                self._release(response)
+                error = geoip_http.RedirectLoopError if looped else requests.exceptions.TooManyRedirects
+                raise error(f'{len(history) + 1} 跳后停止跟随重定向: {url} -> {target}', response=response)
+            self._release(response)
+            history.append(response)
+            _trace_count('redirects')
+            if (response.status_code == 303 and method != 'HEAD') or (
+                    response.status_code in (301, 302) and method == 'POST'):
+                method = 'GET'
+                kwargs.pop('data', None)
+                kwargs.pop('json', None)
+            seen[target] = cookies
+            url = target
+        response.history = history
+        return response
+
+    def safe_request(self, url: str, method: str = 'GET', stop=None, **kwargs) -> Optional[requests.Response]:
+        """
+        安全的请求方法，包含错误处理。默认经 follow_redirects 跟随重定向
+        （stop 见 follow_redirects），allow_redirects=False 时返回第一个响应。
+        """
         try:
-            # 检查是否需要使用特殊的 User-Agent
-            for domain, user_agent in self.special_agents.items():
-                if domain in url:
-                    self.session.headers.update({'User-Agent': user_agent})
-                    break
-            
-            # 设置超时
             kwargs.setdefault('timeout', self.timeout)
-            # 禁用重定向，手动处理
-            kwargs.setdefault('allow_redirects', False)
-            
-            response = self.session.request(method, url, **kwargs)
-            
-            # 处理重定向
-            if response.status_code in (301, 302, 303, 307, 308):
-                redirect_url = response.headers.get('Location')
-                if redirect_url:
-                    return self.safe_request(redirect_url, method, **kwargs)
-            
+            max_hops = MAX_REDIRECTS if kwargs.pop('allow_redirects', True) else 0
+            if max_hops:
+                response = self.follow_redirects(method, url, stop=stop, max_hops=max_hops, **kwargs)
+            else:
+                headers = self._request_headers(url, kwargs.pop('headers', None))
+                response = self._send(method, url, headers=headers, allow_redirects=False, **kwargs)
             response.raise_for_status()
             return response
         except requests.RequestException as e:
-            print(f"请求错误 ({url}): {str(e)}")
+            _log_request_error(url, e)
+            return None
+
+    def probe(self, url: str, byte_budget: int = PROBE_BYTE_BUDGET, stop=None,
+              **kwargs) -> Optional[requests.Response]:
+        """
+        轻量探测：只关心状态码 / 最终 URL 的检查使用。
+        先发 HEAD（跟随重定向，stop 见 follow_redirects）；若站点拒绝 HEAD（4xx/5xx），改用流式 GET，
+        最多读取 byte_budget 字节后立即关闭，不下载完整页面。
+        连接失败时返回 None（不再重试 GET）。返回的 Response 不保证带有完整正文。
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self.follow_redirects('HEAD', url, stop=stop, **kwargs)
+            if response.status_code < 400:
+                return response
+            response = self.follow_redirects('GET', url, stop=stop, stream=True, **kwargs)
+        except requests.RequestException as e:
+            _log_request_error(url, e)
             return None
-        finally:
-            # 恢复默认 User-Agent
-            self.session.headers.update({
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36'
-            })
+        # 正文不超过预算时读完，连接可归还连接池复用；否则直接丢弃连接
+        self._release(response, byte_budget)
+        return response
 
     def get_country(self, ip: str) -> str:
-        """通过 api.country.is 获取 IP 所属国家（ISO 2 字母）"""
+        """获取 IP 所属国家（ISO 2 字母）：优先查本地 MMDB，未命中时可回退 api.country.is"""
         if not ip or ip.lower() == 'unknown':
             return 'Unknown'
+        if self.country_db is not None:
+            code = self.country_db.country_code(ip)
+            if code:
+                return code
+        if not self.remote_country_fallback:
+            return 'Unknown'
+        if self.cache is None:
+            return self._remote_country(ip)
+        scope = f'ip:{ip}'
+        hit = self.cache.get(scope, 'country')
+        if hit is not None:
+            code, state = hit
+            if state == 'stale':
+                self._revalidate((scope, 'country'), functools.partial(self._cache_country, ip))
+            return code
+        return self._cache_country(ip)
+
+    def _remote_country(self, ip: str) -> str:
         resp = self.safe_request(f'https://api.country.is/{ip}')
         if resp:
             try:
@@ -259,65 +2597,155 @@ class GeoIPChecker:
                 return 'Unknown'
         return 'Unknown'
 
+    def _cache_country(self, ip: str) -> str:
+        code = self._remote_country(ip)
+        if code != 'Unknown':
+            self.cache.put(f'ip:{ip}', 'country', code, COUNTRY_TTL)
+        return code
+
+    def egress_ip(self) -> Optional[str]:
+        """出口公网 IP（Cloudflare trace；检测进行中时与 Cloudflare 检查共用同一次抓取）"""
+        page = self.fetch_page(self.registry.fetch_for(EGRESS_TRACE_URL))
+        return page.trace.get('ip') if page is not None else None
+
+    def _cache_egress(self) -> Optional[str]:
+        """结果缓存按出口 IP 分区；查询失败时返回 None（本次不读写缓存），各项检查照常进行"""
+        try:
+            return self.egress_ip()
+        except Exception as e:
+            print(f"出口 IP 查询失败，本次不使用结果缓存: {e}")
+            return None
+
+    def _revalidate(self, key, refresh):
+        """在后台刷新线程池中执行 refresh（同一键同时只刷新一次）"""
+        with self._revalidating_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def run():
+            try:
+                refresh()
+            except Exception as e:
+                print(f"后台刷新失败 {key}: {e}")
+            finally:
+                with self._revalidating_lock:
+                    self._revalidating.discard(key)
+
+        # 使用空白上下文：不计入当前检测的追踪，也不共享本次检测的抓取结果
+        revalidate_executor().submit(contextvars.Context().run, run)
+
+    def _split_cached(self, table: Dict[str, Any], egress: str):
+        """
+        按出口 IP 查结果缓存：fresh 直接使用，stale 先使用并在后台刷新，未命中的留待实时检测。
+        返回 (缓存结果, 需实时检测的检查表)。
+        """
+        cached, live = {}, {}
+        for service, func in table.items():
+            spec = self.registry.get(service)
+            hit = self.cache.get(egress, service) if spec is not None and spec.ttl > 0 else None
+            if hit is None:
+                live[service] = func
+                continue
+            value, state = hit
+            cached[service] = {**value, 'cached': True}
+            if state == 'stale':
+                cached[service]['stale'] = True
+                self._revalidate((egress, service), functools.partial(self._refresh_check, egress, service, func))
+        return cached, live
+
+    def _refresh_check(self, egress: str, service: str, func):
+        self._store_results(egress, {service: self._run_one_traced(service, func)})
+
+    def _store_results(self, egress: str, results: Dict[str, Any]):
+        """把有效结果写入缓存（超时、熔断、失败的结果不缓存）"""
+        for service, result in results.items():
+            spec = self.registry.get(service)
+            if (spec is None or not spec.ttl or not isinstance(result, dict)
+                    or result.get('timed_out') or result.get('circuit_open')):
+                continue
+            self.cache.put(egress, service, result, spec.ttl)
+
     def check_cloudflare(self) -> Dict[str, Any]:
         """检查 Cloudflare 位置"""
-        response = self.safe_request('https://www.cloudflare.com/cdn-cgi/trace')
-        if response:
-            data = dict(line.split('=') for line in response.text.splitlines())
-            return {'location': data.get('loc', 'Unknown')}
-        return {'location': 'Unknown'}
+        return self.run_declared('Cloudflare')
+
+    DNS_CHECK_URL = 'https://only-185936-14-198-202-48.nstool.onmyojigame.com/'
+
+    @staticmethod
+    def _parse_dns_page(text: str):
+        """从 nstool 页面中提取公网 IP 与本地 DNS IP"""
+        m_ip = DNS_PAGE_IP_RE.search(text)
+        m_dns = DNS_PAGE_SERVER_RE.search(text)
+        public_ip = m_ip.group(1) if m_ip else 'Unknown'
+        dns_ip = m_dns.group(1) if m_dns else 'Unknown'
+        return public_ip, dns_ip
+
+    def _dns_result(self, public_ip: str, public_country: str, dns_ip: str, dns_country: str) -> Dict[str, Any]:
+        return {
+            'public_ip': public_ip,
+            'public_country': public_country,
+            'public_lists': self.cidr_index.lookup(public_ip),
+            'dns_ip': dns_ip,
+            'dns_country': dns_country,
+            'dns_lists': self.cidr_index.lookup(dns_ip),
+            'match': public_country != 'Unknown' and public_country == dns_country
+        }
 
     def check_dns_country_match(self) -> Dict[str, Any]:
         """检测公共 IP 与本地 DNS IP 并比较国家是否一致"""
-        response = self.safe_request('https://only-185936-14-198-202-48.nstool.onmyojigame.com/')
+        response = self.safe_request(self.DNS_CHECK_URL, stream=True)
         if response:
-            # 提取两个 IP
-            m_ip = re.search(r'Your IP Address:\s*([\d\.]+)', response.text)
-            m_dns = re.search(r'Your Local DNS Server:\s*([\d\.]+)', response.text)
-            public_ip = m_ip.group(1) if m_ip else 'Unknown'
-            dns_ip = m_dns.group(1) if m_dns else 'Unknown'
+            # 提取两个 IP 后立即释放正文，不在查询国家期间占用内存
+            public_ip, dns_ip = self._parse_dns_page(self.decode_response(response))
+            self.release_body(response)
             public_country = self.get_country(public_ip)
             dns_country = self.get_country(dns_ip)
-            return {
-                'public_ip': public_ip,
-                'public_country': public_country,
-                'dns_ip': dns_ip,
-                'dns_country': dns_country,
-                'match': public_country != 'Unknown' and public_country == dns_country
-            }
-        return {
-            'public_ip': 'Unknown',
-            'public_country': 'Unknown',
-            'dns_ip': 'Unknown',
-            'dns_country': 'Unknown',
-            'match': False
-        }
+            return self._dns_result(public_ip, public_country, dns_ip, dns_country)
+        return self._dns_result('Unknown', 'Unknown', 'Unknown', 'Unknown')
+
+    async def check_dns_country_match_async(self) -> Dict[str, Any]:
+        """check_dns_country_match 的异步版本：两次 get_country 并发执行"""
+        response = await self._to_thread(self.safe_request, self.DNS_CHECK_URL, stream=True)
+        if response:
+            public_ip, dns_ip = self._parse_dns_page(await self._to_thread(self.decode_response, response))
+            self.release_body(response)
+            public_country, dns_country = await asyncio.gather(
+                self._to_thread(self.get_country, public_ip),
+                self._to_thread(self.get_country, dns_ip),
+            )
+            return self._dns_result(public_ip, public_country, dns_ip, dns_country)
+        return self._dns_result('Unknown', 'Unknown', 'Unknown', 'Unknown')
 
     def check_netflix(self) -> Dict[str, Any]:
         """检查 Netflix 国家和可用性（改进）"""
         print("\n3. Netflix 国家识别")
         # 选用一个几乎全球可看的剧集 ID，用于触发地区跳转
         test_title = '80018499'   # House of Cards
-        response = self.safe_request(f'https://www.netflix.com/title/{test_title}', allow_redirects=True)
+        # 跳转目标已带地区代码时不再请求地区页面；只用到 URL、Cookie 与状态码，正文不下载
+        response = self.safe_request(f'https://www.netflix.com/title/{test_title}', stream=True,
+                                     stop=NETFLIX_REGION_RE.search)
         if not response:
             return {'available': False, 'country': 'Unknown', 'region': 'Unknown'}
+        final_url = getattr(response, 'redirect_target', None) or response.url
+        nfvdid_cookie = response.cookies.get('nfvdid')
+        status_code = response.status_code
+        self.release_body(response)
 
-        # ① 首选：从最终跳转 URL 中提取地区代码
-        final_url = response.url
-        region_match = re.search(r'netflix\.com/([a-z]{2}(?:-[a-z]{2})?)/title', final_url)
+        # ① 首选：从跳转 URL 中提取地区代码
+        region_match = NETFLIX_REGION_RE.search(final_url)
         if region_match:
             region = region_match.group(1).lower()      # 例如 hk-en、jp、us
             country = region.split('-')[0].upper()      # 取前两位作为国家码
             return {'available': True, 'country': country, 'region': region}
 
         # ② 备用：尝试解析 nfvdid Cookie（其中包含地区信息）
-        nfvdid_cookie = response.cookies.get('nfvdid')
         if nfvdid_cookie:
             try:
                 # Cookie 是两段 base64，取第一段做简单解码
                 part = nfvdid_cookie.split('%')[0]      # 去掉 URL-encoded 部分尾巴
                 decoded = base64.b64decode(urllib.parse.unquote(part)).decode(errors='ignore')
-                country_match = re.search(r'"country"\s*:\s*"([A-Z]{2})"', decoded)
+                country_match = NETFLIX_COOKIE_COUNTRY_RE.search(decoded)
                 if country_match:
                     country = country_match.group(1)
                     return {'available': True, 'country': country, 'region': country.lower()}
@@ -325,7 +2753,7 @@ class GeoIPChecker:
                 pass
 
         # ③ 如果页面返回 403/404 等错误码，判定为不可用
-        if response.status_code in (403, 404):
+        if status_code in (403, 404):
             return {'available': False, 'country': 'Unknown', 'region': 'Blocked'}
 
         # ④ 未能识别地区，但服务可访问
@@ -334,27 +2762,51 @@ class GeoIPChecker:
     def check_youtube_premium(self) -> Dict[str, Any]:
         """检查 YouTube Premium 可用性和地区（增强地区判断）"""
         print("\n4. YouTube Premium 检测")
-        premium_response = self.safe_request('https://www.youtube.com/premium', allow_redirects=True)
+        premium_response = self.safe_request('https://www.youtube.com/premium', stream=True)
         if not premium_response:
             return {'available': False, 'country': 'Unknown', 'region': 'Unknown'}
-        soup = BeautifulSoup(premium_response.text, 'html.parser')
-        # 检查价格信息
-        price_text = soup.find(string=re.compile(r'HK\\$|NT\\$|\\$|\\d+\\s*港币|\\d+\\s*新台币|\\d+\\s*USD|\\d+\\s*円|¥'))
-        if price_text:
-            if 'HK$' in price_text or '港币' in price_text:
-                return {'available': True, 'country': 'HK', 'region': 'Hong Kong'}
-            elif 'NT$' in price_text or '新台币' in price_text:
-                return {'available': True, 'country': 'TW', 'region': 'Taiwan'}
-            elif 'USD' in price_text or '$' in price_text:
-                return {'available': True, 'country': 'US', 'region': 'United States'}
-            elif '円' in price_text or '¥' in price_text:
-                return {'available': True, 'country': 'JP', 'region': 'Japan'}
-        # 检查地区限制提示
-        region_text = soup.find(string=re.compile(r'not available|unavailable|不可用|利用できません|사용할 수 없음'))
+        if self.stream_html:
+            blocked = []
+
+            def on_text(text, tag):
+                if YOUTUBE_PRICE_RE.search(text):
+                    return self._youtube_price_result(text) or {}
+                if not blocked and YOUTUBE_BLOCKED_RE.search(text):
+                    blocked.append(text)
+                return None
+
+            result = self.scan_html(premium_response, on_text)
+            if result:
+                return result
+            region_text = blocked[0] if blocked else None
+        else:
+            soup = bs4.BeautifulSoup(self.decode_response(premium_response), 'html.parser')
+            # 检查价格信息
+            price_text = soup.find(string=YOUTUBE_PRICE_RE)
+            result = self._youtube_price_result(price_text) if price_text else None
+            # 检查地区限制提示（find 返回的节点引用整棵树，转为 str 后立即释放树与正文）
+            region_text = None if result else str(soup.find(string=YOUTUBE_BLOCKED_RE) or '')
+            del soup, price_text
+            self.release_body(premium_response)
+            if result:
+                return result
         if region_text:
             return {'available': False, 'country': 'Unknown', 'region': 'Blocked'}
         return {'available': True, 'country': 'Unknown', 'region': 'Unknown'}
 
+    @staticmethod
+    def _youtube_price_result(price_text: str) -> Optional[Dict[str, Any]]:
+        """根据价格文本中的货币判断 YouTube Premium 地区"""
+        if 'HK$' in price_text or '港币' in price_text:
+            return {'available': True, 'country': 'HK', 'region': 'Hong Kong'}
+        elif 'NT$' in price_text or '新台币' in price_text:
+            return {'available': True, 'country': 'TW', 'region': 'Taiwan'}
+        elif 'USD' in price_text or '$' in price_text:
+            return {'available': True, 'country': 'US', 'region': 'United States'}
+        elif '円' in price_text or '¥' in price_text:
+            return {'available': True, 'country': 'JP', 'region': 'Japan'}
+        return None
+
     def check_google_location(self) -> dict:
         print("\n5. Google 位置检测")
         # 设置更真实的浏览器特征
@@ -362,7 +2814,7 @@ class GeoIPChecker:
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
             'Accept-Language': 'zh-HK,zh;q=0.9,en;q=0.8',
-            'Accept-Encoding': 'gzip, deflate, br',
+            'Accept-Encoding': ACCEPT_ENCODING,
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
             'Sec-Fetch-Dest': 'document',
@@ -373,58 +2825,48 @@ class GeoIPChecker:
         }
         
         # 只请求 Google 主页
-        home_resp = self.safe_request('https://www.google.com.hk/?hl=zh-HK', headers=headers, allow_redirects=True)
+        home_resp = self.safe_request('https://www.google.com.hk/?hl=zh-HK', headers=headers, stream=True)
         if not home_resp:
             return {'location': 'Unknown', 'method': 'unknown'}
         
-        # 确保响应内容被正确解码
-        try:
-            if 'br' in home_resp.headers.get('Content-Encoding', '').lower():
-                if brotli is not None:
-                    html_content = brotli.decompress(home_resp.content).decode('utf-8', errors='replace')
-                else:
-                    html_content = home_resp.text
-            elif 'gzip' in home_resp.headers.get('Content-Encoding', '').lower():
-                html_content = gzip.decompress(home_resp.content).decode('utf-8', errors='replace')
-            else:
-                html_content = home_resp.text
-        except Exception as e:
-            print(f"[DEBUG] 解码响应内容时出错: {e}")
-            html_content = home_resp.text
-        
-        ts = time.strftime('%Y%m%d_%H%M%S')
-        self.save_tmp(html_content, f'google_home_html_{ts}.txt')
-        
-        # 方法3：从主页底部文本中提取位置信息
-        soup = BeautifulSoup(html_content, "html.parser")
-        menu_words = {
-            'about', 'advertising', 'business', 'how search works', 'privacy', 'terms',
-            'settings', 'advertise', 'store', 'all', 'images', 'videos', 'news', 'shopping',
-            'tools', 'search', 'sign in', 'gmail', 'more', 'maps', 'play', 'youtube', 'drive',
-            'calendar', 'translate', 'photos', 'books', 'blogger', 'contacts', 'docs', 'finance',
-            'groups', 'hangouts', 'keep', 'meet', 'jamboard', 'earth', 'chrome', 'arts & culture',
-            'podcasts', 'stadia', 'duo', 'messages', 'collections', 'forms', 'ads', 'developers',
-            'press', 'location', 'account', 'help', 'send feedback', 'learn more', 'cookies'
-        }
-        
-        # 收集所有可能的短文本
-        short_texts = set()
-        for tag in soup.find_all(['div', 'span', 'p', 'a']):
-            txt = tag.get_text(separator=' ', strip=True)
-            if txt and len(txt) <= 30:
-                t = txt.lower()
-                if t and t not in menu_words and not re.fullmatch(r'\s*', t):
-                    short_texts.add(t)
-        
-        print("[DEBUG] 提取到的短文本候选内容:", short_texts)
-        print("[DEBUG] 用于匹配的国家名:", list(ISO_COUNTRY_LOOKUP.keys())[:10], "... 共", len(ISO_COUNTRY_LOOKUP))
-        
-        # 尝试匹配国家名
-        for text in short_texts:
-            for name_lower, code in ISO_COUNTRY_LOOKUP.items():
-                if name_lower in text:
-                    print(f"[DEBUG] 命中：{text} => {name_lower} => {code}")
-                    return {'location': code, 'country': name_lower.title(), 'method': 'bottom_text'}
+        if self.stream_html:
+            # 边读边匹配文本节点，命中国家名即停止读取；调试转储只包含已读取的部分
+            chunks = []
+
+            def on_text(text, tag):
+                if tag in GOOGLE_TEXT_TAGS and len(text) <= 30 and text.lower() not in GOOGLE_MENU_WORDS:
+                    return country_matcher().search(text)
+                return None
+
+            hit = self.scan_html(home_resp, on_text, keep=chunks)
+            html_content = ''.join(chunks)
+        else:
+            # 正文只解压一次，解析与调试转储共用
+            html_content = self.decode_response(home_resp)
+
+            # 方法3：从主页底部文本中提取位置信息
+            soup = bs4.BeautifulSoup(html_content, "html.parser")
+            # 收集所有可能的短文本（按文档顺序、去重）
+            short_texts = {}
+            for tag in soup.find_all(list(GOOGLE_TEXT_TAGS)):
+                txt = tag.get_text(separator=' ', strip=True)
+                if txt and len(txt) <= 30:
+                    t = txt.lower()
+                    if t not in GOOGLE_MENU_WORDS:
+                        short_texts[t] = None
+            # 所有候选文本拼接后用预编译的多语言国家名匹配器扫描一次
+            hit = country_matcher().search('\n'.join(short_texts))
+            del soup, short_texts
+        # 只保留调试转储用的文本，响应上缓存的正文与连接立即释放
+        self.release_body(home_resp)
+
+        # 提取失败的页面总是保存，成功的按采样保存
+        self.save_tmp(html_content, 'google_home_html.txt', failed=hit is None)
+
+        if hit:
+            name, code = hit
+            print(f"[DEBUG] 命中：{name} => {code}")
+            return {'location': code, 'country': COUNTRY_NAMES_EN.get(code, name), 'method': 'bottom_text'}
         
         # 如果从文本中没有找到位置信息，尝试从 URL 中获取
         if 'google.com.hk' in home_resp.url:
@@ -435,188 +2877,1249 @@ class GeoIPChecker:
 
     def check_amazon(self) -> Dict[str, Any]:
         """检查 Amazon 重定向"""
-        response = self.safe_request('https://www.amazon.com/', allow_redirects=True)
-        if response:
-            match = re.search(r'amazon\.([a-z]{2})', response.url)
-            if match:
-                return {'country': match.group(1).upper(), 'url': response.url}
-        return {'country': 'Unknown', 'url': 'Unknown'}
+        return self.run_declared('Amazon')
 
     def check_disney_plus(self) -> Dict[str, Any]:
-        """检查 Disney+ 国家或可用性"""
-        print("\n7. Disney+ 检测")
-        response = self.safe_request('https://www.disneyplus.com/', allow_redirects=True)
-        if not response:
-            return {'available': False, 'region': 'Unknown'}
-        # 检查返回的physical-location
-        physical_location = response.headers.get('physical-location')
-        if physical_location:
-            return {'available': True, 'region': physical_location}
-        return {'available': True, 'region': 'Unknown'}
+        """检查 Disney+ 国家或可用性（physical-location 响应头）"""
+        return self.run_declared('DisneyPlus')
 
     def check_x(self) -> Dict[str, Any]:
         """检查 X (Twitter) 可用性"""
-        response = self.safe_request('https://twitter.com/', allow_redirects=True)
-        if response and response.status_code == 200:
-            return {'available': True}
-        return {'available': False}
+        return self.run_declared('X')
 
     def check_tiktok(self) -> Dict[str, Any]:
         """检查 TikTok 可用性"""
-        response = self.safe_request('https://www.tiktok.com/', allow_redirects=True)
-        if response and response.status_code == 200:
-            return {'available': True}
-        return {'available': False}
+        return self.run_declared('TikTok')
 
     def check_openai(self) -> Dict[str, Any]:
         """检查 OpenAI ChatGPT 可用性及地区（Cloudflare trace）"""
-        print("\n10. OpenAI (chat.openai.com) 可用性检测")
-        trace_resp = self.safe_request('https://chat.openai.com/cdn-cgi/trace')
-        if not trace_resp:
-            # 尝试备用域名 chatgpt.com
-            trace_resp = self.safe_request('https://chatgpt.com/cdn-cgi/trace')
-        if trace_resp:
-            data = dict(line.split('=') for line in trace_resp.text.splitlines() if '=' in line)
-            loc = data.get('loc', 'Unknown')
-            # 若出现 warp=deny 表示被 Cloudflare 拦截
-            blocked = data.get('warp') == 'deny' or data.get('ip') is None
-            return {'available': not blocked, 'country': loc}
-        # 请求都失败，视为不可用
-        return {'available': False, 'country': 'Unknown'}
+        return self.run_declared('OpenAI')
 
     def check_facebook(self) -> Dict[str, Any]:
         """检查 Facebook 可用性（多端点尝试）"""
-        test_urls = [
-            'https://www.facebook.com/favicon.ico',
-            'https://m.facebook.com/favicon.ico',
-            'https://graph.facebook.com/robots.txt'
-        ]
-        for url in test_urls:
-            resp = self.safe_request(url, allow_redirects=True)
-            if resp and resp.status_code == 200:
-                return {'available': True}
-        return {'available': False}
+        return self.run_declared('Facebook')
 
     def check_instagram(self) -> Dict[str, Any]:
         """检查 Instagram 可用性"""
-        response = self.safe_request('https://www.instagram.com/', allow_redirects=True)
-        if response and response.status_code == 200:
-            return {'available': True}
-        return {'available': False}
+        return self.run_declared('Instagram')
 
     def check_telegram(self) -> Dict[str, Any]:
         """检查 Telegram 可用性"""
-        response = self.safe_request('https://web.telegram.org/', allow_redirects=True)
-        if response and response.status_code == 200:
-            return {'available': True}
-        return {'available': False}
+        return self.run_declared('Telegram')
 
-    def run_all_checks(self):
-        """运行所有检查"""
-        print("开始检测地理位置信息...")
-        print("---------------------------------------")
-        
-        # 使用线程池并行执行检查
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = {
-                executor.submit(self.check_cloudflare): "Cloudflare",
-                executor.submit(self.check_dns_country_match): "DNSMatch",
-                executor.submit(self.check_netflix): "Netflix",
-                executor.submit(self.check_youtube_premium): "YouTube",
-                executor.submit(self.check_google_location): "Google",
-                executor.submit(self.check_amazon): "Amazon",
-                executor.submit(self.check_disney_plus): "DisneyPlus",
-                executor.submit(self.check_x): "X",
-                executor.submit(self.check_tiktok): "TikTok",
-                executor.submit(self.check_openai): "OpenAI",
-                executor.submit(self.check_facebook): "Facebook",
-                executor.submit(self.check_instagram): "Instagram",
-                executor.submit(self.check_telegram): "Telegram"
-            }
-            
-            results = {}
-            for future in as_completed(futures):
+    def fetch_page(self, fetch: Fetch) -> Optional[FetchedPage]:
+        """执行一个规划后的抓取；检测进行中时同一 Fetch 只请求一次"""
+        cache = _current_fetches.get()
+        if cache is None:
+            return self._fetch_page(fetch)
+        return cache.get(fetch.key, functools.partial(self._fetch_page, fetch))
+
+    def _fetch_page(self, fetch: Fetch) -> Optional[FetchedPage]:
+        stop = fetch.redirect_stop.search if fetch.redirect_stop is not None else None
+        if fetch.mode == 'probe':
+            response = self.probe(fetch.url, fetch.byte_budget, headers=dict(fetch.headers), stop=stop)
+        else:
+            response = self.safe_request(fetch.url, headers=dict(fetch.headers), stream=True, stop=stop)
+        if response is None:
+            return None
+        if fetch.needs_body:
+            return FetchedPage(response, self.decode_response(response))
+        # 不需要正文：只保留状态码 / 响应头 / 最终 URL，立即释放连接
+        response.close()
+        return FetchedPage(response)
+
+    def run_declared(self, name: str) -> Dict[str, Any]:
+        """按注册表声明执行检查：按 strategy 尝试各 URL，取第一个有结论的响应求值"""
+        spec = self.registry[name]
+        plan = self.registry.plans[name]
+        if spec.strategy == 'sequential' or len(plan) == 1:
+            for fetch in plan:
+                page = self.fetch_page(fetch)
+                if spec.conclusive(page):
+                    return spec.evaluate(page)
+            return spec.evaluate(None)
+        executor = self._get_executor()
+        remaining = list(plan)
+        pending = set()
+        attempts = {}
+        try:
+            while remaining or pending:
+                if remaining:
+                    abandoned = threading.Event()
+                    future = executor.submit(contextvars.copy_context().run, _run_attempt, abandoned,
+                                             self.fetch_page, remaining.pop(0))
+                    attempts[future] = abandoned
+                    pending.add(future)
+                    if spec.strategy == 'race' and remaining:
+                        continue
+                done, pending = wait(pending, timeout=spec.hedge_delay if remaining else None,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = future.result()
+                    if spec.conclusive(page):
+                        return spec.evaluate(page)
+            return spec.evaluate(None)
+        finally:
+            # 尚未开始的尝试直接取消；已发出的请求结果被丢弃，其错误不再打印
+            for future in pending:
+                future.cancel()
+                attempts[future].set()
+
+    async def run_declared_async(self, name: str) -> Dict[str, Any]:
+        """run_declared 的异步版本"""
+        spec = self.registry[name]
+        remaining = list(self.registry.plans[name])
+        # sequential 相当于对冲延迟无限长
+        hedge_delay = None if spec.strategy == 'sequential' else spec.hedge_delay
+        pending = set()
+        attempts = {}
+        try:
+            while remaining or pending:
+                if remaining:
+                    abandoned = threading.Event()
+                    task = asyncio.ensure_future(self._to_thread(_run_attempt, abandoned, self.fetch_page,
+                                                                 remaining.pop(0)))
+                    attempts[task] = abandoned
+                    pending.add(task)
+                    if spec.strategy == 'race' and remaining:
+                        continue
+                done, pending = await asyncio.wait(pending, timeout=hedge_delay if remaining else None,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page = task.result()
+                    if spec.conclusive(page):
+                        return spec.evaluate(page)
+            return spec.evaluate(None)
+        finally:
+            for task in pending:
+                task.cancel()
+                attempts[task].set()
+
+    def timed_out_result(self, service: str) -> Dict[str, Any]:
+        """超过全局截止时间的检查结果：该检查的默认结果加 timed_out 标记"""
+        spec = self.registry.get(service)
+        return spec.timed_out() if spec is not None else {'timed_out': True}
+
+    def check_table(self) -> Dict[str, Any]:
+        """服务名 → 检查方法（按注册表顺序，即输出顺序）"""
+        return {
+            spec.name: getattr(self, spec.method) if spec.method else functools.partial(self.run_declared, spec.name)
+            for spec in self.registry
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='geoip')
+        return self._executor
+
+    async def _to_thread(self, func, *args, **kwargs):
+        """在共享线程池中执行阻塞调用，不阻塞事件循环（受全局/单实例并发上限约束）"""
+        loop = asyncio.get_running_loop()
+        # 复制 contextvars，使工作线程中的请求记入当前检查的追踪
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        if self.request_limit and self._request_sem is None:
+            self._request_sem = asyncio.Semaphore(self.request_limit)
+        sems = [sem for sem in (self.global_sem, self._request_sem) if sem is not None]
+        held = []
+        try:
+            for sem in sems:
+                await sem.acquire()
+                held.append(sem)
+            future = self._get_executor().submit(call)
+        except BaseException:
+            for sem in held:
+                sem.release()
+            raise
+        # 许可在线程中的调用真正结束时才归还：截止时间或竞速 / 对冲取消本协程后，
+        # 阻塞中的请求仍在占用连接，提前归还会让新请求叠加在这些请求之上，突破并发上限
+        if held:
+            future.add_done_callback(functools.partial(_release_on_loop, loop, held))
+        return await asyncio.wrap_future(future, loop=loop)
+
+    async def _run_one_async(self, service: str, func):
+        # 声明式检查与有异步版本（子请求可并发）的检查优先使用异步版本
+        spec = self.registry.get(service)
+        if spec is not None and not spec.method:
+            async_func = functools.partial(self.run_declared_async, service)
+        else:
+            async_func = getattr(self, f'{getattr(func, "__name__", "")}_async', None)
+        trace = CheckTrace(service)
+        _current_check.set(trace)  # gather 为每个协程创建独立 Task，上下文互不影响
+        # 检查被取消（超过截止时间）后，仍在工作线程中进行的请求不再打印错误
+        abandoned = threading.Event()
+        _current_attempt.set(_current_attempt.get() + (abandoned,))
+        start = time.perf_counter()
+        try:
+            if async_func is not None:
+                result = await async_func()
+            else:
+                result = await self._to_thread(func)
+            return self._finish_check(service, result, trace)
+        except asyncio.CancelledError:
+            abandoned.set()
+            trace.count('timeouts')
+            raise
+        except Exception as e:
+            print(f"{service} 检查失败: {str(e)}")
+            return None
+        finally:
+            trace.add('total', time.perf_counter() - start)
+            self.metrics.record(trace)
+
+    def _finish_check(self, service: str, result, trace: CheckTrace):
+        """
+        熔断处理：检查的所有请求都被熔断器拦截时，返回该检查上次的有效结果（stale）
+        或本次的不可用结果，并加上 circuit_open 标记；否则记住本次结果。
+        """
+        if trace.counters['short_circuits'] and not trace.counters['requests']:
+            cached = self._last_results.get(service)
+            result = dict(cached if cached is not None else result or {})
+            result.update(circuit_open=True, stale=cached is not None)
+            return result
+        if isinstance(result, dict) and not result.get('timed_out'):
+            # 长期保存的副本使用紧凑表示
+            self._last_results[service] = CheckResult.of(result)
+        return result
+
+    def _run_one_traced(self, service: str, func):
+        """在当前线程中带追踪地执行一个检查（线程池引擎使用）"""
+        trace = CheckTrace(service)
+        token = _current_check.set(trace)
+        start = time.perf_counter()
+        try:
+            return self._finish_check(service, func(), trace)
+        finally:
+            trace.add('total', time.perf_counter() - start)
+            _current_check.reset(token)
+            self.metrics.record(trace)
+
+    async def run_all_checks_async(self, deadline: Optional[float] = None, services: Optional[Iterable[str]] = None,
+                                   refresh: bool = False, on_result=None,
+                                   egress: Optional[str] = None) -> Dict[str, Any]:
+        """
+        asyncio 引擎：所有检查及其子请求在同一事件循环上并发执行。
+        deadline（秒，默认取 self.deadline）到期时取消未完成的检查，
+        其结果以 timed_out_result 代替，已完成的结果照常返回。
+        services 只运行其中的检查；refresh=True 时不读结果缓存（结果仍写入缓存）。
+        egress 为调用方已知的出口 IP（结果缓存的分区键）时不再抓取 trace 查询出口（常驻模式复用上次的出口）。
+        on_result(service, result) 在每个检查得出结果时立即调用（缓存命中的最先、超时的在截止时）。
+        """
+        emit = on_result or (lambda service, result: None)
+        deadline = self.deadline if deadline is None else deadline
+        table = self.check_table()
+        if services is not None:
+            wanted = set(services)
+            table = {service: func for service, func in table.items() if service in wanted}
+        # 本次检测内共享的抓取结果（各 Task 创建时复制上下文，共享同一个 FetchCache）
+        _current_fetches.set(FetchCache())
+        cached, live = {}, table
+        if self.cache is None:
+            egress = None
+        elif egress is None:
+            # 出口查询计入本次检测的截止时间
+            started = time.monotonic()
+            try:
+                egress = await asyncio.wait_for(self._to_thread(self._cache_egress), timeout=deadline)
+            except asyncio.TimeoutError:
+                print("出口 IP 查询超时，本次不使用结果缓存")
+            if deadline is not None:
+                deadline = max(0.0, deadline - (time.monotonic() - started))
+        if egress and not refresh:
+            cached, live = self._split_cached(table, egress)
+        for service, result in cached.items():
+            emit(service, result)
+        tasks = {}
+        for service, func in live.items():
+            task = tasks[service] = asyncio.ensure_future(self._run_one_async(service, func))
+            task.add_done_callback(
+                lambda t, service=service: None if t.cancelled() else emit(service, t.result()))
+        pending = set()
+        if tasks:
+            _, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            # 等待被取消的检查完成清理（记录指标），不等待其阻塞中的请求
+            await asyncio.wait(pending)
+        fresh = {service: self.timed_out_result(service) if task in pending else task.result()
+                 for service, task in tasks.items()}
+        for service, task in tasks.items():
+            if task in pending:
+                emit(service, fresh[service])
+        if egress:
+            self._store_results(egress, fresh)
+        return {service: cached[service] if service in cached else fresh[service] for service in table}
+
+    def _run_checks_threaded(self, deadline: Optional[float] = None, on_result=None) -> Dict[str, Any]:
+        """旧的线程池引擎（最多 5 个检查同时进行）；deadline、on_result 含义同 run_all_checks_async"""
+        deadline = self.deadline if deadline is None else deadline
+        emit = on_result or (lambda service, result: None)
+        context = contextvars.copy_context()
+        context.run(_current_fetches.set, FetchCache())
+        table = self.check_table()
+        cached, live, egress = {}, table, None
+        executor = ThreadPoolExecutor(max_workers=5)
+        if self.cache is not None:
+            # 出口查询计入本次检测的截止时间
+            started = time.monotonic()
+            try:
+                egress = executor.submit(context.copy().run, self._cache_egress).result(timeout=deadline)
+            except FuturesTimeoutError:
+                print("出口 IP 查询超时，本次不使用结果缓存")
+            if deadline is not None:
+                deadline = max(0.0, deadline - (time.monotonic() - started))
+            if egress:
+                cached, live = self._split_cached(table, egress)
+        for service, result in cached.items():
+            emit(service, result)
+        attempts = {service: threading.Event() for service in live}
+        futures = {executor.submit(context.copy().run, _run_attempt, attempts[service], self._run_one_traced,
+                                   service, func): service
+                   for service, func in live.items()}
+        results = {}
+        try:
+            for future in as_completed(futures, timeout=deadline):
                 service = futures[future]
                 try:
                     results[service] = future.result()
                 except Exception as e:
                     print(f"{service} 检查失败: {str(e)}")
                     results[service] = None
+                emit(service, results[service])
+        except FuturesTimeoutError:
+            for future, service in futures.items():
+                if service not in results:
+                    attempts[service].set()
+                    # 耗时由仍在运行的检查结束时自行记录，这里只计超时次数
+                    trace = CheckTrace(service)
+                    trace.count('timeouts')
+                    self.metrics.record(trace)
+                    results[service] = self.timed_out_result(service)
+                    emit(service, results[service])
+        finally:
+            # 不等待仍在进行中的检查（其线程会在请求超时后自行结束）
+            executor.shutdown(wait=False, cancel_futures=True)
+        if egress:
+            self._store_results(egress, results)
+        return {service: cached[service] if service in cached else results[service] for service in table}
 
-        # 按顺序输出结果
-        print("1. Cloudflare (最快)")
-        print(f"Cloudflare Location: {results['Cloudflare']['location']}")
-        print("---------------------------------------")
+    def close(self):
+        """释放线程池与连接池"""
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown(wait=False)
+        self._executor = None
+        self.session.close()
 
-        print("2. DNS & 本地解析服务器检测")
-        dns_result = results['DNSMatch']
-        print(f"Public IP: {dns_result['public_ip']} ({dns_result['public_country']})")
-        print(f"DNS IP   : {dns_result['dns_ip']} ({dns_result['dns_country']})")
-        if dns_result['match']:
-            print("✅ 公网 IP 与 DNS 服务器属于同一国家")
-        else:
-            print("⚠️  公网 IP 与 DNS 服务器国家不一致")
-        print("---------------------------------------")
+    def run_checks(self, engine: str = 'async', deadline: Optional[float] = None, on_result=None) -> Dict[str, Any]:
+        """运行所有检查并返回结果（不打印）；on_result 见 run_all_checks_async"""
+        if engine == 'thread':
+            return self._run_checks_threaded(deadline, on_result=on_result)
+        return asyncio.run(self.run_all_checks_async(deadline, on_result=on_result))
 
-        print("3. Netflix 国家识别")
-        if results['Netflix']['available']:
-            print(f"Netflix 地区: {results['Netflix']['region']} ({results['Netflix']['country']})")
-        else:
-            print("Netflix: Not Available")
+    def run_all_checks(self, engine: str = 'async', deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        运行所有检查并按固定格式打印（同步入口；engine='async' 使用 asyncio 引擎，'thread' 使用旧线程池）。
+        deadline 为整体截止时间（秒），到期未完成的检查带 timed_out 标记返回。
+        """
+        print("开始检测地理位置信息...")
         print("---------------------------------------")
 
-        print("4. YouTube Premium 国家检测")
-        if results['YouTube']['available']:
-            print(f"YouTube Premium 地区: {results['YouTube']['region']} ({results['YouTube']['country']})")
-        else:
-            print("YouTube Premium: Not Available")
-        print("---------------------------------------")
+        results = self.run_checks(engine, deadline)
 
-        print("5. Google 位置检测")
-        print(f"Google Location: {results['Google']['location']}")
-        print("---------------------------------------")
+        self.print_results(results)
+        return results
 
-        print("6. Amazon 站点跳转检测")
-        print(f"Amazon Country: {results['Amazon']['country']}")
-        print(f"Amazon URL: {results['Amazon']['url']}")
-        print("---------------------------------------")
+    def print_results(self, results: Dict[str, Any]):
+        """
+        按注册表顺序输出各检查的小节（检查失败 / 超时的项单独标出，不影响其余输出）。
+        来自结果缓存或因熔断沿用的结果在小节标题后注明，不与实时结果混淆。
+        """
+        cached = False
+        for number, spec in enumerate(self.registry, 1):
+            result = results.get(spec.name)
+            note = self._result_note(result) if result else ''
+            cached = cached or bool(result and result.get('cached'))
+            print(f"{number}. {spec.title}{note}")
+            if not result:
+                print(f"{spec.name}: 检查失败")
+            elif result.get('timed_out'):
+                print(f"{spec.name}: 超时")
+            else:
+                for line in spec.report(result):
+                    print(line)
+            print("---------------------------------------")
 
-        print("7. Disney+ 检测")
-        if results['DisneyPlus']['available']:
-            print(f"Disney+ Region: {results['DisneyPlus']['region']}")
-        else:
-            print("Disney+: Not Available")
-        print("---------------------------------------")
+        if cached:
+            print("标记 [缓存] 的结果来自结果缓存，未实时检测（--no-cache 可强制实时检测）")
+        print("所有检查完成")
 
-        print("8. X (Twitter) 可用性检测")
-        print(f"X (Twitter): {'Available' if results['X']['available'] else 'Not Available'}")
-        print("---------------------------------------")
+    @staticmethod
+    def _result_note(result) -> str:
+        """非实时结果的标记：熔断 / 缓存已过期（后台刷新中）/ 缓存"""
+        if result.get('circuit_open'):
+            return ' [熔断，沿用上次结果]' if result.get('stale') else ' [熔断，未实时检测]'
+        if result.get('stale'):
+            return ' [缓存，已过期，后台刷新中]'
+        if result.get('cached'):
+            return ' [缓存]'
+        return ''
 
-        print("9. TikTok 可用性检测")
-        print(f"TikTok: {'Available' if results['TikTok']['available'] else 'Not Available'}")
-        print("---------------------------------------")
 
-        print("10. OpenAI (chat.openai.com) 可用性检测")
-        if results['OpenAI']['available']:
-            print(f"OpenAI Country: {results['OpenAI']['country']} (Available)")
-        else:
-            print("OpenAI: Not Available")
-        print("---------------------------------------")
+def read_proxies(source: str) -> List[str]:
+    """读取代理列表（文件路径或 '-' 表示 stdin），忽略空行与 # 注释；缺省协议按 http 处理"""
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        proxies = []
+        for line in stream:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if '://' not in line:
+                line = f'http://{line}'
+            proxies.append(line)
+        return proxies
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
 
-        print("11. Facebook 可用性检测")
-        print(f"Facebook: {'Available' if results['Facebook']['available'] else 'Not Available'}")
-        print("---------------------------------------")
 
-        print("12. Instagram 可用性检测")
-        print(f"Instagram: {'Available' if results['Instagram']['available'] else 'Not Available'}")
-        print("---------------------------------------")
+async def _fleet_check(proxy: str, executor: ThreadPoolExecutor, global_sem, per_proxy: int,
+                       checker_kwargs: Dict[str, Any]) -> str:
+    """用独立的 GeoIPChecker 检测一个代理出口，返回一行 JSON 记录（不含换行）"""
+    checker = GeoIPChecker(proxy=proxy, executor=executor, request_limit=per_proxy, **checker_kwargs)
+    checker.global_sem = global_sem
+    started = time.time()
+    try:
+        results = await checker.run_all_checks_async()
+        record = {'proxy': proxy, 'ok': True, 'results': results}
+    except Exception as e:
+        record = {'proxy': proxy, 'ok': False, 'error': str(e)}
+    finally:
+        checker.close()
+    record['elapsed'] = round(time.time() - started, 3)
+    return json.dumps(record, ensure_ascii=False)
 
-        print("13. Telegram 可用性检测")
-        print(f"Telegram: {'Available' if results['Telegram']['available'] else 'Not Available'}")
-        print("---------------------------------------")
 
-        print("所有检查完成")
+async def run_fleet_async(proxies: Iterable[str], out=None, concurrency: int = 64,
+                          per_proxy: int = 4, **checker_kwargs) -> int:
+    """
+    Fleet 模式：在一个事件循环中检测大量代理出口。
+    每个代理使用独立的 GeoIPChecker（独立 Session / 连接池），
+    concurrency 限制全局在途请求数，per_proxy 限制单个代理的在途请求数；
+    每个代理检测完成后立即向 out 写出一行 JSON。返回已完成的代理数。
+    """
+    out = out or sys.stdout
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='geoip-fleet')
+    global_sem = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue()
+    for proxy in proxies:
+        queue.put_nowait(proxy)
+    done = 0
+
+    async def worker():
+        nonlocal done
+        while True:
+            try:
+                proxy = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            out.write(await _fleet_check(proxy, executor, global_sem, per_proxy, checker_kwargs) + '\n')
+            out.flush()
+            done += 1
+
+    # 同时活跃的代理数：保证全局并发能被填满，又不会一次性创建全部 Session
+    active = max(1, min(queue.qsize(), concurrency // max(1, per_proxy) * 2))
+    try:
+        await asyncio.gather(*(worker() for _ in range(active)))
+    finally:
+        executor.shutdown(wait=False)
+    return done
+
+
+def run_fleet(proxies: Iterable[str], out=None, **kwargs) -> int:
+    """run_fleet_async 的同步入口"""
+    return asyncio.run(run_fleet_async(proxies, out=out, **kwargs))
+
+
+# ---------------------------------------------------------------------------
+# 多进程分片 fleet
+# ---------------------------------------------------------------------------
+# 每个子进程检测多少个出口后退出并由新进程接替（限制长时间运行的 RSS 增长）
+FLEET_RECYCLE_AFTER = 500
+# 子进程异常退出（非正常结束）的次数超过 进程数 × 该值 时放弃
+FLEET_MAX_CRASHES_PER_PROCESS = 2
+# 子进程异常退出时其在途的出口重新排队的次数；超过后写出失败记录（避免单个出口反复拖垮子进程）
+FLEET_PROXY_RETRIES = 1
+
+
+def _fleet_shard(conn, recycle_after: int, concurrency: int, per_proxy: int,
+                 cache_path: Optional[str], checker_kwargs: Dict[str, Any]):
+    """
+    分片子进程入口：从与主进程之间的专用管道 conn 逐个领取分派来的代理（每个 worker 收到一个 None 即结束），
+    每个结果以 ('result', 代理, 结果行) 发回；退出前发回 ('exit', 是否因回收而退出, 指标快照)。
+    """
+    # stdout 与主进程共享同一个文件描述符，调试输出改写到 stderr，避免混进 JSONL
+    sys.stdout = sys.stderr
+    metrics = Metrics()
+    cache = ResultCache(cache_path) if cache_path else None
+    kwargs = {**checker_kwargs, 'metrics': metrics, 'breakers': CircuitBreakers(), 'cache': cache}
+    try:
+        recycled = asyncio.run(_fleet_shard_async(conn, recycle_after, concurrency, per_proxy, kwargs))
+    finally:
+        if cache is not None:
+            cache.close()
+    conn.send(('exit', recycled, metrics.snapshot()))
+    conn.close()
+
+
+async def _fleet_shard_async(conn, recycle_after: int, concurrency: int, per_proxy: int,
+                             checker_kwargs: Dict[str, Any]) -> bool:
+    """子进程内的事件循环：与 run_fleet_async 相同的调度，任务改为从主进程分派的管道领取"""
+    loop = asyncio.get_running_loop()
+    active = max(1, concurrency // max(1, per_proxy) * 2)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='geoip-fleet')
+    # 管道的阻塞读写放在独立线程中，不占用检查线程，也不阻塞事件循环；
+    # 锁只在本进程内，进程被杀死时不会像 multiprocessing.Queue 的进程间锁那样留下被持有的锁
+    io = ThreadPoolExecutor(max_workers=active, thread_name_prefix='geoip-shard-io')
+    recv_lock, send_lock = threading.Lock(), threading.Lock()
+    global_sem = asyncio.Semaphore(concurrency)
+    taken = 0
+    exhausted = False
+
+    def take() -> Optional[str]:
+        with recv_lock:
+            return conn.recv()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    async def worker():
+        nonlocal taken, exhausted
+        while not exhausted and taken < recycle_after:
+            # 先占用名额再领取，保证本进程领取的任务数不超过 recycle_after
+            taken += 1
+            proxy = await loop.run_in_executor(io, take)
+            if proxy is None:
+                exhausted = True
+                return
+            line = await _fleet_check(proxy, executor, global_sem, per_proxy, checker_kwargs)
+            # 主进程写出跟不上时管道写满，这里随之阻塞（反压）
+            await loop.run_in_executor(io, send, ('result', proxy, line))
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(active)))
+    finally:
+        executor.shutdown(wait=False)
+        io.shutdown(wait=False)
+    return not exhausted
+
+
+def run_fleet_sharded(proxies: Iterable[str], out=None, processes: Optional[int] = None,
+                      recycle_after: int = FLEET_RECYCLE_AFTER, concurrency: int = 64, per_proxy: int = 4,
+                      cache_path: Optional[str] = None, metrics: Optional[Metrics] = None,
+                      **checker_kwargs) -> int:
+    """
+    多进程 fleet：把代理分片到 processes 个子进程（默认 CPU 核数），
+    每个子进程运行自己的事件循环与 GeoIPChecker（独立 Session、熔断器与结果缓存连接），
+    HTML 解析与解压不再受单个 GIL 限制。
+    - 主进程与每个子进程之间各有一条管道，不共享任何进程间锁，子进程被杀死也不会卡住其他子进程；
+    - 主进程按完成情况分派代理，每个子进程最多 active 个在途，主进程写出变慢时分派随之暂停（反压）；
+    - 子进程检测 recycle_after 个出口后退出并由新进程接替，限制 RSS 增长，未领取的代理改派给其他子进程；
+    - concurrency 为全体子进程合计的在途请求上限，平均分给各子进程；
+    - 子进程的分阶段指标在其退出时汇总进 metrics；
+    - 结束由主进程控制：没有待分派的代理且某子进程不再有在途代理时，才为其每个 worker 发送一个 None；
+    - 子进程异常退出（管道在 exit 消息之前关闭）时，其在途的代理重新排队
+      （最多 FLEET_PROXY_RETRIES 次，之后写出 ok 为 false 的记录），仍有代理待检测时启动新进程接替。
+    checker_kwargs 需可 pickle（不能包含 Metrics / CircuitBreakers / ResultCache 实例），
+    结果缓存改用 cache_path 由各子进程自行打开。返回写出的记录数（每个代理一条）。
+    """
+    out = out or sys.stdout
+    processes = max(1, processes or os.cpu_count() or 1)
+    shard_concurrency = max(1, -(-concurrency // processes))
+    active = max(1, shard_concurrency // max(1, per_proxy) * 2)
+    # spawn：主进程已有线程，fork 出的子进程可能继承被持有的锁
+    context = multiprocessing.get_context('spawn')
+    pending = iter(proxies)
+    retry = collections.deque()
+    exhausted = False
+    # 主进程一端的管道 → 子进程 / 已分派、尚未发回结果的代理
+    live = {}
+    in_flight = {}
+    closing = set()
+    requeued = collections.Counter()
+    done = crashes = 0
+
+    def next_proxy() -> Optional[str]:
+        nonlocal exhausted
+        if retry:
+            return retry.popleft()
+        if not exhausted:
+            try:
+                return next(pending)
+            except StopIteration:
+                exhausted = True
+        return None
+
+    def has_work() -> bool:
+        return bool(retry) or not exhausted
+
+    def send(conn, item: Optional[str]):
+        try:
+            conn.send(item)
+        except OSError:
+            pass  # 子进程已退出：读端随后读到 EOF，按异常退出处理（在途代理重新排队）
+
+    def assign(conn):
+        if conn in closing:
+            return
+        while len(in_flight[conn]) < active:
+            proxy = next_proxy()
+            if proxy is None:
+                break
+            in_flight[conn].append(proxy)
+            send(conn, proxy)
+        if not in_flight[conn] and not has_work():
+            closing.add(conn)
+            for _ in range(active):
+                send(conn, None)
+
+    def spawn():
+        conn, child_conn = context.Pipe()
+        shard_args = (child_conn, recycle_after, shard_concurrency, per_proxy, cache_path, checker_kwargs)
+        proc = context.Process(target=_fleet_shard, args=shard_args, name='geoip-fleet-shard', daemon=True)
+        proc.start()
+        # 只留子进程持有写端，子进程退出后主进程读到 EOF
+        child_conn.close()
+        live[conn], in_flight[conn] = proc, []
+        assign(conn)
+
+    def retire(conn) -> List[str]:
+        proc = live.pop(conn)
+        proc.join()
+        conn.close()
+        closing.discard(conn)
+        return in_flight.pop(conn)
+
+    def reassign():
+        for conn in list(live):
+            assign(conn)
+        # 代理需要重新检测，但存活的子进程都已收到结束标记（或全部退出）时补充新进程
+        if has_work() and all(conn in closing for conn in live):
+            spawn()
+
+    def write(line: str):
+        nonlocal done
+        out.write(line + '\n')
+        out.flush()
+        done += 1
+
+    def crashed(conn):
+        nonlocal crashes
+        proc = live[conn]
+        lost = retire(conn)
+        crashes += 1
+        print(f"[fleet] 子进程 {proc.pid} 异常退出（exitcode={proc.exitcode}），{len(lost)} 个在途出口重新排队",
+              file=sys.stderr)
+        if crashes > processes * FLEET_MAX_CRASHES_PER_PROCESS:
+            raise RuntimeError(f'fleet 子进程反复异常退出（{crashes} 次），放弃')
+        for proxy in lost:
+            requeued[proxy] += 1
+            if requeued[proxy] > FLEET_PROXY_RETRIES:
+                write(json.dumps({'proxy': proxy, 'ok': False, 'error': 'fleet 子进程异常退出'}, ensure_ascii=False))
+            else:
+                retry.append(proxy)
+        reassign()
+
+    for _ in range(processes):
+        spawn()
+    try:
+        while live:
+            for conn in mp_connection.wait(list(live)):
+                if conn not in live:
+                    continue
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    crashed(conn)
+                    continue
+                if message[0] == 'result':
+                    _, proxy, line = message
+                    write(line)
+                    in_flight[conn].remove(proxy)
+                    assign(conn)
+                else:
+                    _, recycled, snapshot = message
+                    if metrics is not None:
+                        metrics.merge(snapshot)
+                    # 回收的子进程可能还有已分派、未领取的代理
+                    retry.extendleft(reversed(retire(conn)))
+                    if recycled and has_work():
+                        spawn()
+                    reassign()
+    finally:
+        for conn, proc in live.items():
+            proc.terminate()
+            conn.close()
+    return done
+
+
+# ---------------------------------------------------------------------------
+# 紧凑结果模型与有界历史（常驻监控 / 熔断回退长期保存的结果）
+# ---------------------------------------------------------------------------
+def _freeze(value):
+    """把结果中的 list / set / dict 转为不可变形式，使结果可哈希（JSON 序列化结果不变）"""
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, collections.abc.Mapping):
+        return CheckResult.of(value)
+    return value
+
+
+class CheckResult(collections.abc.Mapping):
+    """
+    检查结果的紧凑只读表示（__slots__，无实例 dict）：同一检查的结果共享一个驻留的字段名元组，
+    每个结果只保存值元组；可哈希，相同结果可以只保存一份。
+    实现 Mapping 接口，可直接代替原来的 dict 结果（get / [] / ** 展开）；to_dict() 转回普通 dict。
+    """
+    __slots__ = ('fields', 'values', '_hash')
+    # 字段名元组 → 驻留的同一个元组对象
+    _FIELDS = {}
+
+    def __init__(self, fields: tuple, values: tuple):
+        self.fields = fields
+        self.values = values
+        self._hash = None
+
+    @classmethod
+    def of(cls, result) -> 'CheckResult':
+        if isinstance(result, cls):
+            return result
+        keys = tuple(result)
+        return cls(cls._FIELDS.setdefault(keys, keys), tuple(_freeze(v) for v in result.values()))
+
+    def __getitem__(self, key):
+        try:
+            return self.values[self.fields.index(key)]
+        except ValueError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((self.fields, self.values))
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, CheckResult):
+            return self.fields == other.fields and self.values == other.values
+        return super().__eq__(other)
+
+    def to_dict(self) -> Dict[str, Any]:
+        def thaw(value):
+            if isinstance(value, tuple):
+                return [thaw(v) for v in value]
+            return value.to_dict() if isinstance(value, CheckResult) else value
+        return {key: thaw(value) for key, value in zip(self.fields, self.values)}
+
+    def __repr__(self):
+        return f'CheckResult({self.to_dict()!r})'
+
+
+def _json_default(value):
+    """json.dumps 的 default：CheckResult / 其他 Mapping 转 dict，其余可迭代对象（set 等）转 list"""
+    if isinstance(value, CheckResult):
+        return value.to_dict()
+    if isinstance(value, collections.abc.Mapping):
+        return dict(value)
+    return list(value)
+
+
+class _HistoryRing:
+    """单个检查的定长环形缓冲：时间戳 / 状态 / 结果编号各占一个 array，结果按值驻留"""
+    __slots__ = ('times', 'statuses', 'ids', 'start', 'size', 'values', 'index')
+
+    def __init__(self, capacity: int):
+        self.times = array.array('d', bytes(8 * capacity))
+        self.statuses = array.array('B', bytes(capacity))
+        self.ids = array.array('I', bytes(4 * capacity))
+        self.start = 0
+        self.size = 0
+        # 编号 → 结果，结果 → 编号
+        self.values = []
+        self.index = {}
+
+
+class ResultHistory:
+    """
+    有界的结果历史：每个检查一个容量为 capacity 的环形缓冲，写满后覆盖最旧的记录。
+    同一出口的结果长期不变、通常只有几种，相同结果只保存一个 CheckResult，
+    内存只取决于 capacity 与不同结果的种数，常驻数天也不会增长。
+    """
+    STATUSES = ('ok', 'error', 'timeout', 'circuit_open', 'cached', 'stale')
+
+    def __init__(self, capacity: int = 1440):
+        self.capacity = max(1, capacity)
+        self._lock = threading.Lock()
+        self._rings = {}
+
+    def append(self, service: str, result, at: Optional[float] = None):
+        value = CheckResult.of(result) if isinstance(result, collections.abc.Mapping) else None
+        with self._lock:
+            ring = self._rings.get(service)
+            if ring is None:
+                ring = self._rings[service] = _HistoryRing(self.capacity)
+            value_id = ring.index.get(value)
+            if value_id is None:
+                if len(ring.values) >= 2 * self.capacity:
+                    self._compact(ring)
+                value_id = ring.index[value] = len(ring.values)
+                ring.values.append(value)
+            pos = (ring.start + ring.size) % self.capacity
+            if ring.size == self.capacity:
+                ring.start = (ring.start + 1) % self.capacity
+            else:
+                ring.size += 1
+            ring.times[pos] = time.time() if at is None else at
+            ring.statuses[pos] = self.STATUSES.index(result_status(result))
+            ring.ids[pos] = value_id
+
+    def _compact(self, ring: _HistoryRing):
+        """丢弃已被覆盖、不再被任何记录引用的结果并重新编号"""
+        live = sorted({ring.ids[(ring.start + i) % self.capacity] for i in range(ring.size)})
+        remap = {old: new for new, old in enumerate(live)}
+        ring.values = [ring.values[old] for old in live]
+        ring.index = {value: i for i, value in enumerate(ring.values)}
+        for i in range(ring.size):
+            pos = (ring.start + i) % self.capacity
+            ring.ids[pos] = remap[ring.ids[pos]]
+
+    def entries(self, service: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按时间顺序返回最近 limit 条记录：at（Unix 时间）、status、result"""
+        with self._lock:
+            ring = self._rings.get(service)
+            if ring is None:
+                return []
+            count = ring.size if limit is None else max(0, min(limit, ring.size))
+            out = []
+            for i in range(ring.size - count, ring.size):
+                pos = (ring.start + i) % self.capacity
+                out.append({'at': ring.times[pos], 'status': self.STATUSES[ring.statuses[pos]],
+                            'result': ring.values[ring.ids[pos]]})
+            return out
+
+    def services(self) -> List[str]:
+        with self._lock:
+            return list(self._rings)
+
+    def __len__(self):
+        with self._lock:
+            return sum(ring.size for ring in self._rings.values())
+
+
+def current_rss_bytes() -> int:
+    """当前进程的常驻内存（字节）：Linux 读 /proc/self/statm，其他平台退回峰值 RSS"""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return 0
+    # macOS 上 ru_maxrss 单位为字节，其余平台为 KB
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# ---------------------------------------------------------------------------
+# 结构化输出（逐项流式写出）
+# ---------------------------------------------------------------------------
+def result_status(result) -> str:
+    """结果状态：ok / error（检查抛错）/ timeout / circuit_open / cached / stale"""
+    if not isinstance(result, collections.abc.Mapping):
+        return 'error'
+    for flag, status in (('timed_out', 'timeout'), ('circuit_open', 'circuit_open'), ('stale', 'stale'),
+                         ('cached', 'cached')):
+        if result.get(flag):
+            return status
+    return 'ok'
+
+
+class ResultWriter:
+    """
+    每个检查得出结果时立即写出一条记录并 flush（作为引擎的 on_result 回调）。
+    记录格式固定：ts（UTC ISO 8601）、elapsed（距开始的秒数）、check、status、result。
+    """
+    def __init__(self, out):
+        self.out = out
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, service: str, result) -> Dict[str, Any]:
+        return {
+            'ts': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'elapsed': round(time.monotonic() - self.started, 3),
+            'check': service,
+            'status': result_status(result),
+            'result': result,
+        }
+
+    def __call__(self, service: str, result):
+        record = self.record(service, result)
+        with self._lock:
+            self.write(record)
+            self.out.flush()
+
+    def write(self, record: Dict[str, Any]):
+        raise NotImplementedError
+
+    def close(self):
+        self.out.flush()
+
+
+class NDJSONWriter(ResultWriter):
+    """每行一个 JSON 记录"""
+    def write(self, record):
+        self.out.write(json.dumps(record, ensure_ascii=False, default=_json_default) + '\n')
+
+
+class JSONWriter(ResultWriter):
+    """JSON 数组，元素逐个写出；close() 时补上结尾"""
+    def __init__(self, out):
+        super().__init__(out)
+        self._count = 0
+
+    def write(self, record):
+        self.out.write(('[\n  ' if self._count == 0 else ',\n  ') + json.dumps(record, ensure_ascii=False, default=_json_default))
+        self._count += 1
+
+    def close(self):
+        self.out.write('[]\n' if self._count == 0 else '\n]\n')
+        super().close()
+
+
+class CSVWriter(ResultWriter):
+    """CSV：常用字段独立成列，完整结果以 JSON 放在最后一列"""
+    COLUMNS = ('ts', 'elapsed', 'check', 'status', 'available', 'country', 'region', 'location', 'result')
+
+    def __init__(self, out):
+        super().__init__(out)
+        self._csv = csv.writer(out)
+        self._csv.writerow(self.COLUMNS)
+
+    def write(self, record):
+        result = record['result'] if isinstance(record['result'], collections.abc.Mapping) else {}
+        self._csv.writerow([
+            record['ts'], record['elapsed'], record['check'], record['status'],
+            '' if 'available' not in result else str(bool(result['available'])).lower(),
+            result.get('country', ''), result.get('region', ''), result.get('location', ''),
+            json.dumps(record['result'], ensure_ascii=False, default=_json_default),
+        ])
+
+
+RESULT_WRITERS = {'json': JSONWriter, 'ndjson': NDJSONWriter, 'csv': CSVWriter}
+
+
+# ---------------------------------------------------------------------------
+# 常驻监控模式
+# ---------------------------------------------------------------------------
+class Monitor:
+    """
+    常驻监控：复用同一个 GeoIPChecker（Session / 连接池保持热连接），
+    每个检查按各自的间隔（注册表中的 ttl，ttl 为 0 的按 watch_interval）加随机抖动重复执行。
+    Cloudflare 检查兼作出口监视：公网 IP 或 loc 变化时立即对所有检查做一次完整复检；
+    其余批次复用它得到的出口（在 Cloudflare 的复检间隔内有效），不再各自抓取 trace。
+    最新结果预先序列化为 JSON，由 serve() 启动的本地 HTTP 端点提供给任意多个读取方；
+    每个检查最近 history_size 次结果保存在有界的 ResultHistory 中，长期运行内存不增长。
+    """
+
+    def __init__(self, checker: GeoIPChecker, watch_interval: float = 60.0, jitter: float = 0.1,
+                 history_size: int = 1440):
+        self.checker = checker
+        self.watch_interval = watch_interval
+        self.jitter = jitter
+        self.egress = None
+        self._egress_at = None
+        self.history = ResultHistory(history_size)
+        self._results = {}
+        self._updated = {}
+        self._due = {}
+        self._changes = 0
+        # 对外发布的快照（整体替换，读取方无需加锁）
+        self.snapshot = b'{}'
+        self.started = time.time()
+
+    def _base_interval(self, service: str) -> float:
+        spec = self.checker.registry.get(service)
+        return spec.ttl if spec is not None and spec.ttl > 0 else self.watch_interval
+
+    def interval(self, service: str) -> float:
+        return self._base_interval(service) * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def known_egress(self, services: Iterable[str]) -> Optional[str]:
+        """
+        本批次可复用的出口 IP：批次不含 Cloudflare 检查、且上次得到的出口未超过 Cloudflare 的复检间隔
+        （含抖动上限）时返回，否则返回 None，由 run_all_checks_async 重新查询。
+        """
+        if 'Cloudflare' in services or self.egress is None or self.egress[0] is None:
+            return None
+        ttl = self._base_interval('Cloudflare') * (1 + self.jitter)
+        if time.monotonic() - self._egress_at > ttl:
+            return None
+        return self.egress[0]
+
+    async def run(self, stop: 'asyncio.Event'):
+        await self._run_batch(list(self.checker.check_table()))
+        while not stop.is_set():
+            now = time.monotonic()
+            due = [service for service, at in self._due.items() if at <= now]
+            if not due:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stop.wait(), timeout=min(self._due.values()) - now)
+                continue
+            await self._run_batch(due)
+
+    async def _run_batch(self, services: List[str]):
+        results = await self.checker.run_all_checks_async(services=services, refresh=True,
+                                                          egress=self.known_egress(services))
+        now, clock = time.time(), time.monotonic()
+        for service, result in results.items():
+            result = self._results[service] = CheckResult.of(result) if isinstance(result, dict) else result
+            self.history.append(service, result, now)
+            self._updated[service] = now
+            self._due[service] = clock + self.interval(service)
+        cloudflare = results.get('Cloudflare')
+        if cloudflare and not cloudflare.get('timed_out') and not cloudflare.get('circuit_open'):
+            egress = (cloudflare.get('ip'), cloudflare.get('location'))
+            if self.egress is not None and egress != self.egress:
+                # 出口变化：其余检查全部提前到现在
+                self._changes += 1
+                print(f"[monitor] 出口变化 {self.egress} -> {egress}，完整复检")
+                for service in self._due:
+                    if service not in results:
+                        self._due[service] = clock
+            self.egress = egress
+            self._egress_at = clock
+        self._publish(now)
+
+    def _publish(self, now: float):
+        ip, location = self.egress or (None, None)
+        self.snapshot = json.dumps({
+            'egress': {'ip': ip, 'location': location, 'changes': self._changes},
+            'generated_at': now,
+            'uptime': round(now - self.started, 1),
+            'rss_bytes': current_rss_bytes(),
+            'results': self._results,
+            'updated_at': self._updated,
+        }, ensure_ascii=False, default=_json_default).encode()
+
+    def process_metrics(self) -> str:
+        """常驻进程自身的指标（Prometheus 文本格式）：RSS 与历史记录条数，用于确认长期运行内存平稳"""
+        return (
+            '# TYPE geoip_check_resident_memory_bytes gauge\n'
+            f'geoip_check_resident_memory_bytes {current_rss_bytes()}\n'
+            '# TYPE geoip_check_history_entries gauge\n'
+            f'geoip_check_history_entries {len(self.history)}\n'
+        )
+
+    def serve(self, host: str = '127.0.0.1', port: int = 8765) -> 'http_server.ThreadingHTTPServer':
+        """在后台线程启动 HTTP/JSON 端点：/results、/results/<检查>、/history/<检查>?limit=N、/metrics、/healthz"""
+        monitor = self
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = 'application/json; charset=utf-8'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = urllib.parse.urlsplit(self.path).path.rstrip('/')
+                if path in ('', '/results'):
+                    self._send(200, monitor.snapshot)
+                elif path.startswith('/results/'):
+                    result = monitor._results.get(urllib.parse.unquote(path[len('/results/'):]))
+                    if result is None:
+                        self._send(404, b'{"error": "unknown check"}')
+                    else:
+                        self._send(200, json.dumps(result, ensure_ascii=False, default=_json_default).encode())
+                elif path.startswith('/history/'):
+                    service = urllib.parse.unquote(path[len('/history/'):])
+                    query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+                    limit = query.get('limit', [''])[0]
+                    entries = monitor.history.entries(service, int(limit) if limit.isdigit() else None)
+                    if not entries and service not in monitor.history.services():
+                        self._send(404, b'{"error": "unknown check"}')
+                    else:
+                        self._send(200, json.dumps(entries, ensure_ascii=False, default=_json_default).encode())
+                elif path == '/metrics':
+                    self._send(200, (monitor.checker.metrics.to_prometheus() + monitor.process_metrics()).encode(),
+                               'text/plain; version=0.0.4')
+                elif path == '/healthz':
+                    self._send(200 if monitor._results else 503, b'ok' if monitor._results else b'starting',
+                               'text/plain')
+                else:
+                    self._send(404, b'{"error": "not found"}')
+
+        server = http_server.ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='geoip-monitor-http', daemon=True).start()
+        return server
+
+
+def run_daemon(listen: str = '127.0.0.1:8765', watch_interval: float = 60.0, history_size: int = 1440,
+               **checker_kwargs):
+    """常驻监控模式入口：SIGINT / SIGTERM 时退出"""
+    host, _, port = listen.rpartition(':')
+    checker = GeoIPChecker(**checker_kwargs)
+    monitor = Monitor(checker, watch_interval=watch_interval, history_size=history_size)
+    server = monitor.serve(host or '127.0.0.1', int(port))
+    print(f"[monitor] 结果端点: http://{host or '127.0.0.1'}:{server.server_address[1]}/results")
+
+    async def loop_forever():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with contextlib.suppress(NotImplementedError):
+                loop.add_signal_handler(sig, stop.set)
+        await monitor.run(stop)
+
+    try:
+        asyncio.run(loop_forever())
+    finally:
+        server.shutdown()
+        checker.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='GeoIP / 流媒体解锁检测')
+    parser.add_argument('--timeout', type=float, default=1, help='单个请求超时（秒）')
+    parser.add_argument('--engine', choices=['async', 'thread'], default='async', help='执行引擎')
+    parser.add_argument('--fleet', metavar='FILE', help="fleet 模式：代理列表文件，'-' 表示从 stdin 读取")
+    parser.add_argument('--concurrency', type=int, default=64, help='fleet 模式全局在途请求上限')
+    parser.add_argument('--per-proxy', type=int, default=4, help='fleet 模式单个代理在途请求上限')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='fleet 模式的工作进程数（1 表示单进程，0 表示 CPU 核数）')
+    parser.add_argument('--recycle-after', type=int, default=FLEET_RECYCLE_AFTER,
+                        help='多进程 fleet 中每个工作进程检测多少个出口后由新进程接替')
+    parser.add_argument('--mmdb', help='本地国家 MMDB 路径（默认自动查找 geolite2/ 与 output/）')
+    parser.add_argument('--no-remote-country', action='store_true', help='本地库未命中时不再请求 api.country.is')
+    parser.add_argument('--bulk', metavar='FILE', help="批量定位模式：IP 日志文件（每行第一个字段为 IP），'-' 表示 stdin")
+    parser.add_argument('--bulk-output', metavar='FILE', help='批量定位输出文件（默认 stdout）')
+    parser.add_argument('--geolite2-dir', default=GEOLITE2_DIR, help='GeoLite2 Country CSV 所在目录')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='批量定位每块行数')
+    parser.add_argument('--rebuild-ranges', action='store_true', help='忽略缓存，重新从 CSV 构建区间数组')
+    parser.add_argument('--list', dest='lists', action='append', default=[], metavar='NAME=PATH',
+                        help='追加 text 格式的 CIDR 列表（可重复）')
+    parser.add_argument('--geoip-dat', metavar='PATH', help='追加 V2Ray geoip.dat 中的所有列表')
+    parser.add_argument('--dump-every', type=int, default=20,
+                        help='成功结果每 N 次保存一次页面转储（0 表示只保存提取失败的页面）')
+    parser.add_argument('--output', choices=['text', 'json', 'ndjson', 'csv'], default='text',
+                        help='单次检测的输出格式；json/ndjson/csv 在每项完成时立即写出到 stdout（调试信息改写到 stderr）')
+    parser.add_argument('--daemon', action='store_true', help='常驻监控模式：按间隔重复检测并通过本地 HTTP 端点提供结果')
+    parser.add_argument('--listen', default='127.0.0.1:8765', help='常驻模式 HTTP 端点监听地址 HOST:PORT')
+    parser.add_argument('--watch-interval', type=float, default=60, help='常驻模式出口（公网 IP / loc）检查间隔（秒）')
+    parser.add_argument('--history', type=int, default=1440, help='常驻模式每个检查保留的历史结果条数')
+    parser.add_argument('--cache-db', default=DEFAULT_CACHE_PATH, help='结果缓存 SQLite 文件')
+    parser.add_argument('--no-cache', action='store_true', help='不使用结果缓存，全部实时检测')
+    parser.add_argument('--deadline', type=float, help='整体截止时间（秒），到期未完成的检查标记为超时')
+    parser.add_argument('--metrics-json', metavar='FILE', help="检测结束后写出分阶段耗时 JSON 摘要（'-' 表示 stderr）")
+    parser.add_argument('--metrics-prom', metavar='FILE', help='检测结束后写出 Prometheus textfile')
+    parser.add_argument('--lookup', nargs='+', metavar='IP', help="查询 IP 所属列表并退出，'-' 表示从 stdin 逐行读取")
+    args = parser.parse_args(argv)
+
+    cidr_index = None
+    if args.lists or args.geoip_dat:
+        cidr_index = CIDRIndex.from_config() if os.path.isfile(CONFIG_PATH) else CIDRIndex()
+        for spec in args.lists:
+            name, _, path = spec.partition('=')
+            cidr_index.load_text(name, path)
+        if args.geoip_dat:
+            cidr_index.load_geoip_dat(args.geoip_dat)
+        cidr_index.build()
+    checker_kwargs = {'timeout': args.timeout, 'mmdb_path': args.mmdb,
+                      'remote_country_fallback': not args.no_remote_country, 'cidr_index': cidr_index,
+                      'dump_every': args.dump_every, 'metrics': Metrics(), 'deadline': args.deadline,
+                      'breakers': CircuitBreakers()}
+
+    if args.lookup:
+        index = cidr_index if cidr_index is not None else default_cidr_index()
+        ips = (line.strip() for line in sys.stdin if line.strip()) if args.lookup == ['-'] else args.lookup
+        for ip in ips:
+            names = index.lookup(ip)
+            print(f"{ip}\t{','.join(names) if names else 'false'}")
+        return
+
+    if args.bulk:
+        table = load_country_ranges(args.geolite2_dir, os.path.join(args.geolite2_dir, '.ranges'),
+                                    rebuild=args.rebuild_ranges)
+        src = sys.stdin if args.bulk == '-' else open(args.bulk, encoding='utf-8', errors='replace')
+        dst = open(args.bulk_output, 'w', encoding='utf-8') if args.bulk_output else sys.stdout
+        try:
+            bulk_geolocate(table, src, dst, chunk_size=args.chunk_size)
+        finally:
+            if src is not sys.stdin:
+                src.close()
+            if dst is not sys.stdout:
+                dst.close()
+        return
+
+    checker_kwargs['cache'] = None if args.no_cache else ResultCache(args.cache_db)
+    if args.daemon:
+        run_daemon(listen=args.listen, watch_interval=args.watch_interval, history_size=args.history,
+                   **checker_kwargs)
+        return
+    if args.fleet:
+        proxies = read_proxies(args.fleet)
+        out = sys.stdout
+        # 检查过程中的调试输出改写到 stderr，stdout 只保留 JSONL
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.processes == 1:
+                run_fleet(proxies, out=out, concurrency=args.concurrency,
+                          per_proxy=args.per_proxy, **checker_kwargs)
+            else:
+                # 指标、熔断器与缓存连接不能跨进程共享：各子进程自建，指标在子进程退出时汇总
+                shard_kwargs = {k: v for k, v in checker_kwargs.items() if k not in ('metrics', 'breakers', 'cache')}
+                run_fleet_sharded(proxies, out=out, processes=args.processes or None,
+                                  recycle_after=args.recycle_after, concurrency=args.concurrency,
+                                  per_proxy=args.per_proxy, metrics=checker_kwargs['metrics'],
+                                  cache_path=None if args.no_cache else args.cache_db, **shard_kwargs)
+    elif args.output != 'text':
+        checker = GeoIPChecker(**checker_kwargs)
+        writer = RESULT_WRITERS[args.output](sys.stdout)
+        with contextlib.redirect_stdout(sys.stderr):
+            checker.run_checks(engine=args.engine, on_result=writer)
+        writer.close()
+    else:
+        checker = GeoIPChecker(**checker_kwargs)
+        checker.run_all_checks(engine=args.engine)
+    export_metrics(checker_kwargs['metrics'], args.metrics_json, args.metrics_prom)
+
+
+def export_metrics(metrics: Metrics, json_path: Optional[str] = None, prom_path: Optional[str] = None):
+    """按命令行参数导出指标：JSON 摘要与/或 Prometheus textfile"""
+    if json_path:
+        summary = json.dumps(metrics.summary(), ensure_ascii=False, indent=2)
+        if json_path == '-':
+            print(summary, file=sys.stderr)
+        else:
+            with open(json_path, 'w', encoding='utf-8') as f:
+                f.write(summary + '\n')
+    if prom_path:
+        metrics.write_prometheus(prom_path)
+
 
 if __name__ == "__main__":
-    checker = GeoIPChecker()
-    checker.run_all_checks() 
\ No newline at end of file
+    main()
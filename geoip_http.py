@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+geoip_check 中依赖 requests / urllib3 的类型：可追踪的连接与连接池、HTTPAdapter、受预算约束的 Retry 与相关异常。
+导入 requests 需要数十毫秒，--help、离线查询等不发请求的场景不必付出，
+因此 geoip_check 经 _LazyModule 在首次用到这些类型时才导入本模块。
+"""
+
+import urllib.parse
+from typing import Optional, Dict
+
+import requests
+import urllib3
+
+from geoip_check import _TracedConnectionMixin
+
+
+class RedirectLoopError(requests.exceptions.TooManyRedirects):
+    """重定向链回到了已经访问过的 URL，且期间 Session 的 Cookie 没有变化"""
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """目标主机的熔断器处于打开状态，请求未发出"""
+
+
+class _TracedHTTPConnection(_TracedConnectionMixin, urllib3.connection.HTTPConnection):
+    pass
+
+
+class _TracedHTTPSConnection(_TracedConnectionMixin, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _TracedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    ConnectionCls = _TracedHTTPConnection
+
+
+class _TracedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    ConnectionCls = _TracedHTTPSConnection
+
+
+class TracingHTTPAdapter(requests.adapters.HTTPAdapter):
+    """
+    使用可追踪连接类的 HTTPAdapter（含代理连接池）。
+    host_overrides 把主机（'*' 表示全部）改发到指定的 scheme://host:port，保留原 Host 头与响应 URL，
+    供基准测试的本地替身服务器或固定到特定边缘节点使用。
+    """
+    POOL_CLASSES = {'http': _TracedHTTPConnectionPool, 'https': _TracedHTTPSConnectionPool}
+
+    def __init__(self, *args, host_overrides: Optional[Dict[str, str]] = None, **kwargs):
+        self.host_overrides = dict(host_overrides or {})
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urllib.parse.urlsplit(request.url)
+        target = self.host_overrides.get((parts.hostname or '').lower(), self.host_overrides.get('*'))
+        if not target:
+            return super().send(request, **kwargs)
+        target = urllib.parse.urlsplit(target)
+        routed = request.copy()
+        routed.url = urllib.parse.urlunsplit((target.scheme, target.netloc, parts.path, parts.query, ''))
+        routed.headers['Host'] = parts.netloc
+        response = super().send(routed, **kwargs)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.POOL_CLASSES
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if not proxy.lower().startswith('socks'):
+            manager.pool_classes_by_scheme = self.POOL_CLASSES
+        return manager
+
+
+class BudgetedRetry(requests.adapters.Retry):
+    """受 RetryBudget 约束的 urllib3 Retry：预算耗尽时不再重试，直接按重试用尽处理"""
+    budget = None
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.budget = self.budget
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if self.budget is not None and not self.budget.try_spend():
+            raise urllib3.exceptions.MaxRetryError(
+                _pool, url, error or urllib3.exceptions.ResponseError('retry budget exhausted'))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""测试公共夹具：把仓库根目录加入 sys.path，并提供 geoip_bench 的本地替身服务器"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import geoip_bench  # noqa: E402
+import geoip_check  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def standin():
+    """整个测试会话共用的替身服务器（HTTP，所有站点返回 HK）"""
+    server = geoip_bench.start_standin({'rtt': 0, 'slow': {}, 'fail': set()})
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+@pytest.fixture
+def make_standin():
+    """按需启动带自定义配置的替身服务器（slow: 主机 → 额外延迟秒数，fail: 直接断开的主机），返回其 URL"""
+    servers = []
+
+    def make(slow=None, fail=()):
+        server = geoip_bench.start_standin({'rtt': 0, 'slow': dict(slow or {}), 'fail': set(fail)})
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_address[1]}'
+
+    yield make
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+def make_checker(standin, tmp_path):
+    """创建把所有请求改发到替身服务器的 GeoIPChecker，测试结束时关闭"""
+    checkers = []
+
+    def make(**kwargs):
+        kwargs.setdefault('timeout', 2)
+        kwargs.setdefault('tmp_dir', str(tmp_path))
+        kwargs.setdefault('dump_every', 0)
+        kwargs.setdefault('host_overrides', {'*': standin})
+        checker = geoip_check.GeoIPChecker(**kwargs)
+        checkers.append(checker)
+        return checker
+
+    yield make
+    for checker in checkers:
+        checker.close()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""ArtifactSink：成功结果采样、队列满时丢弃并计数（多线程提交下计数准确）、后台压缩写入"""
+
+import gzip
+import os
+import threading
+import time
+
+import pytest
+
+from geoip_check import ArtifactSink
+
+
+@pytest.fixture
+def blocked_sink(tmp_path):
+    """写入线程在 release 之前阻塞在第一个产物上的 ArtifactSink"""
+    def make(**kwargs):
+        sink = ArtifactSink(str(tmp_path / 'artifacts'), compression='gzip', **kwargs)
+        release = threading.Event()
+        write = sink._write
+
+        def blocked_write(*args):
+            release.wait(5)
+            write(*args)
+
+        sink._write = blocked_write
+        sink.release = release
+        return sink
+
+    return make
+
+
+def _wait_until_taken(sink):
+    # 写入线程取走第一个产物后阻塞，队列重新为空
+    while not sink._queue.empty():
+        time.sleep(0.005)
+
+
+def test_full_queue_drops_and_counts(blocked_sink):
+    sink = blocked_sink(queue_size=2)
+    assert sink.submit('first.html', 'x', failed=True)
+    _wait_until_taken(sink)
+    accepted = [sink.submit(f'{i}.html', 'x', failed=True) for i in range(5)]
+    assert accepted == [True, True, False, False, False]
+    assert sink.dropped == 3 and sink.written == 0
+    sink.release.set()
+    sink.flush()
+    assert sink.written == 3
+    names = sorted(os.listdir(sink.directory))
+    assert len(names) == 3 and all(name.endswith('.html.gz') for name in names)
+    with open(os.path.join(sink.directory, names[0]), 'rb') as f:
+        assert gzip.decompress(f.read()) == b'x'
+
+
+def test_counters_are_exact_under_concurrent_submits(blocked_sink):
+    sink = blocked_sink(queue_size=4)
+    assert sink.submit('first.html', 'x', failed=True)
+    _wait_until_taken(sink)
+    threads, per_thread = 8, 500
+    accepted = []
+    barrier = threading.Barrier(threads)
+
+    def submit():
+        barrier.wait()
+        accepted.append(sum(sink.submit('page.html', 'x', failed=True) for _ in range(per_thread)))
+
+    workers = [threading.Thread(target=submit) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sum(accepted) == 4
+    assert sink.dropped == threads * per_thread - 4
+    sink.release.set()
+    sink.flush()
+    assert sink.written == 5
+
+
+def test_successes_are_sampled(tmp_path):
+    sink = ArtifactSink(str(tmp_path), sample_every=3, compression='gzip')
+    assert [sink.submit('ok.html', 'x') for _ in range(7)] == [True, False, False, True, False, False, True]
+    # 失败结果总是保存；sample_every=0 时只保存失败结果
+    assert sink.submit('failed.html', 'x', failed=True)
+    only_failures = ArtifactSink(str(tmp_path), sample_every=0)
+    assert not only_failures.submit('ok.html', 'x')
+    sink.flush()
+    assert sink.written == 4 and sink.dropped == 0
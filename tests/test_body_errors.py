@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""正文读取中途出错（截断、读取超时、损坏的 brotli）时各检查退回默认结果，而不是抛出异常"""
+
+import asyncio
+import http.server
+import socketserver
+import threading
+import time
+
+import pytest
+
+import geoip_check
+
+
+class BrokenHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        mode = self.server.mode
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if mode == 'corrupt_br':
+            body = b'\x8b\x00\x80not really brotli' * 64
+            self.send_header('Content-Encoding', 'br')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        # 声明的长度远大于实际发送的内容
+        self.send_header('Content-Length', '100000')
+        self.end_headers()
+        self.wfile.write(b'<html><body><p>partial' + b' ' * 500)
+        self.wfile.flush()
+        if mode == 'stall':
+            time.sleep(2)
+        self.close_connection = True
+
+
+class BrokenServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+@pytest.fixture(scope='module')
+def broken():
+    server = BrokenServer(('127.0.0.1', 0), BrokenHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+MODES = ['truncated', 'stall'] + (['corrupt_br'] if geoip_check.brotli is not None else [])
+
+
+@pytest.fixture(params=MODES)
+def checker(request, broken, tmp_path):
+    broken.mode = request.param
+    checker = geoip_check.GeoIPChecker(timeout=0.5, tmp_dir=str(tmp_path), dump_every=0, warm_up=False,
+                                       remote_country_fallback=False,
+                                       host_overrides={'*': f'http://127.0.0.1:{broken.server_address[1]}'})
+    yield checker
+    checker.close()
+
+
+def test_decode_response_returns_empty_text(checker):
+    response = checker.safe_request('https://www.example.com/', stream=True)
+    assert checker.decode_response(response) == ''
+
+
+def test_scan_html_returns_none(checker):
+    response = checker.safe_request('https://www.example.com/', stream=True)
+    assert checker.scan_html(response, lambda text, tag: None) is None
+
+
+def test_dns_check_falls_back(checker):
+    assert checker.check_dns_country_match()['public_ip'] == 'Unknown'
+    assert asyncio.run(checker.check_dns_country_match_async())['public_ip'] == 'Unknown'
+
+
+@pytest.mark.parametrize('stream_html', [True, False])
+def test_html_checks_fall_back(checker, stream_html):
+    checker.stream_html = stream_html
+    assert checker.check_youtube_premium()['country'] == 'Unknown'
+    # 正文不可用时退回按跳转后的 URL 判断
+    assert checker.check_google_location()['method'] == 'url'
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""熔断器状态转换与跨出口汇总熔断器"""
+
+import time
+
+from geoip_check import CircuitBreaker, CircuitBreakers
+
+
+def _fail(breaker, times):
+    for _ in range(times):
+        breaker.record(False)
+
+
+def test_opens_after_min_requests_at_error_rate():
+    breaker = CircuitBreaker(min_requests=4, error_rate=0.5, cooldown=10)
+    breaker.record(True)
+    _fail(breaker, 2)
+    assert breaker.state == 'closed'
+    breaker.record(False)
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_old_events_leave_the_window():
+    breaker = CircuitBreaker(window=0.05, min_requests=3, error_rate=0.5)
+    _fail(breaker, 2)
+    time.sleep(0.1)
+    breaker.record(False)
+    assert breaker.state == 'closed'
+
+
+def test_half_open_admits_one_trial_and_closes_on_success():
+    breaker = CircuitBreaker(min_requests=1, cooldown=0.05)
+    _fail(breaker, 1)
+    time.sleep(0.1)
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+def test_failed_trial_reopens_with_doubled_cooldown():
+    breaker = CircuitBreaker(min_requests=1, cooldown=0.05, max_cooldown=0.08)
+    _fail(breaker, 1)
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == 'open' and breaker._open_for == 0.08
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.record(False)
+    # 不超过 max_cooldown
+    assert breaker._open_for == 0.08
+
+
+def test_release_returns_the_trial():
+    breaker = CircuitBreaker(min_requests=1, cooldown=0.05)
+    _fail(breaker, 1)
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_open_egress_does_not_hold_the_host_wide_trial():
+    # 出口 A 冷却很长，汇总熔断器很快进入 half_open；A 的请求被拒绝时不能占用汇总熔断器的试探名额
+    breakers = CircuitBreakers(min_requests=2, cooldown=10,
+                               host_settings={'min_requests': 2, 'error_rate': 0.5, 'cooldown': 0.05})
+    for _ in range(2):
+        breakers.record('A', 'h', False)
+    assert breakers._get('*', 'h').state == 'open'
+    time.sleep(0.1)
+    assert not breakers.allow('A', 'h')
+    assert breakers.allow('B', 'h')
+    breakers.record('B', 'h', True)
+    assert breakers._get('*', 'h').state == 'closed'
+    assert breakers.allow('C', 'h')
+
+
+def test_host_wide_refusal_releases_the_egress_trial():
+    breakers = CircuitBreakers(min_requests=1, cooldown=0.05,
+                               host_settings={'min_requests': 1, 'cooldown': 10})
+    breakers.record('A', 'h', False)
+    time.sleep(0.1)
+    # A 已可试探，但汇总熔断器仍在冷却：拒绝且 A 的试探名额被归还
+    assert not breakers.allow('A', 'h')
+    assert breakers._get('A', 'h').allow()
+
+
+def test_blocked_proxies_do_not_trip_healthy_ones():
+    breakers = CircuitBreakers(min_requests=5, cooldown=10)
+    for _ in range(10):
+        for egress in ('blocked-1', 'blocked-2', 'blocked-3'):
+            if breakers.allow(egress, 'h'):
+                breakers.record(egress, 'h', False)
+        for i in range(10):
+            if breakers.allow(f'ok-{i}', 'h'):
+                breakers.record(f'ok-{i}', 'h', True)
+    assert breakers._get('blocked-1', 'h').state == 'open'
+    assert breakers._get('*', 'h').state == 'closed'
+    assert all(breakers.allow(f'ok-{i}', 'h') for i in range(10))
+
+
+def test_host_wide_breaker_opens_when_every_egress_fails():
+    breakers = CircuitBreakers(min_requests=5, cooldown=10)
+    for i in range(30):
+        breakers.record(f'p{i}', 'h', False)
+    assert breakers._get('*', 'h').state == 'open'
+    assert not breakers.allow('fresh', 'h')
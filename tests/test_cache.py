@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""结果缓存：fresh → stale → 过期的转换、LRU 淘汰、SQLite 共享，以及检测引擎的缓存读写规则"""
+
+import asyncio
+import time
+
+import pytest
+
+import geoip_check
+from geoip_check import ResultCache
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(geoip_check.time, 'time', clock)
+    return clock
+
+
+def test_fresh_stale_expired_transitions(clock):
+    cache = ResultCache(stale_for=50)
+    cache.put('203.0.113.7', 'Netflix', {'country': 'HK'}, ttl=100)
+    assert cache.get('203.0.113.7', 'Netflix') == ({'country': 'HK'}, 'fresh')
+    clock.now += 99.9
+    assert cache.get('203.0.113.7', 'Netflix')[1] == 'fresh'
+    clock.now += 0.1
+    assert cache.get('203.0.113.7', 'Netflix') == ({'country': 'HK'}, 'stale')
+    clock.now += 49.9
+    assert cache.get('203.0.113.7', 'Netflix')[1] == 'stale'
+    clock.now += 0.1
+    assert cache.get('203.0.113.7', 'Netflix') is None
+    # 重新写入后恢复 fresh
+    cache.put('203.0.113.7', 'Netflix', {'country': 'JP'}, ttl=100)
+    assert cache.get('203.0.113.7', 'Netflix') == ({'country': 'JP'}, 'fresh')
+
+
+def test_scopes_are_independent_and_zero_ttl_is_not_stored(clock):
+    cache = ResultCache()
+    cache.put('a', 'X', {'available': True}, ttl=10)
+    cache.put('a', 'Cloudflare', {'location': 'HK'}, ttl=0)
+    assert cache.get('b', 'X') is None
+    assert cache.get('a', 'Cloudflare') is None
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = ResultCache(max_entries=2)
+    cache.put('s', 'a', 1, ttl=10)
+    cache.put('s', 'b', 2, ttl=10)
+    assert cache.get('s', 'a') == (1, 'fresh')  # a 变为最近使用
+    cache.put('s', 'c', 3, ttl=10)
+    assert cache.get('s', 'b') is None
+    assert cache.get('s', 'a') == (1, 'fresh')
+    assert cache.get('s', 'c') == (3, 'fresh')
+
+
+def test_sqlite_is_shared_between_instances_and_keeps_age(clock, tmp_path):
+    path = str(tmp_path / 'cache' / 'results.sqlite')
+    writer = ResultCache(path, stale_for=50)
+    writer.put('203.0.113.7', 'Netflix', {'country': 'HK', 'lists': ['CN']}, ttl=100)
+    writer.close()
+    clock.now += 120
+    reader = ResultCache(path, stale_for=50, max_entries=1)
+    try:
+        assert reader.get('203.0.113.7', 'Netflix') == ({'country': 'HK', 'lists': ['CN']}, 'stale')
+        # LRU 淘汰后仍可从 SQLite 读回
+        reader.put('203.0.113.7', 'X', {'available': True}, ttl=100)
+        assert reader.get('203.0.113.7', 'Netflix')[1] == 'stale'
+        clock.now += 31
+        assert reader.get('203.0.113.7', 'Netflix') is None
+    finally:
+        reader.close()
+
+
+# ---------------------------------------------------------------------------
+# 检测引擎的缓存读写
+# ---------------------------------------------------------------------------
+EGRESS = '203.0.113.7'
+
+
+def test_split_cached_marks_fresh_and_stale_and_revalidates_only_stale(make_checker, clock):
+    cache = ResultCache(stale_for=100)
+    checker = make_checker(cache=cache, warm_up=False)
+    revalidated = []
+    checker._revalidate = lambda key, refresh: revalidated.append(key)
+    cache.put(EGRESS, 'Instagram', {'available': True}, ttl=1)
+    clock.now += 200  # Instagram 已超出 stale 窗口
+    cache.put(EGRESS, 'X', {'available': True}, ttl=100)
+    cache.put(EGRESS, 'TikTok', {'available': False}, ttl=10)
+    cache.put(EGRESS, 'Cloudflare', {'location': 'JP', 'ip': EGRESS}, ttl=100)
+    clock.now += 50
+    table = checker.check_table()
+    cached, live = checker._split_cached(table, EGRESS)
+    assert cached == {'X': {'available': True, 'cached': True},
+                      'TikTok': {'available': False, 'cached': True, 'stale': True}}
+    assert revalidated == [(EGRESS, 'TikTok')]
+    # ttl 为 0 的检查（Cloudflare）即使缓存中有值也实时检测；过期的条目实时检测
+    assert {'Cloudflare', 'Instagram'} <= set(live)
+    assert set(cached) | set(live) == set(table)
+
+
+def test_store_results_skips_flagged_and_uncached_results(make_checker):
+    cache = ResultCache()
+    checker = make_checker(cache=cache, warm_up=False)
+    checker._store_results(EGRESS, {
+        'Netflix': {'available': True, 'country': 'HK', 'region': 'HK'},
+        'X': {'available': False, 'timed_out': True},
+        'TikTok': {'available': False, 'circuit_open': True},
+        'Instagram': RuntimeError('boom'),
+        'Cloudflare': {'location': 'HK', 'ip': EGRESS},
+        'Unregistered': {'available': True},
+    })
+    assert cache.get(EGRESS, 'Netflix')[1] == 'fresh'
+    for service in ('X', 'TikTok', 'Instagram', 'Cloudflare', 'Unregistered'):
+        assert cache.get(EGRESS, service) is None, service
+
+
+def test_stale_revalidation_refreshes_the_entry(make_checker):
+    cache = ResultCache()
+    checker = make_checker(cache=cache, warm_up=False)
+    cache.put(EGRESS, 'X', {'available': False}, ttl=0.01)
+    time.sleep(0.05)
+    cached, _ = checker._split_cached(checker.check_table(), EGRESS)
+    assert cached['X']['stale']
+    started = time.monotonic()
+    while checker._revalidating and time.monotonic() - started < 5:
+        time.sleep(0.02)
+    assert cache.get(EGRESS, 'X') == ({'available': True}, 'fresh')
+
+
+@pytest.mark.parametrize('engine', ['async', 'thread'])
+def test_second_run_is_served_from_cache(make_checker, engine):
+    checker = make_checker(cache=ResultCache())
+
+    def run():
+        if engine == 'thread':
+            return checker._run_checks_threaded()
+        return asyncio.run(checker.run_all_checks_async())
+
+    first = run()
+    assert not any(result.get('cached') for result in first.values())
+    second = run()
+    assert second['Netflix'] == {**first['Netflix'], 'cached': True}
+    assert 'cached' not in second['Cloudflare']  # ttl 为 0，每次实时获取
+
+
+def test_refresh_bypasses_cache_reads_but_still_writes(make_checker):
+    cache = ResultCache()
+    checker = make_checker(cache=cache)
+    cache.put(EGRESS, 'Netflix', {'available': False, 'country': 'US', 'region': 'US'}, ttl=100)
+    checker.egress_ip = lambda: EGRESS
+    results = asyncio.run(checker.run_all_checks_async(refresh=True))
+    assert not any(result.get('cached') for result in results.values())
+    assert cache.get(EGRESS, 'Netflix') == (results['Netflix'], 'fresh')
+    assert results['Netflix']['country'] == 'HK'
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""CIDRIndex：扫描线合并的重叠 / 嵌套 / 相邻区间、边界地址、IPv6 查询，以及 text 与 geoip.dat 输入"""
+
+import ipaddress
+import json
+import random
+
+import pytest
+
+import geoip_check
+
+
+def make_index(entries):
+    index = geoip_check.CIDRIndex()
+    for name, cidr in entries:
+        assert index.add(name, cidr)
+    return index.build()
+
+
+def test_overlapping_lists_report_every_covering_list():
+    index = make_index([('a', '10.0.0.0/8'), ('b', '10.1.0.0/16'), ('c', '10.1.2.0/24'), ('b', '192.168.0.0/16')])
+    assert index.lookup('10.0.0.1') == ['A']
+    assert index.lookup('10.1.0.1') == ['A', 'B']
+    assert index.lookup('10.1.2.3') == ['A', 'B', 'C']
+    assert index.lookup('10.1.3.0') == ['A', 'B']
+    assert index.lookup('10.2.0.0') == ['A']
+    assert index.lookup('192.168.255.255') == ['B']
+    assert index.lookup('11.0.0.0') == []
+    assert index.lookup('9.255.255.255') == []
+
+
+def test_nested_ranges_of_the_same_list_keep_membership_until_the_outer_end():
+    # 内层网段结束时外层仍在覆盖，不能提前把列表移出
+    index = make_index([('cn', '1.0.0.0/8'), ('cn', '1.2.0.0/16'), ('cn', '1.2.0.0/16')])
+    assert index.lookup('1.2.255.255') == ['CN']
+    assert index.lookup('1.3.0.0') == ['CN']
+    assert index.lookup('1.255.255.255') == ['CN']
+    assert index.lookup('2.0.0.0') == []
+
+
+def test_adjacent_ranges_merge_into_one_interval():
+    index = make_index([('x', '10.0.0.0/25'), ('x', '10.0.0.128/25'), ('x', '10.0.1.0/24')])
+    assert index._bounds[4] == [int(ipaddress.ip_address('10.0.0.0')), int(ipaddress.ip_address('10.0.2.0'))]
+    assert index.lookup('10.0.0.127') == index.lookup('10.0.0.128') == index.lookup('10.0.1.255') == ['X']
+    assert index.lookup('10.0.2.0') == []
+
+
+@pytest.mark.parametrize('ip, expected', [
+    ('0.0.0.0', ['ALL4']),
+    ('255.255.255.255', ['ALL4', 'TOP']),
+    ('255.255.255.254', ['ALL4']),
+])
+def test_ranges_touching_the_ends_of_the_address_space(ip, expected):
+    index = make_index([('all4', '0.0.0.0/0'), ('top', '255.255.255.255/32')])
+    assert index.lookup(ip) == expected
+
+
+def test_ipv6_lookups_are_separate_from_ipv4():
+    index = make_index([('hk', '2400:cb00::/32'), ('hk', '1.1.1.0/24'), ('cf', '2400:cb00:2048::/48'),
+                        ('end', 'ffff:ffff:ffff:ffff::/64'), ('mapped', '::ffff:0:0/96')])
+    assert index.lookup('2400:cb00::1') == ['HK']
+    assert index.lookup('2400:cb00:2048:1::') == ['CF', 'HK']
+    assert index.lookup('2400:cb00:2049::') == ['HK']
+    assert index.lookup('2400:cb01::') == []
+    assert index.lookup('ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff') == ['END']
+    assert index.lookup('ffff:ffff:ffff:fffe::') == []
+    # IPv4 映射地址按 IPv6 查询，不会命中 IPv4 列表
+    assert index.lookup('::ffff:1.1.1.1') == ['MAPPED']
+    assert index.lookup('1.1.1.1') == ['HK']
+
+
+def test_matches_brute_force_on_random_overlapping_ranges():
+    rng = random.Random(5)
+    entries = []
+    for _ in range(300):
+        version = rng.choice((4, 6))
+        bits = 32 if version == 4 else 128
+        prefix = rng.randint(bits - 24, bits) if version == 4 else rng.randint(100, 128)
+        base = rng.getrandbits(bits) & ~((1 << (bits - prefix)) - 1)
+        # 集中在少数高位前缀下，保证大量重叠
+        base = (base & ((1 << (bits - 8)) - 1)) | (rng.choice((10, 11)) << (bits - 8))
+        network = ipaddress.ip_network((base, prefix))
+        entries.append((rng.choice('abcde'), str(network)))
+    index = make_index(entries)
+    networks = [(name.upper(), ipaddress.ip_network(cidr)) for name, cidr in entries]
+    probes = []
+    for _, net in networks:
+        probes += [net.network_address, net.broadcast_address, net.network_address - 1, net.broadcast_address + 1]
+    for ip in probes:
+        expected = sorted({name for name, net in networks if net.version == ip.version and ip in net})
+        assert index.lookup(str(ip)) == expected, ip
+
+
+def test_add_text_parses_comments_and_filters_by_ip_type():
+    index = geoip_check.CIDRIndex()
+    lines = ['# header', '1.0.0.0/24 # trailing', '2001:db8::/32 // go style', '', 'garbage', '  8.8.8.8  ']
+    assert index.add_text('v4', lines, only_ip_type='ipv4') == 2
+    assert index.add_text('v6', lines, only_ip_type='IPv6') == 1
+    assert index.add_text('any', lines) == 3
+    assert index.lookup('8.8.8.8') == ['ANY', 'V4']
+    assert index.lookup('2001:db8::5') == ['ANY', 'V6']
+    assert index.names == {'V4', 'V6', 'ANY'}
+
+
+def test_adding_after_build_rebuilds_on_next_lookup():
+    index = make_index([('a', '10.0.0.0/8')])
+    assert index.lookup('10.0.0.1') == ['A']
+    index.add('b', '10.0.0.0/24')
+    assert index.lookup('10.0.0.1') == ['A', 'B']
+
+
+def test_invalid_input_and_batch_lookup():
+    index = make_index([('Cn', '1.0.0.0/8')])
+    assert index.add('cn', 'not-a-network') is False
+    assert index.lookup('nope') == []
+    assert index.lookup(None) == []
+    assert index.contains(' 1.2.3.4 ', 'cn')
+    assert not index.contains('2.2.3.4', 'CN')
+    assert index.lookup_many(['1.2.3.4', '2.2.3.4', '::1']) == [['CN'], [], []]
+
+
+# ---------------------------------------------------------------------------
+# V2Ray geoip.dat（GeoIPList protobuf）
+# ---------------------------------------------------------------------------
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number: int, payload) -> bytes:
+    if isinstance(payload, int):
+        return _varint(number << 3) + _varint(payload)
+    return _varint((number << 3) | 2) + _varint(len(payload)) + payload
+
+
+def encode_geoip_dat(lists) -> bytes:
+    out = b''
+    for code, cidrs in lists.items():
+        entry = _field(1, code.encode())
+        for cidr in cidrs:
+            net = ipaddress.ip_network(cidr)
+            entry += _field(2, _field(1, net.network_address.packed) + _field(2, net.prefixlen))
+        entry += _field(3, 0)  # reverse_match：varint 字段，应被跳过
+        out += _field(1, entry)
+    return out
+
+
+def test_load_geoip_dat(tmp_path):
+    path = tmp_path / 'geoip.dat'
+    path.write_bytes(encode_geoip_dat({
+        'cn': ['1.0.1.0/24', '240e::/20'],
+        'hk': ['1.0.1.128/25', '43.154.0.0/16'],
+        'private': ['10.0.0.0/8', 'fc00::/7'],
+    }))
+    index = geoip_check.CIDRIndex()
+    assert index.load_geoip_dat(str(path)) == 3
+    assert index.lookup('1.0.1.200') == ['CN', 'HK']
+    assert index.lookup('1.0.1.1') == ['CN']
+    assert index.lookup('240e:1::1') == ['CN']
+    assert index.lookup('fd00::1') == ['PRIVATE']
+
+    only = geoip_check.CIDRIndex()
+    assert only.load_geoip_dat(str(path), wanted=['hk']) == 1
+    assert only.names == {'HK'}
+    assert only.lookup('1.0.1.1') == []
+    assert only.lookup('43.154.64.180') == ['HK']
+
+
+def test_from_config_loads_local_text_inputs(tmp_path):
+    (tmp_path / 'lists').mkdir()
+    (tmp_path / 'lists' / 'hk').write_text('43.154.0.0/16\n2400:cb00::/32\n', encoding='utf-8')
+    config = {'input': [
+        {'type': 'text', 'action': 'add', 'args': {'name': '5ufhk', 'uri': 'lists/hk', 'onlyIPType': 'ipv4'}},
+        {'type': 'text', 'action': 'add', 'args': {'name': 'remote', 'uri': 'https://example.com/list.txt'}},
+        {'type': 'text', 'action': 'add', 'args': {'name': 'missing', 'uri': 'lists/none'}},
+        {'type': 'maxmindGeoLite2Country', 'action': 'add'},
+    ]}
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps(config), encoding='utf-8')
+    index = geoip_check.CIDRIndex.from_config(str(path))
+    assert index.names == {'5UFHK'}
+    assert index.lookup('43.154.64.180') == ['5UFHK']
+    assert index.lookup('2400:cb00::1') == []
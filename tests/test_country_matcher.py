@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""CountryMatcher：英文名 / 别名 / 简繁中文名命中，词边界与最长优先，以及 country_matcher() 只构建一次"""
+
+import threading
+
+import pytest
+
+import geoip_check
+from geoip_check import CountryMatcher
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    return CountryMatcher.load()
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Hong Kong', ('Hong Kong', 'HK')),
+    ('UNITED STATES', ('UNITED STATES', 'US')),
+    ('Located in Oman.', ('Oman', 'OM')),
+    ('Oman2', ('Oman', 'OM')),
+    # ISO_COUNTRIES 中的不换行连字符名称同时以普通连字符收录
+    ('Guinea-Bissau', ('Guinea-Bissau', 'GW')),
+    ('Guinea‑Bissau', ('Guinea‑Bissau', 'GW')),
+    ('Åland Islands', ('Åland Islands', 'AX')),
+    # GeoLite2 Locations 中的简体名及其繁体写法
+    ('香港', ('香港', 'HK')),
+    ('位于台湾', ('台湾', 'TW')),
+    ('台灣', ('台灣', 'TW')),
+])
+def test_hits(matcher, text, expected):
+    assert matcher.search(text) == expected
+
+
+# 拉丁字母名称前后紧接字母时不算命中（"Omani" 不含 "Oman"）
+@pytest.mark.parametrize('text', ['Omani', 'Germanyish', 'NewZealand', 'xJapan', '', 'Settings\nPrivacy'])
+def test_misses(matcher, text):
+    assert matcher.search(text) is None
+
+
+def test_longest_name_wins_and_all_names_are_found(matcher):
+    assert matcher.search('Romania') == ('Romania', 'RO')
+    assert matcher.search('Papua New Guinea') == ('Papua New Guinea', 'PG')
+    assert matcher.find_all('Niger, Nigeria; 香港 and Oman') == [
+        ('Niger', 'NE'), ('Nigeria', 'NG'), ('香港', 'HK'), ('Oman', 'OM')]
+
+
+def test_explicit_names_and_aliases():
+    matcher = CountryMatcher({'Holland': 'NL', 'Netherlands': 'NL', '荷兰': 'NL', '': 'XX'})
+    assert matcher.search('holland') == ('holland', 'NL')
+    assert matcher.search('The Netherlands') == ('Netherlands', 'NL')
+    assert matcher.search('来自荷兰') == ('荷兰', 'NL')
+    assert matcher.search('Hollandaise') is None
+    assert CountryMatcher({}).search('Netherlands') is None
+
+
+def test_missing_locations_fall_back_to_iso_names(tmp_path):
+    matcher = CountryMatcher.load(str(tmp_path))
+    assert matcher.search('Japan') == ('Japan', 'JP')
+    assert matcher.search('日本') is None
+
+
+def test_global_matcher_is_built_once(monkeypatch):
+    monkeypatch.setattr(geoip_check, '_COUNTRY_MATCHER', None)
+    built = []
+    load = CountryMatcher.load.__func__
+
+    def counting_load(cls, *args, **kwargs):
+        built.append(1)
+        return load(cls, *args, **kwargs)
+
+    monkeypatch.setattr(CountryMatcher, 'load', classmethod(counting_load))
+    barrier = threading.Barrier(4)
+    matchers = []
+
+    def get():
+        barrier.wait()
+        matchers.append(geoip_check.country_matcher())
+
+    threads = [threading.Thread(target=get) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert built == [1]
+    assert all(m is matchers[0] for m in matchers)
+    assert geoip_check.country_matcher().search('Hong Kong') == ('Hong Kong', 'HK')
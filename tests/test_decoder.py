@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""BodyDecoder：各编码及叠加编码的还原、截断与解压炸弹防护"""
+
+import functools
+import gzip
+import os
+import tracemalloc
+import zlib
+
+import pytest
+
+import geoip_check
+from geoip_check import BodyDecoder
+
+brotli = pytest.importorskip('brotli') if geoip_check.brotli is not None else None
+
+PLAIN = os.urandom(20000).hex().encode() + b'<p>Hong Kong</p>' * 4000
+
+
+def _deflate_raw(data):
+    obj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return obj.compress(data) + obj.flush()
+
+
+ENCODERS = {
+    'gzip': gzip.compress,
+    'deflate': zlib.compress,
+    'identity': lambda data: data,
+}
+if brotli is not None:
+    ENCODERS['br'] = brotli.compress
+
+
+def encode(data, content_encoding):
+    # Content-Encoding 按施加顺序列出
+    for coding in [c.strip() for c in content_encoding.split(',')]:
+        data = ENCODERS[coding](data)
+    return data
+
+
+def decode(body, content_encoding, limit, chunk=4096):
+    decoder = BodyDecoder(content_encoding, limit)
+    out = b''.join(decoder.feed(body[i:i + chunk]) for i in range(0, len(body), chunk))
+    assert decoder.size == len(out)
+    return out, decoder.truncated
+
+
+CODINGS = sorted(ENCODERS) + ['gzip, gzip'] + (['gzip, br', 'br, gzip', 'br, deflate'] if brotli else [])
+
+
+@pytest.mark.parametrize('coding', CODINGS)
+def test_round_trip_under_limit(coding):
+    out, truncated = decode(encode(PLAIN, coding), coding, len(PLAIN))
+    assert out == PLAIN and not truncated
+
+
+@pytest.mark.parametrize('coding', CODINGS)
+def test_truncates_at_limit(coding):
+    out, truncated = decode(encode(PLAIN, coding), coding, 1000)
+    assert out == PLAIN[:1000] and truncated
+
+
+def test_raw_deflate_fallback():
+    out, truncated = decode(_deflate_raw(PLAIN), 'deflate', len(PLAIN))
+    assert out == PLAIN and not truncated
+
+
+def test_unsupported_encoding():
+    with pytest.raises(ValueError):
+        BodyDecoder('compress')
+
+
+@functools.lru_cache(maxsize=None)
+def bomb_for(coding):
+    return encode(bytes(64 * 1024 * 1024), coding)
+
+
+BOMB_CODINGS = ['gzip', 'gzip, gzip'] + (['br', 'br, br', 'gzip, br', 'br, gzip'] if brotli else [])
+
+
+@pytest.mark.parametrize('coding', BOMB_CODINGS)
+def test_bomb_is_bounded(coding):
+    # 64MB 的零字节压缩后只有数十 KB（叠加编码更小）；解压峰值内存应与 limit 同量级
+    limit = 256 * 1024
+    bomb = bomb_for(coding)
+    tracemalloc.start()
+    try:
+        out, truncated = decode(bomb, coding, limit, chunk=64 * 1024)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert truncated and len(out) == limit
+    assert peak < 8 * limit
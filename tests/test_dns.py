@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""DNSResolver：TTL 过期、失败缓存、并发合并、提前刷新、预解析，以及连接类记录的 dns / connect 耗时与解析失败"""
+
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+import urllib3
+
+import geoip_check
+from geoip_check import DNSResolver
+
+
+class FakeDNS:
+    """替换 socket.getaddrinfo：只解析 records 中的 *.test 主机，其余交给系统解析"""
+
+    def __init__(self, records, delay: float = 0.0):
+        self.records = dict(records)
+        self.delay = delay
+        self.calls = []
+        self._real = socket.getaddrinfo
+
+    def __call__(self, host, port, *args, **kwargs):
+        if not str(host).endswith('.test'):
+            return self._real(host, port, *args, **kwargs)
+        self.calls.append(host)
+        time.sleep(self.delay)
+        addresses = self.records.get(host)
+        if addresses is None:
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, port or 0)) for address in addresses]
+
+
+@pytest.fixture
+def fake_dns(monkeypatch):
+    def install(records, delay: float = 0.0) -> FakeDNS:
+        fake = FakeDNS(records, delay)
+        monkeypatch.setattr(geoip_check.socket, 'getaddrinfo', fake)
+        return fake
+
+    return install
+
+
+def wait_for(condition, timeout: float = 2.0):
+    started = time.monotonic()
+    while not condition() and time.monotonic() - started < timeout:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_lookup_is_cached_until_the_ttl_expires(fake_dns):
+    fake = fake_dns({'svc.test': ['192.0.2.1', '192.0.2.1', '192.0.2.2']})
+    resolver = DNSResolver(ttl=0.3)
+    assert resolver.lookup('SVC.test') == ('192.0.2.1', '192.0.2.2')
+    assert resolver.lookup('svc.test') == ('192.0.2.1', '192.0.2.2')
+    assert fake.calls == ['svc.test']
+    time.sleep(0.35)
+    fake.records['svc.test'] = ['192.0.2.3']
+    assert resolver.lookup('svc.test') == ('192.0.2.3',)
+    assert len(fake.calls) == 2
+
+
+def test_literals_are_returned_without_resolving(fake_dns):
+    fake = fake_dns({})
+    resolver = DNSResolver()
+    assert resolver.lookup('127.0.0.1') == ('127.0.0.1',)
+    assert resolver.lookup('[::1]') == ('::1',)
+    assert fake.calls == []
+
+
+def test_failures_are_cached_for_the_negative_ttl(fake_dns):
+    fake = fake_dns({})
+    resolver = DNSResolver(negative_ttl=0.3)
+    for _ in range(2):
+        with pytest.raises(socket.gaierror):
+            resolver.lookup('missing.test')
+    assert fake.calls == ['missing.test']
+    time.sleep(0.35)
+    fake.records['missing.test'] = ['192.0.2.9']
+    assert resolver.lookup('missing.test') == ('192.0.2.9',)
+
+
+def test_concurrent_lookups_share_one_query(fake_dns):
+    fake = fake_dns({'svc.test': ['192.0.2.1']}, delay=0.1)
+    resolver = DNSResolver()
+    barrier = threading.Barrier(6)
+    results = []
+
+    def lookup():
+        barrier.wait()
+        results.append(resolver.lookup('svc.test'))
+
+    threads = [threading.Thread(target=lookup) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [('192.0.2.1',)] * 6
+    assert fake.calls == ['svc.test']
+
+
+def test_entries_close_to_expiry_are_refreshed_in_the_background(fake_dns):
+    fake = fake_dns({'svc.test': ['192.0.2.1']})
+    resolver = DNSResolver(ttl=1.0)
+    resolver.lookup('svc.test')
+    # 剩余寿命低于 DNS_REFRESH_AHEAD：命中立即返回旧地址，同时在后台刷新
+    time.sleep(1.0 * (1 - geoip_check.DNS_REFRESH_AHEAD) + 0.05)
+    fake.records['svc.test'] = ['192.0.2.2']
+    fake.delay = 0.2
+    started = time.monotonic()
+    assert resolver.lookup('svc.test') == ('192.0.2.1',)
+    assert time.monotonic() - started < 0.1
+    assert wait_for(lambda: resolver.lookup('svc.test') == ('192.0.2.2',))
+    assert fake.calls == ['svc.test', 'svc.test']
+
+
+def test_prefetch_resolves_uncached_hosts_once(fake_dns):
+    fake = fake_dns({'a.test': ['192.0.2.1'], 'b.test': ['192.0.2.2']})
+    resolver = DNSResolver()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = resolver.prefetch(['a.test', 'A.TEST', '', '192.0.2.7', 'b.test', 'missing.test'], executor)
+        assert len(futures) == 3
+        for future in futures:
+            try:
+                future.result(timeout=2)
+            except socket.gaierror:
+                pass
+        # 已缓存（包括解析失败）的主机不再预解析
+        assert resolver.prefetch(['a.test', 'b.test', 'missing.test'], executor) == []
+    assert resolver.lookup('a.test') == ('192.0.2.1',)
+    assert sorted(fake.calls) == ['a.test', 'b.test', 'missing.test']
+
+
+# ---------------------------------------------------------------------------
+# 连接类：经解析器建立连接并记录分阶段耗时
+# ---------------------------------------------------------------------------
+DNS_DELAY = 0.1
+
+
+@pytest.fixture
+def direct_checker(make_checker):
+    """不改发主机、使用独立解析器的检查器（请求按 URL 中的主机名解析并直连）"""
+    def make():
+        checker = make_checker(host_overrides={}, resolver=DNSResolver(), warm_up=False)
+        checker.retry_strategy.total = 0
+        return checker
+
+    return make
+
+
+def _traced_get(checker, url: str) -> geoip_check.CheckTrace:
+    trace = geoip_check.CheckTrace('DNS')
+    token = geoip_check._current_check.set(trace)
+    try:
+        checker._send('GET', url, timeout=2).close()
+    finally:
+        geoip_check._current_check.reset(token)
+    return trace
+
+
+def test_new_connections_record_dns_and_connect_time(fake_dns, direct_checker, standin):
+    fake_dns({'www.cloudflare.com.test': ['127.0.0.1']}, delay=DNS_DELAY)
+    port = standin.rsplit(':', 1)[1]
+    url = f'http://www.cloudflare.com.test:{port}/cdn-cgi/trace'
+    checker = direct_checker()
+    phases = _traced_get(checker, url).phases
+    assert phases['dns'] >= DNS_DELAY
+    # connect 只含 TCP 建连，不含解析等待
+    assert 0 <= phases['connect'] < DNS_DELAY
+    # 复用连接：不再解析也不再建连
+    assert 'dns' not in _traced_get(checker, url).phases
+    # 新的检查器建立新连接，但命中共享解析器的缓存
+    other = direct_checker()
+    other.resolver = checker.resolver
+    phases = _traced_get(other, url).phases
+    assert phases.get('dns', 0.0) < DNS_DELAY and 'connect' in phases
+
+
+@pytest.mark.parametrize('records', [{}, {'svc.test': []}], ids=['nxdomain', 'no-addresses'])
+@pytest.mark.parametrize('urllib3_has_name_resolution_error', [True, False], ids=['urllib3-2', 'urllib3-1'])
+def test_resolution_failures_surface_as_connection_errors(fake_dns, direct_checker, monkeypatch, records,
+                                                           urllib3_has_name_resolution_error):
+    fake_dns(records)
+    if not urllib3_has_name_resolution_error:
+        monkeypatch.delattr(urllib3.exceptions, 'NameResolutionError', raising=False)
+    with pytest.raises(requests.exceptions.ConnectionError) as info:
+        _traced_get(direct_checker(), 'http://svc.test/')
+    assert 'svc.test' in str(info.value)
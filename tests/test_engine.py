@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""检测引擎：结果缓存的出口查询失败 / 超时不影响整次检测"""
+
+import asyncio
+import time
+
+import pytest
+import urllib3
+
+import geoip_check
+
+
+def _run(checker, engine, deadline=None):
+    if engine == 'thread':
+        return checker._run_checks_threaded(deadline)
+    return asyncio.run(checker.run_all_checks_async(deadline))
+
+
+@pytest.mark.parametrize('engine', ['async', 'thread'])
+def test_egress_lookup_error_falls_back_to_uncached_run(make_checker, engine):
+    checker = make_checker(cache=geoip_check.ResultCache())
+
+    def broken():
+        raise urllib3.exceptions.ProtocolError('Connection broken: IncompleteRead')
+
+    checker.egress_ip = broken
+    results = _run(checker, engine)
+    assert set(results) == set(checker.check_table())
+    assert results['Cloudflare']['location'] == 'HK'
+    assert results['Netflix']['country'] == 'HK'
+
+
+@pytest.mark.parametrize('engine', ['async', 'thread'])
+def test_egress_lookup_counts_against_deadline(make_checker, engine):
+    checker = make_checker(cache=geoip_check.ResultCache())
+    checker.egress_ip = lambda: time.sleep(3)
+    started = time.monotonic()
+    results = _run(checker, engine, deadline=1)
+    assert time.monotonic() - started < 2
+    assert set(results) == set(checker.check_table())
+
+
+def test_stale_revalidation_does_not_deadlock_small_shared_pool(make_checker):
+    # race / hedge 检查的刷新会把子请求提交到共享线程池；刷新任务不能占满共享线程池的全部工作线程
+    cache = geoip_check.ResultCache()
+    checker = make_checker(cache=cache, max_workers=2, warm_up=False)
+    egress = '203.0.113.7'
+    for service in ('Facebook', 'OpenAI'):
+        cache.put(egress, service, {'available': True}, ttl=0.01)
+    time.sleep(0.05)
+    cached, live = checker._split_cached(checker.check_table(), egress)
+    assert {'Facebook', 'OpenAI'} <= set(cached)
+    started = time.monotonic()
+    while checker._revalidating and time.monotonic() - started < 5:
+        time.sleep(0.05)
+    assert not checker._revalidating
+    assert cache.get(egress, 'OpenAI')[1] == 'fresh'
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""多进程 fleet：子进程中途被杀死时在途出口重新排队、调用仍能结束，回收的子进程把未领取的代理交给接替者"""
+
+import json
+import multiprocessing
+import os
+import signal
+import threading
+
+import pytest
+
+import geoip_check
+
+TARGETS = 12
+
+
+class KillingWriter:
+    """写到第 kill_at 行时杀死一个 fleet 子进程"""
+
+    def __init__(self, kill_at: int):
+        self.kill_at = kill_at
+        self.lines = []
+        self.killed = None
+
+    def write(self, text: str):
+        for line in text.splitlines():
+            self.lines.append(json.loads(line))
+            if len(self.lines) == self.kill_at and self.killed is None:
+                child = multiprocessing.active_children()[0]
+                self.killed = child.pid
+                os.kill(child.pid, signal.SIGKILL)
+
+    def flush(self):
+        pass
+
+
+@pytest.mark.parametrize('kill_at', [1, TARGETS])
+def test_killed_shard_does_not_hang_the_fleet(standin, tmp_path, kill_at):
+    out = KillingWriter(kill_at)
+    returned = []
+
+    def run():
+        returned.append(geoip_check.run_fleet_sharded(
+            [standin] * TARGETS, out=out, processes=2, concurrency=4, per_proxy=4, recycle_after=100,
+            timeout=2, tmp_dir=str(tmp_path), dump_every=0, host_overrides={'*': standin}))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(90)
+    assert not thread.is_alive(), '子进程被杀死后 run_fleet_sharded 没有返回'
+    assert out.killed is not None
+    # 被杀死子进程的在途出口重新排队后完成，每个代理恰好一条记录
+    assert returned == [TARGETS] == [len(out.lines)]
+    assert all(line['proxy'] == standin for line in out.lines)
+
+
+def test_recycled_shards_hand_unclaimed_proxies_to_their_successors(standin, tmp_path):
+    out = KillingWriter(kill_at=0)
+    metrics = geoip_check.Metrics()
+    assert geoip_check.run_fleet_sharded(
+        [standin] * TARGETS, out=out, processes=2, concurrency=8, per_proxy=4, recycle_after=2, metrics=metrics,
+        timeout=2, tmp_dir=str(tmp_path), dump_every=0, host_overrides={'*': standin}) == TARGETS
+    assert len(out.lines) == TARGETS
+    # 各子进程退出时的指标快照都汇总进主进程
+    assert metrics.summary()['checks']['Netflix']['phases']['total']['count'] == TARGETS
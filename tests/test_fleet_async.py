@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""单进程 fleet（run_fleet_async）：记录按完成顺序逐行写出，单代理与全局在途请求数不超过上限"""
+
+import collections
+import json
+import threading
+import time
+
+import pytest
+
+import geoip_check
+
+
+class LineWriter:
+    """记录每行写出的时刻，确认代理检测完成后立即写出（不等整批结束）"""
+
+    def __init__(self):
+        self.lines = []
+        self.flushed = 0
+
+    def write(self, text: str):
+        for line in text.splitlines():
+            self.lines.append((time.monotonic(), json.loads(line)))
+
+    def flush(self):
+        self.flushed += 1
+
+
+@pytest.fixture
+def in_flight(monkeypatch):
+    """统计各代理与全局同时在途的请求数峰值（请求在工作线程中发送）"""
+    lock = threading.Lock()
+    current = collections.Counter()
+    peak = collections.Counter()
+    send = geoip_check.GeoIPChecker._send
+
+    def counting_send(self, method, url, **kwargs):
+        with lock:
+            current[self.proxy] += 1
+            current[None] += 1
+            peak[self.proxy] = max(peak[self.proxy], current[self.proxy])
+            peak[None] = max(peak[None], current[None])
+        try:
+            time.sleep(0.02)
+            return send(self, method, url, **kwargs)
+        finally:
+            with lock:
+                current[self.proxy] -= 1
+                current[None] -= 1
+
+    monkeypatch.setattr(geoip_check.GeoIPChecker, '_send', counting_send)
+    return peak
+
+
+def test_records_are_written_as_each_proxy_finishes(standin, make_standin, tmp_path):
+    slow = make_standin(slow={'www.netflix.com': 0.8})
+    out = LineWriter()
+    proxies = [slow] + [standin] * 5
+    done = geoip_check.run_fleet(proxies, out=out, concurrency=16, per_proxy=4, timeout=3,
+                                 tmp_dir=str(tmp_path), dump_every=0, host_overrides={'*': standin})
+    assert done == len(proxies) == len(out.lines) == out.flushed
+    # 输出按完成顺序：排在第一的慢代理最后写出，其余代理不必等它
+    assert [record['proxy'] for _, record in out.lines] == [standin] * 5 + [slow]
+    assert out.lines[-1][0] - out.lines[-2][0] >= 0.3
+    for _, record in out.lines:
+        assert record['ok'] and record['elapsed'] >= 0
+        assert set(record['results']) == {spec.name for spec in geoip_check.CHECK_REGISTRY}
+
+
+def test_per_proxy_and_global_in_flight_caps(standin, tmp_path, in_flight):
+    # 同一个替身服务器以不同的代理认证信息区分成 6 个代理
+    scheme, _, address = standin.partition('://')
+    proxies = [f'{scheme}://user{i}:x@{address}' for i in range(6)]
+    out = LineWriter()
+    assert geoip_check.run_fleet(proxies, out=out, concurrency=6, per_proxy=2, timeout=3,
+                                 tmp_dir=str(tmp_path), dump_every=0, host_overrides={'*': standin}) == 6
+    assert sorted(record['proxy'] for _, record in out.lines) == proxies
+    assert all(record['ok'] for _, record in out.lines)
+    assert max(in_flight[proxy] for proxy in proxies) <= 2
+    assert in_flight[None] <= 6
+    # 多个代理确实同时在检测
+    assert in_flight[None] > 2
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""对冲 / 竞速的备用 URL 与全局截止时间：先到的结论胜出、落选者不再输出、超时的检查带 timed_out 标记"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import geoip_check
+
+SLOW = 3.0
+
+
+def _declared(checker, engine, name):
+    if engine == 'thread':
+        return checker.run_declared(name)
+    return asyncio.run(checker.run_declared_async(name))
+
+
+def _run(checker, engine, deadline):
+    if engine == 'thread':
+        return checker._run_checks_threaded(deadline)
+    return asyncio.run(checker.run_all_checks_async(deadline))
+
+
+@pytest.mark.parametrize('engine', ['async', 'thread'])
+def test_hedge_returns_the_fast_alternate_without_waiting_for_the_slow_host(make_checker, make_standin, engine):
+    target = make_standin(slow={'chat.openai.com': SLOW})
+    checker = make_checker(host_overrides={'*': target}, timeout=SLOW * 2, warm_up=False)
+    assert checker.registry['OpenAI'].strategy == 'hedge'
+    started = time.monotonic()
+    result = _declared(checker, engine, 'OpenAI')
+    elapsed = time.monotonic() - started
+    assert result == {'available': True, 'country': 'HK'}
+    # 主域名 hedge_delay 秒内没有结论即启动 chatgpt.com，由后者给出结论
+    assert elapsed < SLOW / 3, elapsed
+    assert elapsed >= checker.registry['OpenAI'].hedge_delay
+
+
+@pytest.mark.parametrize('engine', ['async', 'thread'])
+def test_hedge_does_not_fire_the_alternate_when_the_primary_answers(make_checker, make_standin, engine):
+    target = make_standin(slow={'chatgpt.com': SLOW})
+    checker = make_checker(host_overrides={'*': target}, timeout=SLOW * 2, warm_up=False)
+    started = time.monotonic()
+    assert _declared(checker, engine, 'OpenAI') == {'available': True, 'country': 'HK'}
+    assert time.monotonic() - started < checker.registry['OpenAI'].hedge_delay
+
+
+@pytest.mark.parametrize('engine', ['async', 'thread'])
+def test_race_takes_the_first_conclusive_answer_and_silences_losers(make_checker, make_standin, capsys, engine):
+    # www 返回 503（重试后失败），graph 直接断开；两者都比 m.facebook.com 慢，结束时检查已经返回
+    target = make_standin(slow={'www.facebook.com': 0.5, 'graph.facebook.com': 0.5}, fail={'graph.facebook.com'})
+    checker = make_checker(host_overrides={'*': target}, warm_up=False)
+    assert checker.registry['Facebook'].strategy == 'race'
+    started = time.monotonic()
+    assert _declared(checker, engine, 'Facebook') == {'available': True}
+    assert time.monotonic() - started < 0.5
+    # 等落选者的请求在后台失败结束
+    time.sleep(SLOW)
+    assert '请求错误' not in capsys.readouterr().out
+
+
+def test_failures_of_attempts_that_finish_before_the_winner_are_still_reported(make_checker, make_standin, capsys):
+    target = make_standin(slow={'m.facebook.com': 0.5, 'graph.facebook.com': 0.5}, fail={'www.facebook.com'})
+    checker = make_checker(host_overrides={'*': target}, warm_up=False, timeout=1)
+    checker.retry_strategy.total = 0
+    assert checker.run_declared('Facebook') == {'available': True}
+    assert 'https://www.facebook.com/favicon.ico' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('engine', ['async', 'thread'])
+def test_checks_past_the_deadline_are_marked_timed_out(make_checker, make_standin, engine):
+    target = make_standin(slow={'twitter.com': SLOW})
+    checker = make_checker(host_overrides={'*': target}, timeout=SLOW * 2)
+    started = time.monotonic()
+    results = _run(checker, engine, deadline=1)
+    assert time.monotonic() - started < 2
+    assert results['X'] == {'available': False, 'timed_out': True}
+    assert set(results) == set(checker.check_table())
+    assert results['Cloudflare']['location'] == 'HK'
+    assert checker.metrics.summary()['checks']['X']['timeouts'] == 1
+
+
+def test_timed_out_result_uses_the_check_default():
+    checker = geoip_check.GeoIPChecker(warm_up=False, dump_every=0)
+    try:
+        assert checker.timed_out_result('DisneyPlus') == {'available': False, 'region': 'Unknown', 'timed_out': True}
+        assert checker.timed_out_result('Unregistered') == {'timed_out': True}
+    finally:
+        checker.close()
+
+
+def test_cancelled_requests_keep_their_concurrency_permit_until_the_thread_finishes(make_checker):
+    checker = make_checker(request_limit=1, warm_up=False)
+    release = threading.Event()
+
+    async def scenario():
+        blocked = asyncio.ensure_future(checker._to_thread(release.wait, 5))
+        await asyncio.sleep(0.05)
+        blocked.cancel()
+        await asyncio.sleep(0.05)
+        # 协程已取消，但工作线程中的调用仍在进行：许可不能归还
+        assert checker._request_sem.locked()
+        follower = asyncio.ensure_future(checker._to_thread(lambda: 'next'))
+        await asyncio.sleep(0.05)
+        assert not follower.done()
+        release.set()
+        assert await asyncio.wait_for(follower, 2) == 'next'
+        assert not checker._request_sem.locked()
+
+    asyncio.run(scenario())
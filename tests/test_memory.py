@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""内存有界：单项检查重复执行不抬高峰值 RSS，ResultHistory 的条数与驻留结果数不随运行次数增长"""
+
+import asyncio
+import os
+
+import geoip_bench
+import geoip_check
+
+# 单项检查预热后重复执行允许抬高的峰值 RSS（MB），与 geoip_bench --rss-budget 含义相同
+RSS_GROWTH_BUDGET_MB = float(os.environ.get('GEOIP_RSS_GROWTH_BUDGET_MB', 2))
+
+
+def test_repeated_checks_do_not_grow_peak_rss(standin, tmp_path):
+    # 在独立子进程中运行，避免其他测试已经抬高的峰值 RSS 掩盖增长
+    spec = {'kind': 'checks', 'runs': 20, 'target': standin, 'timeout': 2, 'tmp_dir': str(tmp_path),
+            'verify': None, 'soup': False}
+    report = geoip_bench._run_in_subprocess(spec)
+    assert report['checks']
+    over = {service: entry['rss_growth_mb'] for service, entry in report['checks'].items()
+            if entry['rss_growth_mb'] > RSS_GROWTH_BUDGET_MB}
+    assert not over, over
+
+
+def test_history_stays_bounded_across_full_runs(make_checker):
+    checker = make_checker()
+    history = geoip_check.ResultHistory(4)
+    runs = 12
+    for _ in range(runs):
+        results = asyncio.run(checker.run_all_checks_async(refresh=True))
+        for service, result in results.items():
+            history.append(service, result)
+    services = history.services()
+    assert set(services) == set(results)
+    assert len(history) == history.capacity * len(services)
+    for service in services:
+        assert len(history.entries(service)) == history.capacity
+        assert len(history._rings[service].values) <= 2 * history.capacity
+
+
+def test_history_compacts_distinct_results():
+    history = geoip_check.ResultHistory(8)
+    for i in range(1000):
+        history.append('X', {'region': f'R{i}'}, at=float(i))
+    ring = history._rings['X']
+    assert len(history) == 8
+    assert len(ring.values) <= 2 * history.capacity
+    # 压缩后仍按时间顺序返回最近的记录，且结果与写入时一致
+    entries = history.entries('X')
+    assert [entry['at'] for entry in entries] == [float(i) for i in range(992, 1000)]
+    assert [entry['result']['region'] for entry in entries] == [f'R{i}' for i in range(992, 1000)]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Metrics：直方图分桶（上界包含）、累计桶计数与 Prometheus 文本格式、snapshot / merge"""
+
+import re
+
+from geoip_check import CheckTrace, Metrics
+
+SAMPLE = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)\{(?P<labels>(?:[a-z_]+="(?:[^"\\]|\\.)*",?)*)\} (?P<value>\S+)$')
+LABEL = re.compile(r'([a-z_]+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse(text: str):
+    """按 Prometheus 文本格式解析：返回 TYPE 声明与 (名称, 标签, 值) 样本；格式不符时断言失败"""
+    types, samples = {}, []
+    assert text.endswith('\n')
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            types[name] = kind
+        elif line.startswith('# HELP '):
+            continue
+        else:
+            match = SAMPLE.match(line)
+            assert match, line
+            labels = {key: re.sub(r'\\(.)', lambda m: {'n': '\n'}.get(m.group(1), m.group(1)), value)
+                      for key, value in LABEL.findall(match['labels'])}
+            samples.append((match['name'], labels, float(match['value'])))
+    return types, samples
+
+
+def test_histogram_buckets_are_cumulative_with_inclusive_bounds():
+    metrics = Metrics()
+    for seconds in (0.005, 0.006, 0.3, 0.3, 20.0):
+        metrics.observe('Netflix', 'total', seconds)
+    types, samples = parse(metrics.to_prometheus())
+    assert types['geoip_check_phase_seconds'] == 'histogram'
+    buckets = {labels['le']: value for name, labels, value in samples if name == 'geoip_check_phase_seconds_bucket'}
+    assert list(buckets) == [repr(bound) for bound in Metrics.BUCKETS] + ['+Inf']
+    # 恰好等于上界的观测值落在该桶（le 为“小于等于”）
+    assert buckets['0.005'] == 1 and buckets['0.01'] == 2 and buckets['0.25'] == 2
+    assert buckets['0.5'] == 4 and buckets['10.0'] == 4 and buckets['+Inf'] == 5
+    assert list(buckets.values()) == sorted(buckets.values())
+    values = {name: value for name, _, value in samples if not name.endswith('_bucket')}
+    assert values['geoip_check_phase_seconds_count'] == 5
+    assert abs(values['geoip_check_phase_seconds_sum'] - 20.611) < 1e-6
+
+
+def test_counters_and_label_escaping():
+    metrics = Metrics()
+    trace = CheckTrace('We"ird\\Check\nName')
+    trace.add('ttfb', 0.02)
+    trace.count('requests', 3)
+    trace.count('errors')
+    metrics.record(trace)
+    metrics.record(trace)
+    types, samples = parse(metrics.to_prometheus())
+    assert all(types[f'geoip_check_{counter}_total'] == 'counter' for counter in CheckTrace.COUNTERS)
+    counters = {name: value for name, labels, value in samples if labels == {'check': trace.name}}
+    assert counters['geoip_check_requests_total'] == 6
+    assert counters['geoip_check_errors_total'] == 2
+    assert counters['geoip_check_retries_total'] == 0
+    phases = {labels['phase'] for name, labels, _ in samples if name == 'geoip_check_phase_seconds_count'}
+    assert phases == {'ttfb'}
+
+
+def test_snapshot_merge_matches_a_single_instance(tmp_path):
+    combined, parts = Metrics(), [Metrics(), Metrics()]
+    for i, seconds in enumerate((0.001, 0.07, 0.7, 3.0)):
+        combined.observe('YouTube', 'total', seconds)
+        parts[i % 2].observe('YouTube', 'total', seconds)
+    merged = Metrics()
+    for part in parts:
+        merged.merge(part.snapshot())
+    assert merged.to_prometheus() == combined.to_prometheus()
+    summary = merged.summary()['checks']['YouTube']['phases']['total']
+    assert summary['count'] == 4 and summary['max'] == 3.0 and summary['p50'] == 0.1
+    path = tmp_path / 'geoip.prom'
+    merged.write_prometheus(str(path))
+    assert path.read_text(encoding='utf-8') == combined.to_prometheus()
+    assert [p.name for p in tmp_path.iterdir()] == ['geoip.prom']
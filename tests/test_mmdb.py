@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""MMDBReader：用测试内构造的小型 MMDB 文件验证搜索树遍历（24/28/32 位记录、IPv4/IPv6 树）与数据段解码"""
+
+import ipaddress
+import struct
+
+import pytest
+
+import geoip_check
+
+
+# ---------------------------------------------------------------------------
+# 极简 MMDB 写入器（只覆盖测试用到的部分）
+# ---------------------------------------------------------------------------
+class Pointer:
+    """数据段中指向 offset 处字段的指针"""
+
+    def __init__(self, offset: int):
+        self.offset = offset
+
+
+class Typed:
+    """按指定类型编码的数值（uint64 / uint128 / int32 / float）"""
+
+    def __init__(self, dtype: int, value):
+        self.dtype = dtype
+        self.value = value
+
+
+def _ctrl(dtype: int, size: int) -> bytes:
+    if size < 29:
+        prefix, extra = size, b''
+    elif size < 285:
+        prefix, extra = 29, bytes([size - 29])
+    elif size < 65821:
+        prefix, extra = 30, (size - 285).to_bytes(2, 'big')
+    else:
+        prefix, extra = 31, (size - 65821).to_bytes(3, 'big')
+    if dtype <= 7:
+        return bytes([(dtype << 5) | prefix]) + extra
+    return bytes([prefix, dtype - 7]) + extra
+
+
+def encode(value) -> bytes:
+    if isinstance(value, Pointer):
+        if value.offset < 2048:
+            return bytes([(1 << 5) | (value.offset >> 8), value.offset & 0xFF])
+        ptr = value.offset - 2048
+        return bytes([(1 << 5) | (1 << 3) | (ptr >> 16)]) + (ptr & 0xFFFF).to_bytes(2, 'big')
+    if isinstance(value, Typed):
+        if value.dtype == 8:
+            return _ctrl(8, 4) + value.value.to_bytes(4, 'big', signed=True)
+        if value.dtype == 15:
+            return _ctrl(15, 4) + struct.pack('>f', value.value)
+        raw = value.value.to_bytes((value.value.bit_length() + 7) // 8, 'big')
+        return _ctrl(value.dtype, len(raw)) + raw
+    if isinstance(value, bool):
+        return _ctrl(14, int(value))
+    if isinstance(value, str):
+        raw = value.encode('utf-8')
+        return _ctrl(2, len(raw)) + raw
+    if isinstance(value, bytes):
+        return _ctrl(4, len(value)) + value
+    if isinstance(value, float):
+        return _ctrl(3, 8) + struct.pack('>d', value)
+    if isinstance(value, int):
+        raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+        return _ctrl(6 if len(raw) > 2 else 5, len(raw)) + raw
+    if isinstance(value, dict):
+        return _ctrl(7, len(value)) + b''.join(encode(k) + encode(v) for k, v in value.items())
+    if isinstance(value, list):
+        return _ctrl(11, len(value)) + b''.join(encode(v) for v in value)
+    raise TypeError(value)
+
+
+def _pack_node(left: int, right: int, record_size: int) -> bytes:
+    if record_size == 24:
+        return left.to_bytes(3, 'big') + right.to_bytes(3, 'big')
+    if record_size == 28:
+        middle = ((left >> 24) << 4) | (right >> 24)
+        return (left & 0xFFFFFF).to_bytes(3, 'big') + bytes([middle]) + (right & 0xFFFFFF).to_bytes(3, 'big')
+    return left.to_bytes(4, 'big') + right.to_bytes(4, 'big')
+
+
+def build_mmdb(path, networks, ip_version=6, record_size=24, data_prefix=()):
+    """
+    networks 为 [(cidr, 记录)]，按顺序插入（后插入的更具体网段覆盖先前的记录）；
+    data_prefix 中的值先写入数据段，可被记录中的 Pointer 引用。
+    """
+    data = b''
+    for value in data_prefix:
+        data += encode(value)
+    nodes = [[None, None]]
+    for cidr, record in networks:
+        net = ipaddress.ip_network(cidr)
+        bits, length = int(net.network_address), net.prefixlen
+        if ip_version == 6 and net.version == 4:
+            length += 96
+        total = 128 if ip_version == 6 else 32
+        leaf = ('data', len(data))
+        data += encode(record)
+        node = 0
+        for i in range(length):
+            bit = (bits >> (total - 1 - i)) & 1
+            if i == length - 1:
+                nodes[node][bit] = leaf
+                break
+            child = nodes[node][bit]
+            if not isinstance(child, int):
+                nodes.append([child, child])  # 拆分更粗的网段，原记录下沉到两个子节点
+                child = nodes[node][bit] = len(nodes) - 1
+            node = child
+    node_count = len(nodes)
+
+    def record_value(child):
+        if child is None:
+            return node_count
+        if isinstance(child, tuple):
+            return node_count + 16 + child[1]
+        return child
+
+    tree = b''.join(_pack_node(record_value(a), record_value(b), record_size) for a, b in nodes)
+    metadata = {'node_count': node_count, 'record_size': record_size, 'ip_version': ip_version,
+                'database_type': 'Test', 'languages': ['en'], 'binary_format_major_version': 2}
+    with open(path, 'wb') as f:
+        f.write(tree + b'\0' * 16 + data + geoip_check.MMDBReader.METADATA_MARKER + encode(metadata))
+    return str(path)
+
+
+NETWORKS = [
+    ('1.0.0.0/8', {'country': {'iso_code': 'US', 'names': {'en': 'United States'}}}),
+    ('1.2.0.0/16', {'country': {'iso_code': 'AU'}}),
+    ('8.8.8.0/24', {'country': 'CN'}),
+    ('43.154.64.180/32', {'registered_country': {'iso_code': 'HK'}}),
+    ('2001:db8::/32', {'country': {'iso_code': 'JP'}}),
+    ('2400:cb00::/32', {'continent': {'code': 'AS'}}),
+]
+
+
+@pytest.fixture(params=[24, 28, 32])
+def reader(request, tmp_path):
+    db = geoip_check.MMDBReader(build_mmdb(tmp_path / 'country.mmdb', NETWORKS, record_size=request.param))
+    yield db
+    db.close()
+
+
+def test_metadata(reader):
+    assert reader.ip_version == 6
+    assert reader.metadata['database_type'] == 'Test'
+    assert reader.metadata['languages'] == ['en']
+
+
+@pytest.mark.parametrize('ip, expected', [
+    ('1.9.9.9', 'US'),
+    ('1.2.3.4', 'AU'),            # 更具体的网段覆盖 /8
+    ('1.3.0.1', 'US'),
+    ('8.8.8.8', 'CN'),            # 本项目自定义 mmdb：country 直接是字符串
+    ('43.154.64.180', 'HK'),      # 只有 registered_country
+    ('43.154.64.181', None),
+    ('2001:db8::1', 'JP'),
+    ('2001:db8:ffff::', 'JP'),
+    ('2001:db9::1', None),
+    ('2400:cb00::1', None),       # 有记录但没有国家
+    ('9.9.9.9', None),
+    ('not-an-ip', None),
+])
+def test_country_code(reader, ip, expected):
+    assert reader.country_code(ip) == expected
+
+
+def test_lookup_returns_full_record_and_caches_it(reader):
+    record = reader.lookup('1.9.9.9')
+    assert record == NETWORKS[0][1]
+    # 同一网段的记录只解码一次
+    assert reader.lookup('1.200.0.1') is record
+    assert reader.lookup('9.9.9.9') is None
+
+
+def test_decodes_all_data_types(tmp_path):
+    long_text = 'x' * 300           # 长度需要两个额外字节
+    record = {
+        'country': {'iso_code': 'DE'},
+        'flags': [True, False],
+        'uint16': 513,
+        'uint32': 70000,
+        'uint64': Typed(9, 2 ** 40 + 1),
+        'uint128': Typed(10, 2 ** 100),
+        'int32': Typed(8, -5),
+        'double': 1.5,
+        'float': Typed(15, 0.25),
+        'bytes': b'\x00\x01',
+        'empty': {},
+        'long': long_text,
+        'medium': 'y' * 100,        # 长度需要一个额外字节
+        'utf8': '香港',
+    }
+    path = build_mmdb(tmp_path / 'types.mmdb', [('10.0.0.0/8', record)])
+    db = geoip_check.MMDBReader(path)
+    try:
+        decoded = db.lookup('10.1.2.3')
+    finally:
+        db.close()
+    assert decoded == {**record, 'uint64': 2 ** 40 + 1, 'uint128': 2 ** 100, 'int32': -5, 'float': 0.25}
+
+
+def test_pointers_resolve_relative_to_data_section(tmp_path):
+    shared = {'iso_code': 'SG'}
+    padding = 'p' * 3000            # 让后面的共享记录落在 2048 之后，需要两字节指针
+    far = {'iso_code': 'FR'}
+    near_offset = 0
+    far_offset = len(encode(shared)) + len(encode(padding))
+    path = build_mmdb(tmp_path / 'pointers.mmdb', [
+        ('5.0.0.0/8', {'country': Pointer(near_offset)}),
+        ('6.0.0.0/8', {'country': Pointer(near_offset)}),
+        ('7.0.0.0/8', {'country': Pointer(far_offset)}),
+    ], data_prefix=[shared, padding, far])
+    db = geoip_check.MMDBReader(path)
+    try:
+        assert db.country_code('5.1.1.1') == 'SG'
+        assert db.country_code('6.1.1.1') == 'SG'
+        assert db.country_code('7.1.1.1') == 'FR'
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize('record_size', [24, 28, 32])
+def test_ipv4_only_tree(tmp_path, record_size):
+    path = build_mmdb(tmp_path / 'v4.mmdb', [('1.0.0.0/8', {'country': {'iso_code': 'US'}}),
+                                             ('203.0.113.0/24', {'country': {'iso_code': 'NZ'}})],
+                      ip_version=4, record_size=record_size)
+    db = geoip_check.MMDBReader(path)
+    try:
+        assert db.ip_version == 4
+        assert db.country_code('1.2.3.4') == 'US'
+        assert db.country_code('203.0.113.9') == 'NZ'
+        assert db.country_code('203.0.114.9') is None
+        assert db.country_code('2001:db8::1') is None
+    finally:
+        db.close()
+
+
+def test_28_bit_records_use_the_shared_high_nibbles(tmp_path):
+    # 数据段偏移超过 2^24 时，28 位记录的最高 4 位存放在节点中间字节的高 / 低半字节
+    padding = bytes(1 << 24)
+    path = build_mmdb(tmp_path / 'big.mmdb', [('0.0.0.0/1', {'country': {'iso_code': 'AA'}}),
+                                              ('128.0.0.0/1', {'country': {'iso_code': 'BB'}})],
+                      ip_version=4, record_size=28, data_prefix=[padding])
+    db = geoip_check.MMDBReader(path)
+    try:
+        assert db.country_code('1.1.1.1') == 'AA'
+        assert db.country_code('200.1.1.1') == 'BB'
+    finally:
+        db.close()
+
+
+def test_rejects_files_without_metadata(tmp_path):
+    path = tmp_path / 'broken.mmdb'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        geoip_check.MMDBReader(str(path))
+    assert geoip_check.open_country_db(str(path)) is None
+
+
+def test_open_country_db_reuses_reader(tmp_path):
+    path = build_mmdb(tmp_path / 'country.mmdb', NETWORKS)
+    db = geoip_check.open_country_db(path)
+    assert db is not None and db.country_code('1.2.3.4') == 'AU'
+    assert geoip_check.open_country_db(path) is db
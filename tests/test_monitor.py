@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""常驻监控：批次复用 Cloudflare 检查得到的出口，以及 serve() 端点的 /results、/metrics、/history、/healthz"""
+
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import geoip_check
+from geoip_check import Monitor, ResultCache
+
+
+@pytest.fixture
+def monitor(make_checker):
+    checker = make_checker(cache=ResultCache(), warm_up=False)
+    trace_fetches = []
+    original = checker._fetch_page
+
+    def fetch_page(fetch):
+        if fetch.url == geoip_check.EGRESS_TRACE_URL:
+            trace_fetches.append(fetch.url)
+        return original(fetch)
+
+    checker._fetch_page = fetch_page
+    monitor = Monitor(checker, watch_interval=60)
+    monitor.trace_fetches = trace_fetches
+    return monitor
+
+
+def test_batches_reuse_the_egress_until_the_cloudflare_interval_passes(monitor):
+    # 首个批次含 Cloudflare：出口查询与 Cloudflare 检查共用一次 trace 抓取
+    asyncio.run(monitor._run_batch(list(monitor.checker.check_table())))
+    assert len(monitor.trace_fetches) == 1
+    assert monitor.egress == ('203.0.113.7', 'HK')
+    # 不含 Cloudflare 的批次复用已知出口，结果照常写入该出口的缓存分区
+    for _ in range(3):
+        asyncio.run(monitor._run_batch(['Netflix', 'TikTok']))
+    assert len(monitor.trace_fetches) == 1
+    assert monitor.checker.cache.get('203.0.113.7', 'Netflix') is not None
+    # 超过 Cloudflare 的复检间隔（含抖动）后重新查询出口
+    monitor._egress_at -= monitor.watch_interval * (1 + monitor.jitter) + 1
+    asyncio.run(monitor._run_batch(['Netflix']))
+    assert len(monitor.trace_fetches) == 2
+
+
+def _get(url: str):
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    try:
+        with opener.open(url, timeout=5) as response:
+            return response.status, response.headers.get('Content-Type'), response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get('Content-Type'), e.read()
+
+
+def test_endpoint_serves_results_metrics_and_history(monitor):
+    server = monitor.serve('127.0.0.1', 0)
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        assert _get(f'{base}/healthz')[0] == 503
+        before = time.time()
+        asyncio.run(monitor._run_batch(list(monitor.checker.check_table())))
+
+        status, content_type, body = _get(f'{base}/results')
+        assert status == 200 and content_type.startswith('application/json')
+        snapshot = json.loads(body)
+        assert snapshot['egress'] == {'ip': '203.0.113.7', 'location': 'HK', 'changes': 0}
+        assert set(snapshot['results']) == set(monitor.checker.check_table())
+        assert snapshot['results']['Cloudflare']['location'] == 'HK'
+        assert snapshot['generated_at'] >= before and snapshot['rss_bytes'] > 0
+
+        status, _, body = _get(f'{base}/results/Netflix')
+        assert status == 200 and json.loads(body) == snapshot['results']['Netflix']
+        assert _get(f'{base}/results/Nope')[0] == 404
+
+        asyncio.run(monitor._run_batch(['Netflix']))
+        status, _, body = _get(f'{base}/history/Netflix?limit=1')
+        assert status == 200 and len(json.loads(body)) == 1
+        assert len(json.loads(_get(f'{base}/history/Netflix')[2])) == 2
+
+        status, content_type, body = _get(f'{base}/metrics')
+        assert status == 200 and content_type.startswith('text/plain; version=0.0.4')
+        text = body.decode()
+        assert '# TYPE geoip_check_resident_memory_bytes gauge' in text
+        assert f'geoip_check_history_entries {len(monitor.history)}' in text
+        assert '_bucket{' in text and 'le="+Inf"' in text
+
+        assert _get(f'{base}/healthz')[:1] == (200,)
+        assert _get(f'{base}/nope')[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
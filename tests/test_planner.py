@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""检查注册表的抓取规划：相同 (URL, 请求头) 合并为一个 Fetch，单次检测内每个 Fetch 只请求一次"""
+
+import asyncio
+import collections
+import threading
+import time
+
+import pytest
+
+import geoip_check
+from geoip_check import CheckRegistry, CheckSpec, FetchCache, StatusIs, TraceField
+
+
+def test_shared_url_is_planned_once_and_upgraded_to_get_with_body():
+    registry = CheckRegistry([
+        CheckSpec('Probe', urls='https://a.example/', fields={'available': StatusIs(200)}),
+        CheckSpec('Trace', urls=('https://a.example/', 'https://b.example/'), fields={'loc': TraceField('loc')}),
+    ])
+    assert len(registry.fetches) == 2
+    shared = registry.plans['Probe'][0]
+    assert registry.plans['Trace'][0] is shared
+    # 任一使用者需要正文时，合并后的抓取取 GET 与正文
+    assert (shared.mode, shared.needs_body) == ('get', True)
+    assert registry.plans['Trace'][1].url == 'https://b.example/'
+
+
+def test_probe_only_users_keep_the_cheap_probe():
+    registry = CheckRegistry([
+        CheckSpec('A', urls='https://a.example/', fields={'available': StatusIs(200)}),
+        CheckSpec('B', urls='https://a.example/', fields={'ok': StatusIs(204)}),
+    ])
+    (fetch,) = registry.fetches
+    assert (fetch.mode, fetch.needs_body) == ('probe', False)
+
+
+def test_explicit_get_mode_wins_without_requiring_a_body():
+    registry = CheckRegistry([
+        CheckSpec('A', urls='https://a.example/', fields={'available': StatusIs(200)}),
+        CheckSpec('B', urls='https://a.example/', mode='get', fields={'available': StatusIs(200)}),
+    ])
+    (fetch,) = registry.fetches
+    assert (fetch.mode, fetch.needs_body) == ('get', False)
+
+
+def test_headers_are_part_of_the_fetch_key():
+    registry = CheckRegistry([
+        CheckSpec('Plain', urls='https://a.example/', fields={'available': StatusIs(200)}),
+        CheckSpec('Mobile', urls='https://a.example/', fields={'available': StatusIs(200)},
+                  headers={'User-Agent': 'm', 'Accept': '*/*'}),
+        CheckSpec('MobileToo', urls='https://a.example/', fields={'available': StatusIs(200)},
+                  headers={'Accept': '*/*', 'User-Agent': 'm'}),
+    ])
+    assert len(registry.fetches) == 2
+    assert registry.plans['Mobile'][0] is registry.plans['MobileToo'][0]
+    assert registry.plans['Plain'][0] is not registry.plans['Mobile'][0]
+    assert dict(registry.plans['Mobile'][0].headers) == {'User-Agent': 'm', 'Accept': '*/*'}
+
+
+def test_redirect_stop_only_applies_when_every_user_agrees():
+    def spec(name, stop):
+        return CheckSpec(name, urls='https://a.example/', fields={'available': StatusIs(200)}, redirect_stop=stop)
+
+    agreed = CheckRegistry([spec('A', r'\.jp/'), spec('B', r'\.jp/')])
+    assert agreed.fetches[0].redirect_stop.pattern == r'\.jp/'
+    assert CheckRegistry([spec('A', r'\.jp/'), spec('B', r'\.de/')]).fetches[0].redirect_stop is None
+    assert CheckRegistry([spec('A', r'\.jp/'), spec('B', None)]).fetches[0].redirect_stop is None
+
+
+def test_egress_lookup_shares_the_cloudflare_trace_fetch():
+    registry = geoip_check.CHECK_REGISTRY
+    assert registry.fetch_for(geoip_check.EGRESS_TRACE_URL) is registry.plans['Cloudflare'][0]
+    unplanned = registry.fetch_for('https://unplanned.example/')
+    assert (unplanned.mode, unplanned.needs_body) == ('get', True)
+
+
+def test_fetch_cache_runs_concurrent_fetches_once():
+    cache = FetchCache()
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    results = []
+
+    def user():
+        barrier.wait()
+        results.append(cache.get('key', fetch))
+
+    threads = [threading.Thread(target=user) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+
+
+def test_fetch_cache_shares_failures():
+    cache = FetchCache()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        raise RuntimeError('boom')
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            cache.get('key', fetch)
+    assert len(calls) == 1
+
+
+def _count_fetches(checker):
+    counts = collections.Counter()
+    lock = threading.Lock()
+    original = checker._fetch_page
+
+    def counting(fetch):
+        with lock:
+            counts[fetch.key] += 1
+        return original(fetch)
+
+    checker._fetch_page = counting
+    return counts
+
+
+@pytest.mark.parametrize('engine', ['async', 'thread'])
+def test_full_run_requests_each_planned_fetch_once(make_checker, engine):
+    checker = make_checker(cache=geoip_check.ResultCache())
+    counts = _count_fetches(checker)
+    if engine == 'thread':
+        results = checker._run_checks_threaded()
+    else:
+        results = asyncio.run(checker.run_all_checks_async())
+    assert results['Cloudflare']['location'] == 'HK'
+    assert counts and max(counts.values()) == 1, counts
+    # 结果缓存的出口查询与 Cloudflare 检查共用同一次 trace 抓取
+    assert counts[geoip_check.CHECK_REGISTRY.plans['Cloudflare'][0].key] == 1
+
+
+def test_each_run_gets_its_own_fetch_cache(make_checker):
+    registry = CheckRegistry([
+        CheckSpec('A', urls='https://www.cloudflare.com/cdn-cgi/trace', fields={'loc': TraceField('loc')}),
+        CheckSpec('B', urls='https://www.cloudflare.com/cdn-cgi/trace', fields={'ip': TraceField('ip')}),
+    ])
+    checker = make_checker(registry=registry, warm_up=False)
+    counts = _count_fetches(checker)
+    for _ in range(2):
+        results = asyncio.run(checker.run_all_checks_async())
+        assert results['A']['loc'] == 'HK'
+    (key,) = counts
+    assert counts[key] == 2
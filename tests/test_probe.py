@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""probe：HEAD 路径、拒绝 HEAD（405）时回退到流式 GET、超出字节预算即关闭连接，以及检查声明的预算"""
+
+import pytest
+
+import geoip_check
+from geoip_check import CheckRegistry, CheckSpec, StatusIs
+
+# 替身服务器默认页面的正文大小（'<html><body>ok</body></html>' × 1000）
+PAGE_BYTES = 28 * 1000
+
+
+@pytest.fixture
+def checker(make_checker):
+    checker = make_checker(warm_up=False)
+    checker.retry_strategy.total = 0
+    return checker
+
+
+def traced(checker, func, *args, **kwargs):
+    trace = geoip_check.CheckTrace('Probe')
+    token = geoip_check._current_check.set(trace)
+    try:
+        return func(*args, **kwargs), trace
+    finally:
+        geoip_check._current_check.reset(token)
+
+
+def test_head_is_enough_when_the_site_accepts_it(checker):
+    response, trace = traced(checker, checker.probe, 'https://www.netflix.com/')
+    assert response.status_code == 200
+    assert response.request.method == 'HEAD'
+    assert trace.counters['requests'] == 1
+
+
+def test_rejected_head_falls_back_to_a_streamed_get(checker):
+    response, trace = traced(checker, checker.probe, 'https://www.tiktok.com/')
+    assert response.request.method == 'GET'
+    assert response.status_code == 200
+    assert trace.counters['requests'] == 2
+
+
+def test_connection_errors_do_not_retry_with_get(make_checker, make_standin):
+    checker = make_checker(host_overrides={'*': make_standin(fail={'www.tiktok.com'})}, warm_up=False)
+    checker.retry_strategy.total = 0
+    response, trace = traced(checker, checker.probe, 'https://www.tiktok.com/')
+    assert response is None
+    assert trace.counters['requests'] == 0 and trace.counters['errors'] == 1
+
+
+@pytest.mark.parametrize('byte_budget, reused', [(1024, False), (PAGE_BYTES, True)])
+def test_body_over_the_budget_closes_the_connection_early(checker, byte_budget, reused):
+    response = checker.probe('https://www.tiktok.com/', byte_budget)
+    assert response.request.method == 'GET'
+    assert int(response.headers['Content-Length']) == PAGE_BYTES
+    # 超出预算：不读正文直接关闭连接；预算之内：读完正文，连接归还连接池，同一主机的下一个请求复用
+    assert response.raw.isclosed()
+    _, trace = traced(checker, checker.follow_redirects, 'HEAD', 'https://www.tiktok.com/', timeout=2)
+    assert ('connect' not in trace.phases) is reused
+
+
+def test_spec_byte_budget_reaches_probe(make_checker):
+    registry = CheckRegistry([
+        CheckSpec('Small', urls='https://www.tiktok.com/', fields={'available': StatusIs(200)}, byte_budget=1024),
+        CheckSpec('Large', urls='https://www.tiktok.com/', fields={'ok': StatusIs(200)}, byte_budget=64 * 1024),
+        CheckSpec('Default', urls='https://www.netflix.com/', fields={'available': StatusIs(200)}),
+    ])
+    # 共享同一抓取时取最大的预算，未声明时为 PROBE_BYTE_BUDGET
+    assert registry.plans['Small'][0].byte_budget == 64 * 1024
+    assert registry.plans['Default'][0].byte_budget == geoip_check.PROBE_BYTE_BUDGET
+    checker = make_checker(registry=registry, warm_up=False)
+    budgets = {}
+    original = checker.probe
+
+    def probe(url, byte_budget=geoip_check.PROBE_BYTE_BUDGET, **kwargs):
+        budgets[url] = byte_budget
+        return original(url, byte_budget, **kwargs)
+
+    checker.probe = probe
+    assert checker.run_declared('Small') == {'available': True}
+    assert checker.run_declared('Default') == {'available': True}
+    assert budgets == {'https://www.tiktok.com/': 64 * 1024, 'https://www.netflix.com/': geoip_check.PROBE_BYTE_BUDGET}
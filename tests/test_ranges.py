@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""批量定位：GeoLite2 Blocks CSV 的 IPv4 / IPv6 区间查询、bulk_geolocate 分块输出，以及 .npy 缓存的复用与失效"""
+
+import io
+import os
+
+import pytest
+
+import geoip_check
+
+np = pytest.importorskip('numpy')
+
+LOCATIONS = [('1', 'HK'), ('2', 'JP'), ('3', 'US'), ('4', '')]
+BLOCKS_V4 = [
+    # network, geoname_id, registered_country_geoname_id
+    ('1.0.0.0/24', '1', ''),
+    ('1.0.1.0/24', '', '2'),     # 只有注册国家时取注册国家
+    ('8.8.8.0/24', '3', '3'),
+    ('10.0.0.0/8', '4', ''),     # 没有国家代码的网段不收录
+    ('255.255.255.255/32', '2', ''),
+]
+BLOCKS_V6 = [
+    ('2001:db8::/32', '2', ''),
+    ('2400:cb00::/32', '1', ''),
+    ('ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff/128', '3', ''),
+]
+
+
+def write_geolite2(directory, v4=BLOCKS_V4, v6=BLOCKS_V6):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'GeoLite2-Country-Locations-en.csv'), 'w', encoding='utf-8') as f:
+        f.write('geoname_id,locale_code,continent_code,continent_name,country_iso_code,country_name,'
+                'is_in_european_union\n')
+        f.writelines(f'{geoname},en,AS,Asia,{code},Name,0\n' for geoname, code in LOCATIONS)
+    for version, blocks in ((4, v4), (6, v6)):
+        with open(os.path.join(directory, f'GeoLite2-Country-Blocks-IPv{version}.csv'), 'w', encoding='utf-8') as f:
+            f.write('network,geoname_id,registered_country_geoname_id,represented_country_geoname_id,'
+                    'is_anonymous_proxy,is_satellite_provider\n')
+            f.writelines(f'{network},{geoname},{registered},,0,0\n' for network, geoname, registered in blocks)
+
+
+@pytest.fixture
+def geolite2(tmp_path):
+    directory = str(tmp_path / 'geolite2')
+    write_geolite2(directory)
+    return directory
+
+
+def test_ipv4_and_ipv6_lookups(geolite2):
+    table = geoip_check.CountryRangeTable.from_csv(geolite2)
+    addresses = ['1.0.0.0', '1.0.0.255', '1.0.1.7', '1.0.2.0', '0.255.255.255', '8.8.8.8', '10.1.1.1',
+                 '255.255.255.255', '2001:db8::1', '2001:db8:ffff:ffff:ffff:ffff:ffff:ffff', '2001:db9::',
+                 '2400:cb00:1::', '::1', 'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff', 'not-an-ip', '', '1.2.3']
+    assert table.lookup_many(addresses) == [
+        'HK', 'HK', 'JP', '', '', 'US', '', 'JP', 'JP', 'JP', '', 'HK', '', 'US', '', '', '']
+
+
+def test_empty_tables_return_no_country(tmp_path):
+    directory = str(tmp_path / 'empty')
+    write_geolite2(directory, v4=[], v6=[])
+    table = geoip_check.CountryRangeTable.from_csv(directory)
+    assert table.lookup_many(['1.0.0.1', '2001:db8::1']) == ['', '']
+
+
+def test_bulk_geolocate_streams_chunks(geolite2):
+    table = geoip_check.CountryRangeTable.from_csv(geolite2)
+    out = io.StringIO()
+    lines = ['1.0.0.1 first\n', '2001:db8::5\tsecond\r\n', '\n', 'bogus\n', '8.8.4.4\n']
+    assert geoip_check.bulk_geolocate(table, iter(lines), out, chunk_size=2) == 5
+    assert out.getvalue().splitlines() == [
+        '1.0.0.1 first\tHK', '2001:db8::5\tsecond\tJP', '\t', 'bogus\t', '8.8.4.4\t']
+
+
+def test_cache_is_reused_until_a_source_csv_changes(geolite2, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'ranges')
+    built = []
+    from_csv = geoip_check.CountryRangeTable.from_csv.__func__
+
+    def counting_from_csv(cls, directory):
+        built.append(directory)
+        return from_csv(cls, directory)
+
+    monkeypatch.setattr(geoip_check.CountryRangeTable, 'from_csv', classmethod(counting_from_csv))
+    first = geoip_check.load_country_ranges(geolite2, cache_dir)
+    assert len(built) == 1
+    assert sorted(os.listdir(cache_dir)) == sorted([f'{name}.npy' for name in first.ARRAYS] + ['meta.json'])
+
+    # 源文件未变：直接以 mmap 方式加载缓存
+    cached = geoip_check.load_country_ranges(geolite2, cache_dir)
+    assert len(built) == 1
+    assert isinstance(cached.v4_start, np.memmap)
+    assert cached.lookup_many(['1.0.0.1', '2400:cb00::1']) == ['HK', 'HK']
+
+    # 改写 Blocks CSV（大小不变）：缓存失效并重新构建
+    path = os.path.join(geolite2, 'GeoLite2-Country-Blocks-IPv4.csv')
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text.replace('1.0.0.0/24,1,', '1.0.0.0/24,3,'))
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+    rebuilt = geoip_check.load_country_ranges(geolite2, cache_dir)
+    assert len(built) == 2
+    assert rebuilt.lookup_many(['1.0.0.1']) == ['US']
+
+    # 缓存不完整（缺少数组文件）时重建；rebuild=True 时总是重建
+    os.remove(os.path.join(cache_dir, 'v6_code.npy'))
+    assert geoip_check.load_country_ranges(geolite2, cache_dir).lookup_many(['2001:db8::1']) == ['JP']
+    assert len(built) == 3
+    geoip_check.load_country_ranges(geolite2, cache_dir, rebuild=True)
+    assert len(built) == 4
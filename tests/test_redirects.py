@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""follow_redirects：循环检测（设置 Cookie 的往返除外）、跳数上限、相对 Location 解析与 stop 提前返回"""
+
+import pytest
+import requests
+
+import geoip_check
+import geoip_http
+
+BASE = 'https://redirect.standin'
+
+
+@pytest.fixture
+def checker(make_checker):
+    return make_checker(warm_up=False)
+
+
+def test_redirect_to_itself_is_a_loop(checker):
+    with pytest.raises(geoip_http.RedirectLoopError) as info:
+        checker.follow_redirects('GET', f'{BASE}/loop')
+    assert info.value.response.status_code == 302
+
+
+def test_ping_pong_without_new_cookies_is_a_loop(checker):
+    with pytest.raises(geoip_http.RedirectLoopError):
+        checker.follow_redirects('GET', f'{BASE}/ping')
+
+
+def test_round_trip_that_sets_a_cookie_is_followed(checker):
+    response = checker.follow_redirects('GET', f'{BASE}/login')
+    assert response.status_code == 200
+    assert response.url == f'{BASE}/login'
+    assert [hop.url for hop in response.history] == [f'{BASE}/login', f'{BASE}/auth']
+    assert checker.session.cookies.get('session') == '1'
+    # Cookie 已在 Session 中：再次访问直接返回
+    assert checker.follow_redirects('GET', f'{BASE}/login').history == []
+
+
+def test_relative_locations_resolve_against_the_current_url(checker):
+    trace = geoip_check.CheckTrace('Redirects')
+    token = geoip_check._current_check.set(trace)
+    try:
+        response = checker.follow_redirects('GET', f'{BASE}/hops/3', max_hops=3)
+    finally:
+        geoip_check._current_check.reset(token)
+    assert response.status_code == 200
+    assert response.url == f'{BASE}/hops/0'
+    assert [hop.url for hop in response.history] == [f'{BASE}/hops/3', f'{BASE}/hops/2', f'{BASE}/hops/1']
+    assert trace.counters['redirects'] == 3
+
+
+def test_hop_cap_raises_too_many_redirects(checker):
+    with pytest.raises(requests.exceptions.TooManyRedirects) as info:
+        checker.follow_redirects('GET', f'{BASE}/hops/4', max_hops=3)
+    assert not isinstance(info.value, geoip_http.RedirectLoopError)
+    # safe_request 把重定向错误当作请求失败处理
+    assert checker.safe_request(f'{BASE}/loop') is None
+
+
+def test_stop_returns_the_redirect_without_following_it(checker):
+    seen = []
+
+    def stop(target):
+        seen.append(target)
+        return target.endswith('/hops/1')
+
+    response = checker.follow_redirects('GET', f'{BASE}/hops/3', stop=stop)
+    assert response.status_code == 302
+    assert response.url == f'{BASE}/hops/2'
+    assert response.redirect_target == f'{BASE}/hops/1'
+    assert seen == [f'{BASE}/hops/2', f'{BASE}/hops/1']
+    assert len(response.history) == 1
+
+
+def test_stop_on_a_cross_host_redirect(checker):
+    response = checker.follow_redirects('HEAD', 'https://www.amazon.com/', stop=lambda target: '.co.jp' in target)
+    assert response.status_code == 301
+    assert response.redirect_target == 'https://www.amazon.co.jp/'
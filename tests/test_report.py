@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""文本报告按注册表生成：只在注册表中声明的检查也会输出"""
+
+import geoip_check
+from geoip_check import CheckRegistry, CheckSpec, StatusIs
+
+
+def _report(capsys, registry, results):
+    checker = geoip_check.GeoIPChecker(registry=registry, warm_up=False, dump_every=0)
+    try:
+        checker.print_results(results)
+    finally:
+        checker.close()
+    return capsys.readouterr().out
+
+
+def test_declared_check_is_reported_with_default_formatter(capsys):
+    registry = CheckRegistry(list(geoip_check.CHECK_REGISTRY) + [
+        CheckSpec('Spotify', urls='https://open.spotify.com/', fields={'available': StatusIs(200)},
+                  default={'available': False}),
+    ])
+    out = _report(capsys, registry, {'Spotify': {'available': True, 'circuit_open': True}})
+    assert '14. Spotify [熔断，未实时检测]\nSpotify: Available\n---' in out
+    assert 'circuit_open' not in out
+
+
+def test_custom_formatter_and_failures(capsys):
+    registry = CheckRegistry([
+        CheckSpec('Netflix', method='check_netflix', title='Netflix 国家识别',
+                  report=lambda r: [f"Netflix 地区: {r['region']}"]),
+        CheckSpec('Ping', urls='https://example.com/', fields={'available': StatusIs(200)}),
+        CheckSpec('Slow', urls='https://example.org/', fields={'available': StatusIs(200)}),
+    ])
+    out = _report(capsys, registry, {'Netflix': {'region': 'hk-en'}, 'Ping': None,
+                                     'Slow': {'available': False, 'timed_out': True}})
+    assert out.splitlines()[:2] == ['1. Netflix 国家识别', 'Netflix 地区: hk-en']
+    assert '2. Ping\nPing: 检查失败\n' in out
+    assert '3. Slow\nSlow: 超时\n' in out
+
+
+def test_cached_stale_and_short_circuited_results_are_marked(capsys):
+    registry = CheckRegistry([
+        CheckSpec(name, urls=f'https://{name}.example/', fields={'available': StatusIs(200)})
+        for name in ('Fresh', 'Cached', 'Stale', 'Open')
+    ])
+    out = _report(capsys, registry, {
+        'Fresh': {'available': True},
+        'Cached': {'available': True, 'cached': True},
+        'Stale': {'available': True, 'cached': True, 'stale': True},
+        'Open': {'available': True, 'circuit_open': True, 'stale': True},
+    })
+    lines = out.splitlines()
+    assert '1. Fresh' in lines
+    assert '2. Cached [缓存]' in lines
+    assert '3. Stale [缓存，已过期，后台刷新中]' in lines
+    assert '4. Open [熔断，沿用上次结果]' in lines
+    assert any('--no-cache' in line for line in lines)
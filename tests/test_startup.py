@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""冷启动：在全新解释器中导入 geoip_check 的耗时预算，以及重型依赖不在导入时加载"""
+
+import os
+
+import geoip_bench
+
+# import geoip_check 语句本身的耗时上限（毫秒，取多次的中位数）；较慢的 CI 机器可用环境变量放宽
+IMPORT_BUDGET_MS = float(os.environ.get('GEOIP_IMPORT_BUDGET_MS', 60))
+
+
+def test_import_within_budget_and_heavy_modules_deferred():
+    result = geoip_bench.measure_import(runs=5)
+    assert result['eager_heavy_modules'] == []
+    assert result['import_ms'] <= IMPORT_BUDGET_MS, result
+
+
+def test_lazy_modules_cover_the_heavy_dependencies():
+    assert {'numpy', 'bs4', 'sqlite3', 'asyncio', 'requests', 'geoip_http'} <= set(geoip_bench.LAZY_MODULES)
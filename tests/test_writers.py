@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""ResultWriter：JSON / NDJSON / CSV 输出能原样读回 CheckResult 结果（含超时、缓存结果与非 JSON 类型）"""
+
+import csv
+import datetime
+import io
+import json
+
+import pytest
+
+import geoip_check
+from geoip_check import CheckResult, CSVWriter, JSONWriter, NDJSONWriter
+
+OK = CheckResult.of({'available': True, 'region': 'HK', 'tags': ['a', 'b'], 'detail': {'code': 200}})
+CACHED = CheckResult.of({'country': 'JP', 'location': 'JP', 'cached': True})
+TIMED_OUT = CheckResult.of(geoip_check.CHECK_REGISTRY.get('Netflix').timed_out())
+ROWS = [('Netflix', OK), ('Cloudflare', CACHED), ('YouTube', TIMED_OUT), ('Broken', 'boom')]
+
+
+def write_all(writer_class):
+    out = io.StringIO()
+    writer = writer_class(out)
+    for service, result in ROWS:
+        writer(service, result)
+    writer.close()
+    return out.getvalue()
+
+
+def check_records(records):
+    assert [record['check'] for record in records] == [service for service, _ in ROWS]
+    assert [record['status'] for record in records] == ['ok', 'cached', 'timeout', 'error']
+    # CheckResult（含嵌套的元组与子结果）序列化后与 to_dict() 一致
+    assert [record['result'] for record in records[:3]] == [OK.to_dict(), CACHED.to_dict(), TIMED_OUT.to_dict()]
+    assert records[3]['result'] == 'boom'
+    for record in records:
+        datetime.datetime.fromisoformat(record['ts'])
+        assert record['elapsed'] >= 0
+
+
+def test_json_round_trip():
+    check_records(json.loads(write_all(JSONWriter)))
+
+
+def test_json_without_records_is_an_empty_array():
+    out = io.StringIO()
+    JSONWriter(out).close()
+    assert json.loads(out.getvalue()) == []
+
+
+def test_ndjson_round_trip():
+    text = write_all(NDJSONWriter)
+    assert text.endswith('\n') and text.count('\n') == len(ROWS)
+    check_records([json.loads(line) for line in text.splitlines()])
+
+
+def test_csv_round_trip():
+    rows = list(csv.reader(io.StringIO(write_all(CSVWriter))))
+    assert tuple(rows[0]) == CSVWriter.COLUMNS == (
+        'ts', 'elapsed', 'check', 'status', 'available', 'country', 'region', 'location', 'result')
+    records = [dict(zip(rows[0], row)) for row in rows[1:]]
+    # 常用字段从 CheckResult 中取出独立成列
+    assert [(r['available'], r['country'], r['region'], r['location']) for r in records] == [
+        ('true', '', 'HK', ''), ('', 'JP', '', 'JP'), ('false', 'Unknown', 'Unknown', ''), ('', '', '', '')]
+    for record in records:
+        record['elapsed'] = float(record['elapsed'])
+        record['result'] = json.loads(record['result'])
+    check_records(records)
+
+
+def test_json_default_handles_non_json_types():
+    assert geoip_check._json_default(OK) == OK.to_dict()
+    assert geoip_check._json_default({'a': 1}.items().mapping) == {'a': 1}
+    assert sorted(geoip_check._json_default({'x', 'y'})) == ['x', 'y']
+    assert geoip_check._json_default(frozenset({1})) == [1]
+    assert json.loads(json.dumps({'r': OK, 's': {3}}, default=geoip_check._json_default)) == {
+        'r': OK.to_dict(), 's': [3]}
+    with pytest.raises(TypeError):
+        json.dumps({'when': datetime.datetime(2024, 1, 1)}, default=geoip_check._json_default)